@@ -11,6 +11,11 @@ let pollingInterval = null;
 let chatPollingEnabled = false;
 let videoPollingEnabled = false;
 const cancelledJobIds = new Set();
+let chatDeltaChain = Promise.resolve();
+const HEARTBEAT_INTERVAL_MS = 15000;
+let lastHeartbeat = { jobId: null, at: 0 };
+// Chat sessions whose conversation URL is kept for continuing their next turn
+const MAX_CHAT_SESSIONS = 50;
 let panelOpen = false;
 
 async function initializeRuntimeState() {
@@ -266,7 +271,31 @@ function isImagineUrl(url) {
   return typeof url === 'string' && url.includes('https://grok.com/imagine');
 }
 
-async function getTargetGrokTabForJob(jobType) {
+// Conversation URL to continue a chat session in, if this worker served its previous turn
+async function getChatContinuationUrl(job) {
+  if (!job.session_id || !job.continue_from_job_id) {
+    return null;
+  }
+  const { chatSessions = {} } = await chrome.storage.local.get('chatSessions');
+  const session = chatSessions[job.session_id];
+  return session && session.lastJobId === job.continue_from_job_id ? session.url : null;
+}
+
+async function rememberChatSession(sessionId, jobId, url) {
+  const { chatSessions = {} } = await chrome.storage.local.get('chatSessions');
+  chatSessions[sessionId] = { url, lastJobId: jobId, updatedAt: Date.now() };
+
+  const sessionIds = Object.keys(chatSessions);
+  if (sessionIds.length > MAX_CHAT_SESSIONS) {
+    sessionIds
+      .sort((a, b) => chatSessions[a].updatedAt - chatSessions[b].updatedAt)
+      .slice(0, sessionIds.length - MAX_CHAT_SESSIONS)
+      .forEach(id => delete chatSessions[id]);
+  }
+  await chrome.storage.local.set({ chatSessions });
+}
+
+async function getTargetGrokTabForJob(jobType, chatUrl = null) {
   if (jobType === 'chat') {
     const tabs = await chrome.tabs.query({ url: 'https://grok.com/*' });
     if (tabs.length === 0) {
@@ -274,12 +303,12 @@ async function getTargetGrokTabForJob(jobType) {
     }
 
     const tab = tabs[0];
-    const targetUrl = 'https://grok.com/';
+    const targetUrl = chatUrl || 'https://grok.com/';
     if (tab.url !== targetUrl) {
       await chrome.tabs.update(tab.id, { url: targetUrl });
       const loaded = await waitForTabComplete(tab.id);
       if (!loaded) {
-        throw new Error('Timed out waiting for https://grok.com/ to load.');
+        throw new Error(`Timed out waiting for ${targetUrl} to load.`);
       }
     }
     return tab.id;
@@ -342,6 +371,8 @@ async function pollServer() {
         stats.totalFailed = (stats.totalFailed || 0) + 1;
         await chrome.storage.local.set({ stats });
       } else {
+        // Throttled; tells us if the job was cancelled while we work on it
+        await sendHeartbeat(currentJob.jobId, currentJob.progressStatus);
         return;
       }
     }
@@ -362,27 +393,33 @@ async function pollServer() {
     }
     console.log(`[extension/poll] client=${CLIENT_ID} mode=${job.job_type} job=${job.job_id}`);
 
-    await chrome.storage.local.set({
-      currentJob: {
-        jobId: job.job_id,
-        clientId: job.client_id || CLIENT_ID,
-        prompt: job.prompt,
-        image: job.image,
-        mode: job.job_type || 'video',
-        status: 'processing',
-        startedAt: Date.now(),
-        timeoutSeconds: job.job_type === 'chat' ? CHAT_TIMEOUT_SECONDS : VIDEO_TIMEOUT_SECONDS
-      }
-    });
+    const activeJob = {
+      jobId: job.job_id,
+      clientId: job.client_id || CLIENT_ID,
+      prompt: job.prompt,
+      image: job.image,
+      mode: job.job_type || 'video',
+      status: 'processing',
+      uploadUrl: job.upload_url || null,
+      uploadToken: job.upload_token || null,
+      sessionId: job.session_id || null,
+      startedAt: Date.now(),
+      timeoutSeconds: job.job_type === 'chat' ? CHAT_TIMEOUT_SECONDS : VIDEO_TIMEOUT_SECONDS
+    };
+    await chrome.storage.local.set({ currentJob: activeJob });
+
+    const continuationUrl = job.job_type === 'chat' ? await getChatContinuationUrl(job) : null;
 
     let tabId;
     try {
-      tabId = await getTargetGrokTabForJob(job.job_type || 'video');
+      tabId = await getTargetGrokTabForJob(job.job_type || 'video', continuationUrl);
     } catch (tabError) {
       await reportError(job.job_id, tabError.message);
       await chrome.storage.local.remove('currentJob');
       return;
     }
+    activeJob.tabId = tabId;
+    await chrome.storage.local.set({ currentJob: activeJob });
 
     const isReady = await ensureContentScriptReady(tabId);
     if (!isReady) {
@@ -403,6 +440,7 @@ async function pollServer() {
           job: {
             ...job,
             mode: 'chat',
+            continuation: Boolean(continuationUrl),
             chatConfig
           }
         });
@@ -417,6 +455,7 @@ async function pollServer() {
         });
       }
       console.log('Job sent to content script successfully:', job.job_id, job.job_type);
+      await sendHeartbeat(job.job_id, 'started');
     } catch (error) {
       console.error('Failed to send message to content script:', error);
       await reportError(job.job_id, 'Failed to communicate with Grok tab. Please refresh the page.');
@@ -435,16 +474,27 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
       cancelledJobIds.delete(message.jobId);
       return true;
     }
-    const uint8Array = new Uint8Array(message.videoData);
-    const videoBlob = new Blob([uint8Array], { type: message.videoType });
-    handleVideoJobCompleted(message.jobId, videoBlob);
+    handleVideoJobCompleted(message.jobId);
+  } else if (message.type === 'VIDEO_UPLOAD_INIT' || message.type === 'VIDEO_UPLOAD_CHUNK' || message.type === 'VIDEO_UPLOAD_COMPLETE') {
+    if (cancelledJobIds.has(message.jobId)) {
+      sendResponse({ ok: false, error: 'Job was cancelled' });
+      return true;
+    }
+    handleVideoUploadMessage(message)
+      .then(result => sendResponse({ ok: true, result }))
+      .catch(error => sendResponse({ ok: false, error: error.message }));
   } else if (message.type === 'JOB_CHAT_COMPLETED') {
     if (cancelledJobIds.has(message.jobId)) {
       console.log('Ignoring JOB_CHAT_COMPLETED for cancelled job:', message.jobId);
       cancelledJobIds.delete(message.jobId);
       return true;
     }
-    handleChatJobCompleted(message.jobId, message.content || '');
+    handleChatJobCompleted(message.jobId, message.content || '', message.conversationUrl);
+  } else if (message.type === 'JOB_CHAT_DELTA') {
+    if (!cancelledJobIds.has(message.jobId)) {
+      // Keep deltas in order; each one starts where the previous ended.
+      chatDeltaChain = chatDeltaChain.then(() => reportChatDelta(message.jobId, message.content || '', message.offset));
+    }
   } else if (message.type === 'JOB_FAILED') {
     if (cancelledJobIds.has(message.jobId)) {
       console.log('Ignoring JOB_FAILED for already-cancelled job:', message.jobId);
@@ -478,26 +528,85 @@ chrome.runtime.onMessage.addListener((message, sender, sendResponse) => {
   return true;
 });
 
-async function handleVideoJobCompleted(jobId, videoBlob) {
-  try {
-    if (!videoBlob || videoBlob.size === 0) {
-      throw new Error('Invalid video blob - size is 0');
-    }
+// Relay chunked upload steps from the content script to the server: straight to
+// the upload sink when poll issued a token, otherwise through the API.
+async function handleVideoUploadMessage(message) {
+  const { currentJob } = await chrome.storage.local.get('currentJob');
+  if (currentJob && currentJob.jobId === message.jobId && currentJob.uploadUrl && currentJob.uploadToken) {
+    return handleSinkUploadMessage(message, currentJob.uploadUrl, currentJob.uploadToken);
+  }
 
-    const formData = new FormData();
-    formData.append('job_id', jobId);
-    formData.append('video', videoBlob, `${jobId}.mp4`);
+  const uploadUrl = `${SERVER_URL}/extension/uploads`;
+  let response;
 
-    const response = await fetch(`${SERVER_URL}/extension/complete`, {
+  if (message.type === 'VIDEO_UPLOAD_INIT') {
+    response = await fetch(uploadUrl, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ job_id: message.jobId, size: message.size })
+    });
+  } else if (message.type === 'VIDEO_UPLOAD_CHUNK') {
+    const chunk = await (await fetch(message.dataUrl)).blob();
+    response = await putChunkWithRetry(`${uploadUrl}/${message.jobId}?offset=${message.offset}`, chunk);
+  } else {
+    response = await fetch(`${uploadUrl}/${message.jobId}/complete`, {
       method: 'POST',
-      body: formData
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ sha256: message.sha256 })
     });
+  }
 
-    if (!response.ok) {
-      const errorText = await response.text();
-      throw new Error(`Upload failed: ${response.status} - ${errorText}`);
+  if (!response.ok) {
+    const errorText = await response.text();
+    throw new Error(`${message.type} failed: ${response.status} - ${errorText}`);
+  }
+  return response.json();
+}
+
+// Same chunk protocol against the upload sink, authorized by the signed token.
+async function handleSinkUploadMessage(message, uploadUrl, uploadToken) {
+  const headers = { Authorization: `Bearer ${uploadToken}` };
+  let response;
+
+  if (message.type === 'VIDEO_UPLOAD_INIT') {
+    response = await fetch(`${uploadUrl}?size=${message.size}`, { method: 'POST', headers });
+  } else if (message.type === 'VIDEO_UPLOAD_CHUNK') {
+    const chunk = await (await fetch(message.dataUrl)).blob();
+    response = await putChunkWithRetry(`${uploadUrl}?offset=${message.offset}`, chunk, 3, headers);
+  } else {
+    response = await fetch(`${uploadUrl}/complete?sha256=${message.sha256}`, { method: 'POST', headers });
+  }
+
+  if (!response.ok) {
+    const errorText = await response.text();
+    throw new Error(`${message.type} failed: ${response.status} - ${errorText}`);
+  }
+  return response.json();
+}
+
+async function putChunkWithRetry(url, chunk, maxAttempts = 3, extraHeaders = {}) {
+  let lastError = null;
+  for (let attempt = 1; attempt <= maxAttempts; attempt++) {
+    try {
+      const response = await fetch(url, {
+        method: 'PUT',
+        headers: { 'Content-Type': 'application/octet-stream', ...extraHeaders },
+        body: chunk
+      });
+      if (response.ok || response.status < 500) {
+        return response;
+      }
+      lastError = new Error(`HTTP ${response.status}`);
+    } catch (error) {
+      lastError = error;
     }
+    await new Promise(resolve => setTimeout(resolve, 500 * attempt));
+  }
+  throw lastError;
+}
 
+async function handleVideoJobCompleted(jobId) {
+  try {
     const { stats } = await chrome.storage.local.get('stats');
     stats.totalCompleted = (stats.totalCompleted || 0) + 1;
     await chrome.storage.local.set({ stats });
@@ -521,17 +630,13 @@ async function handleVideoJobCompleted(jobId, videoBlob) {
     await chrome.storage.local.set({ history });
     await chrome.storage.local.remove('currentJob');
   } catch (error) {
-    await reportError(jobId, `Failed to upload video: ${error.message}`);
-
-    const { stats } = await chrome.storage.local.get('stats');
-    stats.totalFailed = (stats.totalFailed || 0) + 1;
-    await chrome.storage.local.set({ stats });
-
+    // The server already has the video; only local bookkeeping failed.
+    console.error('Failed to record completed video job:', error);
     await chrome.storage.local.remove('currentJob');
   }
 }
 
-async function handleChatJobCompleted(jobId, content) {
+async function handleChatJobCompleted(jobId, content, conversationUrl) {
   try {
     const response = await fetch(`${SERVER_URL}/extension/complete/chat`, {
       method: 'POST',
@@ -568,6 +673,9 @@ async function handleChatJobCompleted(jobId, content) {
     }
 
     await chrome.storage.local.set({ history });
+    if (currentJob?.sessionId && conversationUrl) {
+      await rememberChatSession(currentJob.sessionId, jobId, conversationUrl);
+    }
     await chrome.storage.local.remove('currentJob');
   } catch (error) {
     await reportError(jobId, `Failed to complete chat job: ${error.message}`);
@@ -580,6 +688,23 @@ async function handleChatJobCompleted(jobId, content) {
   }
 }
 
+// Deltas are best-effort: the final /extension/complete/chat carries the full text.
+async function reportChatDelta(jobId, content, offset) {
+  try {
+    await fetch(`${SERVER_URL}/extension/chat/delta`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        job_id: jobId,
+        content,
+        offset
+      })
+    });
+  } catch (error) {
+    console.warn('Failed to report chat delta:', error);
+  }
+}
+
 async function handleJobFailed(jobId, error) {
   await reportError(jobId, error);
 
@@ -626,11 +751,61 @@ async function reportError(jobId, error) {
   }
 }
 
+// Tell the server the job is alive; the first heartbeat marks the start of
+// generation in the job's timings. Progress updates are throttled.
+async function sendHeartbeat(jobId, status) {
+  const now = Date.now();
+  if (lastHeartbeat.jobId === jobId && now - lastHeartbeat.at < HEARTBEAT_INTERVAL_MS) {
+    return;
+  }
+  lastHeartbeat = { jobId, at: now };
+  try {
+    const response = await fetch(`${SERVER_URL}/extension/heartbeat`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({
+        job_id: jobId,
+        status: status || null
+      })
+    });
+    if (response.ok) {
+      const data = await response.json();
+      if (data.cancel) {
+        await abortCancelledJob(jobId);
+      }
+    }
+  } catch (error) {
+    console.warn('Failed to send heartbeat:', error);
+  }
+}
+
+// The server cancelled the job (nobody is waiting for it); drop it without reporting an error
+async function abortCancelledJob(jobId) {
+  const { currentJob } = await chrome.storage.local.get('currentJob');
+  if (!currentJob || currentJob.jobId !== jobId) {
+    return;
+  }
+
+  console.log('Job cancelled by server, aborting:', jobId);
+  cancelledJobIds.add(jobId);
+  await chrome.storage.local.remove('currentJob');
+
+  // Reloading the Grok tab stops the content script mid-job
+  if (currentJob.tabId) {
+    try {
+      await chrome.tabs.reload(currentJob.tabId);
+    } catch (error) {
+      console.warn('Failed to reload tab of cancelled job:', error);
+    }
+  }
+}
+
 // Update job status in storage
 async function updateJobStatus(status) {
   const { currentJob } = await chrome.storage.local.get('currentJob');
   if (currentJob) {
     currentJob.progressStatus = status;
     await chrome.storage.local.set({ currentJob });
+    await sendHeartbeat(currentJob.jobId, status);
   }
 }
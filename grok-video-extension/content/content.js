@@ -159,33 +159,16 @@ async function processVideoJob(job) {
       throw new Error('Downloaded video is empty (0 bytes)');
     }
 
-    // 7. Convert blob to Uint8Array for message passing (ArrayBuffer doesn't survive chrome.runtime.sendMessage)
-    console.log('Step 7: Converting blob to Uint8Array...');
-    const videoArrayBuffer = await videoBlob.arrayBuffer();
-    const videoUint8Array = new Uint8Array(videoArrayBuffer);
-    console.log('✓ Converted to Uint8Array');
-    console.log('  - length:', videoUint8Array.length, 'bytes');
-    console.log('  - constructor:', videoUint8Array.constructor.name);
-    console.log('  - first 10 bytes:', Array.from(videoUint8Array.slice(0, 10)));
-
-    // 8. Send to background for upload
-    console.log('Step 8: Sending to background for upload...');
-    console.log('Message payload:');
-    console.log('  - jobId:', job.job_id);
-    console.log('  - videoType:', videoBlob.type || 'video/mp4');
-    console.log('  - videoData length:', videoUint8Array.length);
+    // 7. Upload to server in resumable chunks relayed by background
+    console.log('Step 7: Uploading video in chunks...');
+    updateStatus('Uploading video...');
+    await uploadVideoInChunks(job.job_id, videoBlob);
+    console.log('✓ Video uploaded');
 
+    // 8. Let background record the completed job
     chrome.runtime.sendMessage({
       type: 'JOB_COMPLETED',
-      jobId: job.job_id,
-      videoData: Array.from(videoUint8Array), // Convert to plain array for message passing
-      videoType: videoBlob.type || 'video/mp4'
-    }, (response) => {
-      if (chrome.runtime.lastError) {
-        console.error('Message sending error:', chrome.runtime.lastError);
-      } else {
-        console.log('Message sent successfully, response:', response);
-      }
+      jobId: job.job_id
     });
 
     updateStatus('Completed!');
@@ -206,6 +189,70 @@ async function processVideoJob(job) {
   }
 }
 
+// Upload video via /extension/uploads: init (returns missing ranges), chunks in
+// parallel, then finalize with SHA-256. A failed pass resumes with only the
+// ranges the server is still missing.
+const VIDEO_UPLOAD_PARALLELISM = 3;
+const VIDEO_UPLOAD_MAX_PASSES = 3;
+
+async function uploadVideoInChunks(jobId, videoBlob) {
+  const sha256 = await sha256Hex(videoBlob);
+  console.log('  - size:', videoBlob.size, 'bytes, sha256:', sha256);
+
+  let lastError = null;
+  for (let pass = 1; pass <= VIDEO_UPLOAD_MAX_PASSES; pass++) {
+    try {
+      const status = await sendRuntimeRequest({ type: 'VIDEO_UPLOAD_INIT', jobId, size: videoBlob.size });
+      const chunks = splitRangesIntoChunks(status.missing, status.chunk_size);
+      console.log(`Upload pass ${pass}: ${chunks.length} chunk(s) to send`);
+
+      let next = 0;
+      const sendNextChunks = async () => {
+        while (next < chunks.length) {
+          const [start, end] = chunks[next++];
+          const dataUrl = await blobToDataUrl(videoBlob.slice(start, end));
+          await sendRuntimeRequest({ type: 'VIDEO_UPLOAD_CHUNK', jobId, offset: start, dataUrl });
+          updateStatus(`Uploading video... ${Math.round((end / videoBlob.size) * 100)}%`);
+        }
+      };
+      await Promise.all(Array.from({ length: VIDEO_UPLOAD_PARALLELISM }, sendNextChunks));
+
+      await sendRuntimeRequest({ type: 'VIDEO_UPLOAD_COMPLETE', jobId, sha256 });
+      return;
+    } catch (error) {
+      lastError = error;
+      console.warn(`Upload pass ${pass} failed:`, error.message);
+      await sleep(1000 * pass);
+    }
+  }
+
+  throw new Error(`Video upload failed: ${lastError?.message || 'unknown error'}`);
+}
+
+function splitRangesIntoChunks(ranges, chunkSize) {
+  const chunks = [];
+  for (const [start, end] of ranges) {
+    for (let offset = start; offset < end; offset += chunkSize) {
+      chunks.push([offset, Math.min(offset + chunkSize, end)]);
+    }
+  }
+  return chunks;
+}
+
+async function sha256Hex(blob) {
+  const digest = await crypto.subtle.digest('SHA-256', await blob.arrayBuffer());
+  return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+// Send a request to background and unwrap its { ok, error } response
+async function sendRuntimeRequest(message) {
+  const response = await chrome.runtime.sendMessage(message);
+  if (!response || !response.ok) {
+    throw new Error(response?.error || `No response for ${message.type}`);
+  }
+  return response.result;
+}
+
 // Find prompt input textarea
 async function findVideoPromptInput(maxAttempts = 10) {
   console.log('Searching for prompt input...');
@@ -319,6 +366,13 @@ async function insertTextFast(element, text) {
   await sleep(200);
 }
 
+const IMAGE_FILE_EXTENSIONS = {
+  'image/png': 'png',
+  'image/jpeg': 'jpg',
+  'image/webp': 'webp',
+  'image/gif': 'gif'
+};
+
 // Upload image to Grok (from original extension)
 async function uploadImageToGrok(base64Image) {
   await waitForDocumentComplete();
@@ -347,8 +401,10 @@ async function uploadImageToGrok(base64Image) {
   // Convert base64 to blob
   const blob = await base64ToBlob(base64Image);
 
-  // Create File object
-  const file = new File([blob], 'image.png', { type: 'image/png' });
+  // Create File object; the server re-encodes images, so keep the MIME type it chose
+  const type = blob.type || 'image/png';
+  const extension = IMAGE_FILE_EXTENSIONS[type] || 'png';
+  const file = new File([blob], `image.${extension}`, { type });
 
   // Create DataTransfer
   const dataTransfer = new DataTransfer();
@@ -832,18 +888,25 @@ async function processChatJob(job) {
     updateStatus('Initializing chat...');
     await sleep(500);
 
-    updateStatus('Navigating to grok.com...');
-    await ensureOnGrokChatHome();
+    // Continuing a session: the background already opened the previous turn's
+    // conversation, so only the newest turn is sent.
+    if (job.continuation) {
+      updateStatus('Continuing conversation...');
+      console.log('Continuing conversation at', window.location.href);
+    } else {
+      updateStatus('Navigating to grok.com...');
+      await ensureOnGrokChatHome();
+    }
     await waitForDocumentComplete();
 
     updateStatus('Waiting for attach button...');
     const attachButton = await findAttachButton(30);
     if (!attachButton) {
-      throw new Error('Attach button not found on https://grok.com/');
+      throw new Error(`Attach button not found on ${window.location.href}`);
     }
     console.log('✓ Attach button detected on chat page');
 
-    const { images, contextText } = await extractChatInputsFromRequest(job.request);
+    const { images, contextText } = await extractChatInputsFromRequest(job.request, Boolean(job.continuation));
     console.log(`Extracted ${images.length} image(s) from request`);
     console.log('Context text length:', contextText.length);
 
@@ -881,7 +944,8 @@ async function processChatJob(job) {
 
     updateStatus('Waiting for model response to finish...');
     await waitForDocumentComplete();
-    const modelFinished = await waitForStopModelResponseInactive();
+    const onProgress = job.request?.stream ? createChatDeltaReporter(job.job_id) : null;
+    const modelFinished = await waitForStopModelResponseInactive(240, onProgress);
     if (!modelFinished) {
       throw new Error('Model response did not finish in time');
     }
@@ -902,7 +966,8 @@ async function processChatJob(job) {
     chrome.runtime.sendMessage({
       type: 'JOB_CHAT_COMPLETED',
       jobId: job.job_id,
-      content: responseText
+      content: responseText,
+      conversationUrl: window.location.href
     });
 
     updateStatus('Completed!');
@@ -930,7 +995,7 @@ async function ensureOnGrokChatHome() {
   throw new Error(`Not on ${targetUrl}. Current URL: ${currentUrl}`);
 }
 
-async function extractChatInputsFromRequest(request) {
+async function extractChatInputsFromRequest(request, newestTurnOnly = false) {
   const result = {
     images: [],
     contextText: ''
@@ -943,7 +1008,14 @@ async function extractChatInputsFromRequest(request) {
   const textParts = [];
   const imageEntries = [];
 
-  for (const message of request.messages) {
+  // Earlier turns are already in the open conversation; keep what follows the last assistant reply
+  let messages = request.messages;
+  if (newestTurnOnly) {
+    const lastAssistant = messages.map(message => message && message.role).lastIndexOf('assistant');
+    messages = messages.slice(lastAssistant + 1);
+  }
+
+  for (const message of messages) {
     if (!message || message.role !== 'user') {
       continue;
     }
@@ -1104,11 +1176,35 @@ async function waitForChatResponseMarkdownText(maxAttempts = 120) {
   return '';
 }
 
-async function waitForStopModelResponseInactive(maxAttempts = 240) {
+// Forward newly rendered response text to background as streaming deltas.
+// Only append-only growth is reported; rewrites are settled by the final completion.
+function createChatDeltaReporter(jobId) {
+  let sentText = '';
+
+  return (text) => {
+    if (!text || text.length <= sentText.length || !text.startsWith(sentText)) {
+      return;
+    }
+
+    chrome.runtime.sendMessage({
+      type: 'JOB_CHAT_DELTA',
+      jobId: jobId,
+      content: text.slice(sentText.length),
+      offset: sentText.length
+    });
+    sentText = text;
+  };
+}
+
+async function waitForStopModelResponseInactive(maxAttempts = 240, onProgress = null) {
   console.log('Waiting for "Stop model response" button to become inactive...');
   await waitForDocumentComplete();
 
   for (let i = 0; i < maxAttempts; i++) {
+    if (onProgress) {
+      onProgress(extractLatestChatResponseMarkdownText());
+    }
+
     const stopButtons = Array.from(document.querySelectorAll('button[aria-label="Stop model response"]'));
     const activeStopButton = stopButtons.find(btn => btn.offsetParent !== null && !btn.disabled);
 
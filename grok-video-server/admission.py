@@ -0,0 +1,147 @@
+import asyncio
+import math
+import time
+from typing import Dict, Tuple
+
+from fastapi import HTTPException, Request
+
+from models import JobType
+from job_queue import job_queue
+import config
+
+
+class TokenBucketLimiter:
+    """Per-client token buckets kept in process memory; each check is O(1)"""
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self, rate_per_minute: float = None, burst: int = None):
+        rate_per_minute = config.RATE_LIMIT_PER_MINUTE if rate_per_minute is None else rate_per_minute
+        self.rate = rate_per_minute / 60.0
+        self.burst = max(1, config.RATE_LIMIT_BURST if burst is None else burst)
+        # client key -> (tokens, last refill monotonic time)
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def acquire(self, key: str) -> float:
+        """Take one token; returns 0 if allowed, otherwise seconds until a token is available"""
+        if self.rate <= 0:
+            return 0.0
+
+        now = time.monotonic()
+        tokens, last = self._buckets.get(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+
+        if tokens >= 1.0:
+            if key not in self._buckets and len(self._buckets) >= self.MAX_BUCKETS:
+                self._evict_idle(now)
+            self._buckets[key] = (tokens - 1.0, now)
+            return 0.0
+
+        self._buckets[key] = (tokens, now)
+        return (1.0 - tokens) / self.rate
+
+    def _evict_idle(self, now: float):
+        """Drop buckets that have refilled completely; they carry no state"""
+        full_after = self.burst / self.rate
+        self._buckets = {
+            key: (tokens, last) for key, (tokens, last) in self._buckets.items()
+            if now - last < full_after
+        }
+
+
+class AdmissionController:
+    """
+    Rejects submissions with 429 when a client exceeds its rate or the queue for
+    a job type is deeper than the worker fleet can drain.
+
+    Queue depth and drain rate come from a cached snapshot of the jobs table that
+    is refreshed at most every QUEUE_STATS_REFRESH_SECONDS, so checks stay O(1)
+    and reflect jobs created or finished by other server processes.
+    """
+
+    def __init__(self, queue, limiter: TokenBucketLimiter = None):
+        self.queue = queue
+        self._limiter = limiter
+        self._stats: Dict[str, Tuple[int, int]] = {}
+        self._stats_at = 0.0
+        self._refresh_lock = asyncio.Lock()
+
+    @property
+    def limiter(self) -> TokenBucketLimiter:
+        # Built on first use so settings are not read at import
+        if self._limiter is None:
+            self._limiter = TokenBucketLimiter()
+        return self._limiter
+
+    @property
+    def max_pending(self) -> Dict[str, int]:
+        return {
+            JobType.VIDEO.value: config.MAX_PENDING_VIDEO_JOBS,
+            JobType.CHAT.value: config.MAX_PENDING_CHAT_JOBS,
+        }
+
+    @staticmethod
+    def client_key(request: Request) -> str:
+        """
+        Identify caller by client IP. API key headers are not verified by this
+        server, so a caller could dodge its bucket by sending a new one each time.
+        """
+        host = request.client.host if request.client else "unknown"
+        return f"ip:{host}"
+
+    async def _refresh_stats(self):
+        if time.monotonic() - self._stats_at < config.QUEUE_STATS_REFRESH_SECONDS:
+            return
+        async with self._refresh_lock:
+            if time.monotonic() - self._stats_at < config.QUEUE_STATS_REFRESH_SECONDS:
+                return
+            since = int(time.time()) - config.DRAIN_RATE_WINDOW_SECONDS
+            self._stats = await self.queue.get_queue_stats(finished_since=since)
+            self._stats_at = time.monotonic()
+
+    def note_enqueued(self, job_type: str):
+        """Count a job created by this process before the next snapshot refresh"""
+        pending, finished = self._stats.get(job_type, (0, 0))
+        self._stats[job_type] = (pending + 1, finished)
+
+    def drain_rate(self, job_type: str) -> float:
+        """Finished jobs per second over the drain window"""
+        _, finished = self._stats.get(job_type, (0, 0))
+        return finished / config.DRAIN_RATE_WINDOW_SECONDS
+
+    def _retry_after_for_queue(self, job_type: str, pending: int, limit: int) -> int:
+        timeout = config.CHAT_JOB_TIMEOUT_SECONDS if job_type == JobType.CHAT.value else config.JOB_TIMEOUT_SECONDS
+        rate = self.drain_rate(job_type)
+        if rate <= 0:
+            # No recent completions: back off for a full job timeout.
+            return timeout
+        seconds = math.ceil((pending - limit + 1) / rate)
+        return max(1, min(seconds, timeout))
+
+    async def admit(self, request: Request, job_type: str):
+        """Raise HTTP 429 with Retry-After if the submission must be rejected"""
+        wait_seconds = self.limiter.acquire(self.client_key(request))
+        if wait_seconds > 0:
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded",
+                headers={"Retry-After": str(max(1, math.ceil(wait_seconds)))}
+            )
+
+        limit = self.max_pending.get(job_type, 0)
+        if limit <= 0:
+            return
+
+        await self._refresh_stats()
+        pending, _ = self._stats.get(job_type, (0, 0))
+        if pending >= limit:
+            retry_after = self._retry_after_for_queue(job_type, pending, limit)
+            raise HTTPException(
+                status_code=429,
+                detail=f"Too many pending {job_type} jobs ({pending}/{limit}), try again later",
+                headers={"Retry-After": str(retry_after)}
+            )
+
+
+# Global admission controller instance
+admission = AdmissionController(job_queue)
@@ -0,0 +1,1173 @@
+#!/usr/bin/env python3
+"""
+Benchmarks and stress checks for the Grok Imagine API server internals
+
+Usage:
+    python benchmark.py claims [--processes 8] [--jobs 400]
+    python benchmark.py broker [--processes 4] [--messages 50] [--redis-url redis://localhost:6379/0]
+    python benchmark.py list-jobs [--rows 10000] [--repeat 5]
+    python benchmark.py faststart [--size-mb 32] [--chunks 2000]
+    python benchmark.py postprocess [--videos 10] [--size-mb 2] [--workers 2]
+    python benchmark.py schema [--rows 200000] [--pending 200] [--repeat 200]
+    python benchmark.py startup [--runs 5]
+    python benchmark.py json-extract [--kib 256]
+    python benchmark.py writes [--bursts 1,8,64] [--jobs 512]
+    python benchmark.py claim-index [--rows 200000] [--pending 5000] [--claims 1000]
+    python benchmark.py dedup [--videos 20] [--copies 5] [--size-mb 4]
+    python benchmark.py webhooks [--jobs 50]
+"""
+
+import argparse
+import asyncio
+import hashlib
+import hmac
+import http.server
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import shutil
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+from collections import Counter
+from contextlib import AsyncExitStack
+
+import aiosqlite
+
+import config
+import mp4
+from broker import create_broker
+from job_queue import JobQueue, JOB_COLUMNS, status_code, job_type_code
+from migrations import migrate, LATEST_VERSION
+from models import JobStatus, JobType
+from structured_output import extract_first_json_object
+
+
+def _claim_worker(db_path: str, client_id: str, start_event, results):
+    """Poll-and-claim loop run in a separate process, like one uvicorn worker"""
+    async def run():
+        queue = JobQueue(db_path=db_path)
+        claimed = []
+        start_event.wait()
+        while True:
+            job = await queue.claim_next_pending_job(job_type=JobType.VIDEO.value, client_id=client_id)
+            if job is None:
+                break
+            claimed.append(job.job_id)
+        return claimed
+
+    results.put((client_id, asyncio.run(run())))
+
+
+def bench_claims(processes: int, jobs: int) -> bool:
+    """Claim jobs concurrently from several processes and verify nothing is claimed twice"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'jobs.db')
+        queue = JobQueue(db_path=db_path)
+
+        async def setup():
+            await queue.init_db()
+            for i in range(jobs):
+                await queue.create_job(prompt=f"stress job {i}")
+
+        asyncio.run(setup())
+
+        ctx = multiprocessing.get_context('spawn')
+        start_event = ctx.Event()
+        results = ctx.Queue()
+        workers = [
+            ctx.Process(target=_claim_worker, args=(db_path, f"W{i:04d}", start_event, results))
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+
+        start = time.perf_counter()
+        start_event.set()
+        per_client = dict(results.get() for _ in workers)
+        elapsed = time.perf_counter() - start
+        for worker in workers:
+            worker.join()
+
+    counts = Counter(job_id for claimed in per_client.values() for job_id in claimed)
+    duplicates = [job_id for job_id, count in counts.items() if count > 1]
+
+    print(f"Processes: {processes}, jobs: {jobs}")
+    for client_id, claimed in sorted(per_client.items()):
+        print(f"  {client_id}: {len(claimed)} claims")
+    print(f"Claimed {len(counts)}/{jobs} jobs in {elapsed:.2f}s ({jobs / elapsed:.0f} claims/s)")
+
+    if duplicates:
+        print(f"✗ {len(duplicates)} jobs claimed more than once: {duplicates[:5]}")
+        return False
+    if len(counts) != jobs:
+        print(f"✗ {jobs - len(counts)} jobs were never claimed")
+        return False
+    print("✓ No double claims")
+    return True
+
+
+def _broker_worker(url: str, prefix: str, channels: list, increments: int, start_event, results):
+    """Publish to each channel and bump the shared counter from a separate process"""
+    async def run():
+        worker_broker = create_broker(url, shared=True)
+        await worker_broker.init()
+        start_event.wait()
+        for channel in channels:
+            await worker_broker.publish(channel, str(time.time()))
+        for _ in range(increments):
+            await worker_broker.incr(f"{prefix}:counter", 1, 60)
+        await worker_broker.close()
+
+    asyncio.run(run())
+    results.put(len(channels))
+
+
+async def _check_broker(label: str, url: str, shared: bool, processes: int, messages: int) -> bool:
+    """
+    Deliver messages published by `processes` other processes (or tasks, when 0),
+    then check a message published before `wait` is kept and counters add up and expire
+    """
+    prefix = f"bench:{os.getpid()}:{time.time_ns()}"
+    channels = [f"{prefix}:{i}" for i in range(messages)]
+    increments = 20
+    ok = True
+
+    test_broker = create_broker(url, shared=shared)
+    await test_broker.init()
+    other = create_broker(url, shared=shared) if shared else test_broker
+    if other is not test_broker:
+        await other.init()
+
+    async def receive(subscription):
+        message = await subscription.wait(10.0)
+        return message, time.time()
+
+    async with AsyncExitStack() as stack:
+        subscriptions = [await stack.enter_async_context(test_broker.listen(c)) for c in channels]
+        workers = []
+        if processes:
+            ctx = multiprocessing.get_context('spawn')
+            start_event = ctx.Event()
+            results = ctx.Queue()
+            workers = [
+                ctx.Process(target=_broker_worker,
+                            args=(url, prefix, channels[i::processes], increments, start_event, results))
+                for i in range(processes)
+            ]
+            for worker in workers:
+                worker.start()
+            start_event.set()
+        else:
+            async def publish_all():
+                for channel in channels:
+                    await test_broker.publish(channel, str(time.time()))
+                await asyncio.gather(*(test_broker.incr(f"{prefix}:counter", 1, 60)
+                                       for _ in range(increments)))
+
+            publisher = asyncio.create_task(publish_all())
+        received = await asyncio.gather(*(receive(s) for s in subscriptions))
+        if processes:
+            for _ in workers:
+                results.get(timeout=60)
+            for worker in workers:
+                worker.join()
+        else:
+            await publisher
+
+    latencies = sorted(at - float(message) for message, at in received if message is not None)
+    print(f"{label}:")
+    if latencies:
+        print(f"  delivered  {len(latencies)}/{messages}, latency median "
+              f"{statistics.median(latencies) * 1000:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+    if len(latencies) != messages:
+        print(f"✗ {messages - len(latencies)} messages were never delivered")
+        ok = False
+
+    # Published between subscribing and waiting: must not be lost
+    async with test_broker.listen(f"{prefix}:early") as subscription:
+        await other.publish(f"{prefix}:early", "early")
+        await asyncio.sleep(0.2)
+        early = await subscription.wait(5.0)
+    if early != "early":
+        print("✗ A message published before wait() was lost")
+        ok = False
+
+    expected = increments * max(processes, 1)
+    total = await other.incr(f"{prefix}:counter", 0, 60)
+    drained = await test_broker.incr(f"{prefix}:counter", -total, 60)
+    await test_broker.incr(f"{prefix}:expiring", 1, 1)
+    await asyncio.sleep(2.1)
+    expired = await other.incr(f"{prefix}:expiring", 0, 60)
+    print(f"  counter    {total}/{expected} after concurrent increments, {drained} after draining, "
+          f"{expired} after expiry")
+    if total != expected or drained != 0 or expired != 0:
+        print("✗ Counter is inconsistent")
+        ok = False
+
+    if other is not test_broker:
+        await other.close()
+    await test_broker.close()
+    return ok
+
+
+def bench_broker(processes: int, messages: int, redis_url: str = None) -> bool:
+    """Message delivery and counters of the SQLite broker, in process and shared, and of Redis if given"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        url = f"sqlite:///{os.path.join(tmp_dir, 'jobs.db')}"
+        ok = asyncio.run(_check_broker("SQLite, one process", url, False, 0, messages))
+        ok = asyncio.run(_check_broker(f"SQLite, {processes} publishing processes", url, True,
+                                       processes, messages)) and ok
+
+    if redis_url:
+        try:
+            ok = asyncio.run(_check_broker(f"Redis, {processes} publishing processes", redis_url, True,
+                                           processes, messages)) and ok
+        except Exception as e:
+            print(f"✗ Redis check failed: {type(e).__name__}: {e}")
+            ok = False
+    else:
+        print("Redis: skipped (pass --redis-url redis://localhost:6379/0 to check it)")
+
+    print("✓ Every message delivered, counters consistent" if ok else "✗ Broker check failed")
+    return ok
+
+
+class _DictJob:
+    """Previous Job layout: per-instance __dict__, built field by field from aiosqlite.Row"""
+
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+
+async def _legacy_list_jobs(db_path: str, limit: int):
+    async with aiosqlite.connect(db_path) as db:
+        db.row_factory = aiosqlite.Row
+        async with db.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)) as cursor:
+            rows = await cursor.fetchall()
+            return [_DictJob(
+                job_id=row['job_id'],
+                prompt=row['prompt'],
+                image=row['image'],
+                status=row['status'],
+                job_type=row['job_type'],
+                client_id=row['client_id'],
+                request_payload=row['request_payload'],
+                text_response=row['text_response'],
+                created_at=row['created_at'],
+                completed_at=row['completed_at'],
+                video_path=row['video_path'],
+                error=row['error']
+            ) for row in rows]
+
+
+def _measure(label: str, fetch, repeat: int):
+    """Best-of-N wall time and peak traced memory of one listing"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        asyncio.run(fetch())
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    jobs = asyncio.run(fetch())
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"  {label:<28} {best * 1000:8.1f} ms  {peak / 1024 / 1024:7.2f} MiB peak  ({len(jobs)} rows)")
+    return best, peak
+
+
+def bench_list_jobs(rows: int, repeat: int) -> bool:
+    """Compare list_jobs against the old aiosqlite.Row + __dict__ Job construction"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'jobs.db')
+        queue = JobQueue(db_path=db_path)
+        asyncio.run(queue.init_db())
+
+        now = int(time.time())
+        with sqlite3.connect(db_path) as conn:
+            conn.executemany("""
+                INSERT INTO jobs (job_id, prompt, image, status, job_type, client_id,
+                                  request_payload, created_at, completed_at, video_path)
+                VALUES (?, ?, NULL, ?, ?, ?, ?, ?, ?, ?)
+            """, [
+                (f"job_{i:012x}", f"benchmark prompt number {i}", status_code(JobStatus.COMPLETED),
+                 job_type_code(JobType.CHAT if i % 2 else JobType.VIDEO), "BENCH",
+                 '{"model": "grok-vision", "messages": [{"role": "user", "content": "hi"}]}' if i % 2 else None,
+                 now - i, now, None if i % 2 else f"./videos/job_{i:012x}.mp4")
+                for i in range(rows)
+            ])
+
+        print(f"list_jobs(limit={rows}), best of {repeat}:")
+        old_time, old_peak = _measure("aiosqlite.Row + __dict__", lambda: _legacy_list_jobs(db_path, rows), repeat)
+        new_time, new_peak = _measure("row factory + NamedTuple", lambda: queue.list_jobs(limit=rows), repeat)
+
+    print(f"Speedup: {old_time / new_time:.2f}x, memory: {new_peak / old_peak:.0%} of before")
+    return True
+
+
+def _fill_jobs_v1(db_path: str, rows: int, pending: int):
+    """Schema version 1 (TEXT enums) with mostly finished jobs and a small pending backlog"""
+    async def create():
+        async with aiosqlite.connect(db_path) as db:
+            await db.execute("PRAGMA journal_mode=WAL")
+            await migrate(db, target=1)
+
+    asyncio.run(create())
+    now = int(time.time())
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany("""
+            INSERT INTO jobs (job_id, prompt, status, job_type, client_id, created_at, completed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [
+            (f"job_{i:012x}", f"benchmark prompt number {i}",
+             JobStatus.PENDING.value if i >= rows - pending else
+             (JobStatus.FAILED.value if i % 10 == 0 else JobStatus.COMPLETED.value),
+             JobType.CHAT.value if i % 3 == 0 else JobType.VIDEO.value, "BENCH",
+             now - rows + i, None if i >= rows - pending else now - rows + i + 30)
+            for i in range(rows)
+        ])
+
+
+def _time_query(conn: sqlite3.Connection, sql: str, params: tuple, repeat: int) -> float:
+    """Mean seconds per execution"""
+    conn.execute(sql, params).fetchall()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        conn.execute(sql, params).fetchall()
+    return (time.perf_counter() - start) / repeat
+
+
+def _query_plan(conn: sqlite3.Connection, sql: str, params: tuple) -> str:
+    return "; ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def bench_schema(rows: int, pending: int, repeat: int) -> bool:
+    """Hot queries on the version 1 schema, then again after migrating to the latest version"""
+    # Only columns version 1 has, so the same claim runs on both schemas
+    v1_select = ", ".join(JOB_COLUMNS[:JOB_COLUMNS.index('postprocessed_at') + 1])
+    claim_sql = f"SELECT {v1_select} FROM jobs WHERE status = {{pending}} AND job_type = ? ORDER BY created_at ASC LIMIT 1"
+    count_sql = "SELECT job_type, COUNT(*) FROM jobs WHERE status = {pending} GROUP BY job_type"
+    stale_sql = "SELECT COUNT(*) FROM jobs WHERE status = {processing} AND job_type = ? AND created_at < ?"
+
+    def run(conn, label, pending_literal, video, processing):
+        claim = claim_sql.format(pending=pending_literal)
+        count = count_sql.format(pending=pending_literal)
+        stale = stale_sql.format(processing=processing)
+        results = {
+            "claim": _time_query(conn, claim, (video,), repeat),
+            "pending counts": _time_query(conn, count, (), repeat),
+            "stale scan": _time_query(conn, stale, (video, int(time.time())), repeat),
+        }
+        conn.execute("VACUUM")
+        size = conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+        print(f"{label}:")
+        for name, seconds in results.items():
+            print(f"  {name:<16} {seconds * 1e6:9.1f} µs")
+        print(f"  {'database size':<16} {size / 1024 / 1024:9.2f} MiB")
+        print(f"  claim plan: {_query_plan(conn, claim, (video,))}")
+        return results, size
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'jobs.db')
+        _fill_jobs_v1(db_path, rows, pending)
+        print(f"{rows} jobs, {pending} pending, mean of {repeat} runs\n")
+
+        with sqlite3.connect(db_path) as conn:
+            before, before_size = run(conn, "Version 1 (TEXT enums)", "'pending'",
+                                      JobType.VIDEO.value, "'processing'")
+
+        async def upgrade():
+            async with aiosqlite.connect(db_path) as db:
+                start = time.perf_counter()
+                await migrate(db)
+                return time.perf_counter() - start
+
+        print(f"\nMigrated to version {LATEST_VERSION} in {asyncio.run(upgrade()):.2f}s\n")
+
+        with sqlite3.connect(db_path) as conn:
+            after, after_size = run(conn, f"Version {LATEST_VERSION} (integer enums)", str(status_code(JobStatus.PENDING)),
+                                    job_type_code(JobType.VIDEO), str(status_code(JobStatus.PROCESSING)))
+            migrated = conn.execute("SELECT COUNT(*) FROM jobs").fetchone()[0]
+
+    print()
+    for name in before:
+        print(f"  {name:<16} {before[name] / after[name]:6.2f}x faster")
+    print(f"  {'database size':<16} {after_size / before_size:6.0%} of before")
+
+    if migrated != rows:
+        print(f"✗ {rows - migrated} rows lost in migration")
+        return False
+    print("✓ All rows migrated")
+    return True
+
+
+def _box(box_type: bytes, payload: bytes, version: int = None) -> bytes:
+    if version is not None:
+        payload = bytes([version, 0, 0, 0]) + payload
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _write_test_mp4(path: str, size: int, chunks: int) -> list:
+    """
+    Write a structurally valid MP4 with moov after mdat (as most encoders do) and
+    one 1280x720 avc1 video track; returns the chunk payload markers
+    """
+    chunk_size = max(16, size // chunks)
+    markers = [f"chunk{i:010d}".encode() for i in range(chunks)]
+    ftyp = _box(b"ftyp", b"isom\x00\x00\x02\x00isomavc1")
+    mdat_offset = len(ftyp)
+    offsets = [mdat_offset + 8 + i * chunk_size for i in range(chunks)]
+
+    mvhd = _box(b"mvhd", struct.pack(">IIII", 0, 0, 1000, 6040) + bytes(80), version=0)
+    tkhd = _box(b"tkhd", struct.pack(">IIIII", 0, 0, 1, 0, 6040) + bytes(52) +
+                struct.pack(">II", 1280 << 16, 720 << 16), version=0)
+    hdlr = _box(b"hdlr", bytes(4) + b"vide" + bytes(12) + b"Video\x00", version=0)
+    stsd = _box(b"stsd", struct.pack(">I", 1) + _box(b"avc1", bytes(78)), version=0)
+    stco = _box(b"stco", struct.pack(f">I{chunks}I", chunks, *offsets), version=0)
+    minf = _box(b"minf", _box(b"stbl", stsd + stco))
+    mdia = _box(b"mdia", _box(b"mdhd", bytes(20), version=0) + hdlr + minf)
+    moov = _box(b"moov", mvhd + _box(b"trak", tkhd + mdia))
+
+    with open(path, "wb") as f:
+        f.write(ftyp)
+        f.write(struct.pack(">I4s", 8 + chunks * chunk_size, b"mdat"))
+        for marker in markers:
+            f.write(marker.ljust(chunk_size, b"\x00"))
+        f.write(moov)
+    return markers
+
+
+def _read_chunks(path: str, length: int) -> list:
+    """The first `length` bytes at every chunk offset the file's stco lists"""
+    moov, _, _ = mp4.read_moov(path)
+    stco = moov.index(b"stco") - 4
+    count = struct.unpack(">I", moov[stco + 12:stco + 16])[0]
+    offsets = struct.unpack(f">{count}I", moov[stco + 16:stco + 16 + 4 * count])
+    with open(path, "rb") as f:
+        found = []
+        for offset in offsets:
+            f.seek(offset)
+            found.append(f.read(length))
+    return found
+
+
+def bench_faststart(size_mb: int, chunks: int) -> bool:
+    """Probe and faststart-remux a synthetic MP4, then verify every chunk offset"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, 'video.mp4')
+        markers = _write_test_mp4(path, size_mb * 1024 * 1024, chunks)
+
+        start = time.perf_counter()
+        info = mp4.probe(path)
+        probe_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        changed = mp4.faststart_in_place(path, tmp_dir)
+        remux_time = time.perf_counter() - start
+
+        ok = changed and mp4.is_faststart(path) and _read_chunks(path, len(markers[0])) == markers
+
+    print(f"File: {size_mb} MiB, {chunks} chunks")
+    print(f"  probe      {probe_time * 1000:8.1f} ms  {info}")
+    print(f"  faststart  {remux_time * 1000:8.1f} ms")
+    print("✓ moov moved before mdat, all chunk offsets valid" if ok else "✗ Remuxed file is inconsistent")
+    return ok
+
+
+def bench_postprocess(videos: int, size_mb: int, workers: int) -> bool:
+    """
+    Run the post-processing pool over completed jobs: half finished before it starts
+    (as after a restart), half submitted while it runs, each video stored twice, plus
+    one file that is not an MP4; checks metadata, remux, sharing and job status
+    """
+    from postprocess import VideoPostProcessor
+    from storage import VideoStorage
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = os.path.join(tmp_dir, 'source.mp4')
+        markers = _write_test_mp4(source, size_mb * 1024 * 1024, 200)
+        with open(source, 'rb') as f:
+            template = f.read()
+        marker = template.index(markers[0])
+        contents = []
+        for i in range(videos):
+            data = bytearray(template)
+            data[marker:marker + len(markers[0])] = f"video{i:010d}".encode()
+            contents.append(bytes(data))
+
+        queue = JobQueue(db_path=os.path.join(tmp_dir, 'jobs.db'))
+        video_storage = VideoStorage(os.path.join(tmp_dir, 'videos'))
+        processor = VideoPostProcessor(queue, video_storage, workers=workers, max_queued=4 * videos + 1)
+
+        async def chunks(data: bytes):
+            yield data
+
+        async def complete(data: bytes, submit: bool) -> str:
+            job = await queue.create_job(prompt="post-processing check")
+            video = await video_storage.save_video_stream(job.job_id, chunks(data))
+            await queue.update_job_status(job.job_id, JobStatus.COMPLETED, video_path=video.path,
+                                          video_sha256=video.sha256)
+            if submit:
+                processor.submit(job.job_id, video.path)
+            return job.job_id
+
+        async def run():
+            await queue.init_db()
+            expected = {}
+            for copy in range(2):
+                for i, data in enumerate(contents):
+                    expected[await complete(data, submit=False)] = i
+            broken = await complete(b"not an mp4 " * 1000, submit=False)
+            await processor.start()
+            start = time.perf_counter()
+            for copy in range(2):
+                for i, data in enumerate(contents):
+                    expected[await complete(data, submit=True)] = i
+
+            while await queue.list_unprocessed_videos() and time.perf_counter() - start < 60:
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - start
+            await processor.stop()
+            jobs = {job_id: await queue.get_job(job_id) for job_id in [*expected, broken]}
+            await queue.close()
+            return expected, broken, jobs, elapsed
+
+        expected, broken, jobs, elapsed = asyncio.run(run())
+
+        ok = True
+        for job_id, i in expected.items():
+            job = jobs[job_id]
+            problems = []
+            if job.status != JobStatus.COMPLETED or job.postprocessed_at is None:
+                problems.append(f"status {job.status}, postprocessed_at {job.postprocessed_at}")
+            elif (job.duration, job.width, job.height, job.video_codec) != (6.04, 1280, 720, "avc1"):
+                problems.append(f"metadata {(job.duration, job.width, job.height, job.video_codec)}")
+            elif not mp4.is_faststart(job.video_path):
+                problems.append("not faststart")
+            elif _read_chunks(job.video_path, len(markers[0])) != [f"video{i:010d}".encode(), *markers[1:]]:
+                problems.append("chunk offsets do not match the remuxed file")
+            if processor.ffmpeg is None and (job.thumbnail_path or job.preview_path):
+                problems.append("thumbnail or preview recorded without ffmpeg")
+            for path in (job.thumbnail_path, job.preview_path):
+                if path and not os.path.exists(path):
+                    problems.append(f"{path} missing")
+            if problems:
+                print(f"✗ {job_id}: {', '.join(problems)}")
+                ok = False
+
+        for i in range(videos):
+            inodes = {os.stat(jobs[job_id].video_path).st_ino for job_id, j in expected.items() if j == i}
+            if len(inodes) != 1:
+                print(f"✗ Copies of video {i} do not share one remuxed file")
+                ok = False
+
+        job = jobs[broken]
+        if job.status != JobStatus.COMPLETED or job.postprocessed_at is None or job.duration is not None:
+            print(f"✗ Non-MP4 job: status {job.status}, postprocessed_at {job.postprocessed_at}, "
+                  f"duration {job.duration}")
+            ok = False
+
+    print(f"Jobs: {len(expected)} ({videos} videos x 4 copies) + 1 non-MP4, {size_mb} MiB each, {workers} workers")
+    print(f"  processed  {elapsed * 1000:8.1f} ms")
+    print(f"  ffmpeg     {processor.ffmpeg or 'not found (thumbnails and previews skipped)'}")
+    print("✓ Metadata stored, videos remuxed and shared, jobs stay completed" if ok
+          else "✗ Post-processing check failed")
+    return ok
+
+
+def _disk_usage(root: str) -> int:
+    """Bytes allocated under root, counting each inode once (like du)"""
+    seen, total = set(), 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            st = os.stat(os.path.join(directory, name))
+            if (st.st_dev, st.st_ino) not in seen:
+                seen.add((st.st_dev, st.st_ino))
+                total += st.st_blocks * 512
+    return total
+
+
+def bench_dedup(videos: int, copies: int, size_mb: int) -> bool:
+    """
+    Store each of `videos` distinct MP4s `copies` times, remux them as post-processing
+    does, then age out half; checks content, sharing and reference-aware eviction
+    """
+    from storage import VideoStorage
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        source = os.path.join(tmp_dir, 'source.mp4')
+        _write_test_mp4(source, size_mb * 1024 * 1024, 200)
+        with open(source, 'rb') as f:
+            template = f.read()
+        marker = template.index(b"chunk0000000000")
+        contents = []
+        for i in range(videos):
+            data = bytearray(template)
+            data[marker:marker + 15] = f"video{i:010d}".encode()
+            contents.append(bytes(data))
+
+        video_dir = os.path.join(tmp_dir, 'videos')
+        storage = VideoStorage(video_dir)
+
+        async def chunks(data: bytes):
+            for offset in range(0, len(data), 1024 * 1024):
+                yield data[offset:offset + 1024 * 1024]
+
+        async def store_all():
+            stored = {}
+            for copy in range(copies):
+                for i, data in enumerate(contents):
+                    job_id = f"job_{i}_{copy}"
+                    stored[job_id] = (i, await storage.save_video_stream(job_id, chunks(data)))
+            return stored
+
+        start = time.perf_counter()
+        stored = asyncio.run(store_all())
+        store_time = time.perf_counter() - start
+        logical = sum(video.size for _, video in stored.values())
+        stored_usage = _disk_usage(video_dir)
+
+        ok = True
+        for job_id, (i, video) in stored.items():
+            with open(video.path, 'rb') as f:
+                if f.read() != contents[i]:
+                    print(f"✗ {job_id} does not hold the video it uploaded")
+                    ok = False
+        duplicates = sum(video.duplicate for _, video in stored.values())
+        if duplicates != videos * (copies - 1):
+            print(f"✗ {duplicates} uploads detected as duplicates, expected {videos * (copies - 1)}")
+            ok = False
+
+        async def remux_all():
+            for job_id, (_, video) in stored.items():
+                await storage.faststart(job_id, video.sha256)
+
+        start = time.perf_counter()
+        asyncio.run(remux_all())
+        remux_time = time.perf_counter() - start
+        remuxed_usage = _disk_usage(video_dir)
+        for i in range(videos):
+            inodes = {os.stat(video.path).st_ino for j, video in stored.values() if j == i}
+            if len(inodes) != 1 or not mp4.is_faststart(stored[f"job_{i}_0"][1].path):
+                print(f"✗ Copies of video {i} are not one faststart file")
+                ok = False
+        stats = storage.stats()
+
+        # Age out the even-numbered videos; only their blobs may go
+        old = time.time() - 30 * 86400
+        for job_id, (i, video) in stored.items():
+            if i % 2 == 0:
+                os.utime(video.path, (old, old))
+        asyncio.run(storage.cleanup_old_videos(7))
+        for job_id, (i, video) in stored.items():
+            expected = i % 2 == 1
+            if os.path.exists(video.path) != expected or os.path.exists(storage.blob_path(video.sha256)) != expected:
+                print(f"✗ {job_id} {'evicted' if expected else 'kept'} unexpectedly")
+                ok = False
+                break
+
+    print(f"Videos: {videos} distinct x {copies} copies of {size_mb} MiB")
+    print(f"  store      {store_time * 1000:8.1f} ms  {logical / store_time / 1e6:.0f} MB/s")
+    print(f"  remux      {remux_time * 1000:8.1f} ms")
+    print(f"  logical    {logical / 1e6:8.1f} MB")
+    print(f"  on disk    {stored_usage / 1e6:8.1f} MB stored, {remuxed_usage / 1e6:.1f} MB after remux")
+    print(f"  stats      {stats}")
+    print("✓ One file per distinct video, eviction follows references" if ok else "✗ Deduplication check failed")
+    return ok
+
+
+_IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import server
+elapsed = time.perf_counter() - start
+import config
+print(elapsed, config._settings is None)
+"""
+
+
+def _startup_env(tmp_dir: str) -> dict:
+    env = dict(os.environ)
+    env.update({
+        'DB_PATH': os.path.join(tmp_dir, 'jobs.db'),
+        'VIDEO_STORAGE_PATH': os.path.join(tmp_dir, 'videos'),
+        'LOG_PATH': os.path.join(tmp_dir, 'logs'),
+    })
+    return env
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _time_to_first_request(env: dict, timeout: float = 30.0) -> float:
+    """Seconds from spawning uvicorn until /health first answers 200"""
+    port = _free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'server:app', '--host', '127.0.0.1', '--port', str(port)],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/health', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.005)
+        raise RuntimeError(f'Server did not answer within {timeout}s')
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def bench_startup(runs: int) -> bool:
+    """Import cost of the server module and time until the first request is served, in fresh processes"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    import_times, first_request_times = [], []
+    side_effects = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            env = _startup_env(tmp_dir)
+            output = subprocess.run(
+                [sys.executable, '-c', _IMPORT_SCRIPT],
+                env=env, cwd=here, capture_output=True, text=True, check=True
+            ).stdout.split()
+            import_times.append(float(output[0]))
+            # Importing must neither load settings nor touch the filesystem
+            if output[1] != 'True' or os.listdir(tmp_dir):
+                side_effects.append(sorted(os.listdir(tmp_dir)))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            first_request_times.append(_time_to_first_request(dict(_startup_env(tmp_dir), PYTHONPATH=here)))
+
+    print(f"Runs: {runs}")
+    print(f"  import server     median {statistics.median(import_times) * 1000:8.1f} ms  "
+          f"min {min(import_times) * 1000:8.1f} ms")
+    print(f"  first /health 200 median {statistics.median(first_request_times) * 1000:8.1f} ms  "
+          f"min {min(first_request_times) * 1000:8.1f} ms")
+    if side_effects:
+        print(f"✗ Import had side effects: {side_effects[0]}")
+        return False
+    print("✓ Import loaded no settings and created no files")
+    return True
+
+
+def _legacy_extract_first_json_object(text: str):
+    """Pre-rewrite extractor: decodes a copy of the text from every '{'"""
+    decoder = json.JSONDecoder()
+    for i, ch in enumerate(text):
+        if ch != '{':
+            continue
+        try:
+            parsed, end = decoder.raw_decode(text[i:])
+            if isinstance(parsed, dict):
+                return text[i:i + end]
+        except json.JSONDecodeError:
+            continue
+    return None
+
+
+def bench_json_extract(kib: int) -> bool:
+    """Extract the JSON answer from the end of a long reply full of non-JSON braces"""
+    answer = '{"title": "a {braced} \\"quoted\\" title", "items": [{"id": 1}, {"id": 2}]}'
+    filler = "Use {placeholders} like {name} in templates; set {x: 1} and it's {done}. "
+    text = filler * (kib * 1024 // len(filler)) + "Result: " + answer + " {trailing"
+
+    results = {}
+    for label, extract in (("legacy", _legacy_extract_first_json_object), ("linear", extract_first_json_object)):
+        start = time.perf_counter()
+        results[label] = extract(text)
+        print(f"  {label:7s} {(time.perf_counter() - start) * 1000:9.1f} ms")
+
+    print(f"Text: {len(text)} chars, {text.count('{')} braces")
+    ok = results["linear"] == results["legacy"] == answer
+    print("✓ Both extractors return the embedded object" if ok else f"✗ Extractors disagree: {results}")
+    return ok
+
+
+async def _write_burst(queue: JobQueue, burst: int, jobs: int) -> float:
+    """Create and complete `jobs` jobs, `burst` at a time; returns writes per second"""
+    start = time.perf_counter()
+    for offset in range(0, jobs, burst):
+        created = await asyncio.gather(*(queue.create_job(prompt=f"write job {offset + i}")
+                                         for i in range(min(burst, jobs - offset))))
+        await asyncio.gather(*(queue.update_job_status(job.job_id, JobStatus.COMPLETED,
+                                                       video_path=f"./videos/{job.job_id}.mp4")
+                               for job in created))
+    return 2 * jobs / (time.perf_counter() - start)
+
+
+def bench_writes(bursts: list, jobs: int) -> bool:
+    """Write throughput by burst size with a commit per write and with group commit"""
+    default_max_ops = config.WRITE_BATCH_MAX_OPS
+    results = {}
+    for label, max_ops in (("commit per write", 1), ("group commit", default_max_ops)):
+        config.WRITE_BATCH_MAX_OPS = max_ops
+        for burst in bursts:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                queue = JobQueue(db_path=os.path.join(tmp_dir, 'jobs.db'))
+
+                async def run():
+                    await queue.init_db()
+                    rate = await _write_burst(queue, burst, jobs)
+                    stats = queue.writer.stats()
+                    completed = await queue.list_jobs(status=JobStatus.COMPLETED.value, limit=jobs)
+                    await queue.close()
+                    return rate, stats, len(completed)
+
+                rate, stats, completed = asyncio.run(run())
+            results[label, burst] = rate
+            print(f"  {label:16s} burst {burst:4d}: {rate:8.0f} writes/s, "
+                  f"mean batch {stats['mean_batch']}, {completed}/{jobs} completed")
+            if completed != jobs:
+                print(f"✗ {jobs - completed} jobs were not completed")
+                return False
+    config.WRITE_BATCH_MAX_OPS = default_max_ops
+
+    largest = max(bursts)
+    print(f"Burst {largest} speedup: {results['group commit', largest] / results['commit per write', largest]:.1f}x")
+    return True
+
+
+async def _legacy_claim(db: aiosqlite.Connection, job_type: JobType, client_id: str):
+    """Previous claim path: pick the next pending row with SQL, then claim it"""
+    if job_type == JobType.CHAT:
+        order = "preferred_client_id = ? DESC, created_at ASC"
+        params = (job_type_code(job_type), 0, client_id)
+    else:
+        order = "created_at ASC"
+        params = (job_type_code(job_type), 0)
+    async with db.execute(f"""
+        SELECT job_id FROM jobs
+        WHERE status = {status_code(JobStatus.PENDING)} AND job_type = ?
+          AND (deadline_ms IS NULL OR deadline_ms >= ?)
+        ORDER BY {order}
+        LIMIT 1
+    """, params) as cursor:
+        row = await cursor.fetchone()
+    if row is None:
+        return None
+    now_ms = int(time.time() * 1000)
+    await db.execute(f"""
+        UPDATE jobs SET status = {status_code(JobStatus.PROCESSING)}, client_id = ?, updated_at = ?, claimed_ms = ?
+        WHERE job_id = ? AND status = {status_code(JobStatus.PENDING)}
+    """, (client_id, now_ms, now_ms, row[0]))
+    return row[0]
+
+
+def bench_claim_index(rows: int, pending: int, claims: int) -> bool:
+    """Claims picked by SQL against claims picked from the in-memory pending index"""
+    ok = True
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'jobs.db')
+        _fill_jobs_v1(db_path, rows, pending)
+
+        async def upgrade():
+            async with aiosqlite.connect(db_path) as db:
+                await migrate(db)
+
+        asyncio.run(upgrade())
+        print(f"{rows} jobs, {pending} pending, {claims} claims per type, one commit each")
+
+        for job_type in (JobType.VIDEO, JobType.CHAT):
+            sql_path = os.path.join(tmp_dir, f'{job_type.value}-sql.db')
+            index_path = os.path.join(tmp_dir, f'{job_type.value}-index.db')
+            shutil.copy(db_path, sql_path)
+            shutil.copy(db_path, index_path)
+
+            async def claim_all(path: str, use_index: bool):
+                queue = JobQueue(db_path=path)
+                await queue.init_db()
+                start = time.perf_counter()
+                claimed = []
+                for _ in range(claims):
+                    if use_index:
+                        job = await queue.claim_next_pending_job(job_type.value, "BENCH")
+                        job_id = job.job_id if job else None
+                    else:
+                        job_id = await queue.writer.submit(lambda db: _legacy_claim(db, job_type, "BENCH"))
+                    if job_id is None:
+                        break
+                    claimed.append(job_id)
+                elapsed = time.perf_counter() - start
+                await queue.close()
+                return claimed, elapsed / max(len(claimed), 1)
+
+            sql_claimed, sql_time = asyncio.run(claim_all(sql_path, False))
+            index_claimed, index_time = asyncio.run(claim_all(index_path, True))
+
+            print(f"\n{job_type.value} ({len(sql_claimed)} claimed):")
+            print(f"  {'SQL pick':<14} {sql_time * 1e6:9.1f} µs/claim")
+            print(f"  {'pending index':<14} {index_time * 1e6:9.1f} µs/claim")
+            print(f"  {'speedup':<14} {sql_time / index_time:9.2f}x")
+            if sorted(sql_claimed) != sorted(index_claimed):
+                print("✗ The index claimed different jobs than SQL")
+                ok = False
+
+    if ok:
+        print("\n✓ Both claimed the same jobs")
+    return ok
+
+
+# Receiver behaviours of the webhook stand-in: statuses answered to attempts 1, 2, ...
+# (the last repeats), the attempts expected and whether the delivery ends delivered
+_WEBHOOK_RECEIVERS = {
+    "/ok": ([200], 1, True),
+    "/flaky": ([503, 502, 200], 3, True),
+    "/throttled": ([429, 200], 2, True),
+    "/down": ([500], None, False),
+    "/gone": ([410], 1, False),
+}
+
+
+def _start_webhook_receiver():
+    """Local HTTP stand-in recording every request; returns (server, requests, connections)"""
+    requests, connections = [], []
+    lock = threading.Lock()
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with lock:
+                connections.append(self.client_address)
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"]))
+            attempt = int(self.headers["X-Webhook-Attempt"])
+            statuses = _WEBHOOK_RECEIVERS[self.path][0]
+            status = statuses[min(attempt, len(statuses)) - 1]
+            with lock:
+                requests.append((self.path, dict(self.headers), body))
+            self.send_response(status)
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, requests, connections
+
+
+def bench_webhooks(jobs: int) -> bool:
+    """
+    Deliver completion webhooks to a local stand-in that accepts, fails transiently,
+    throttles, keeps failing or rejects; half the jobs finish before a restart.
+    Checks attempts, outcomes, bodies and signatures of every delivery.
+    """
+    from webhooks import WebhookDispatcher
+
+    overrides = {
+        "WEBHOOK_MAX_ATTEMPTS": 4,
+        "WEBHOOK_RETRY_BASE_SECONDS": 0.05,
+        "WEBHOOK_RETRY_MAX_SECONDS": 0.2,
+        "WEBHOOK_POLL_INTERVAL_SECONDS": 0.05,
+        "WEBHOOK_SECRET": "benchmark-secret",
+    }
+    defaults = {name: getattr(config, name) for name in overrides}
+    for name, value in overrides.items():
+        setattr(config, name, value)
+    server, requests, connections = _start_webhook_receiver()
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, 'jobs.db')
+
+        async def finish(queue: JobQueue, count: int, expected: dict):
+            for i in range(count):
+                path = list(_WEBHOOK_RECEIVERS)[i % len(_WEBHOOK_RECEIVERS)]
+                job = await queue.create_job(prompt=f"webhook job {i}", callback_url=base + path)
+                if i % 3 == 2:
+                    await queue.update_job_status(job.job_id, JobStatus.FAILED, error="benchmark failure")
+                    # A second terminal update must not queue a second delivery
+                    await queue.update_job_status(job.job_id, JobStatus.FAILED, error="benchmark failure")
+                else:
+                    await queue.update_job_status(job.job_id, JobStatus.COMPLETED,
+                                                  video_path=f"./videos/{job.job_id}.mp4")
+                expected[job.job_id] = (path, JobStatus.FAILED if i % 3 == 2 else JobStatus.COMPLETED)
+            # Jobs without a callback_url are never delivered
+            job = await queue.create_job(prompt="no webhook")
+            await queue.update_job_status(job.job_id, JobStatus.COMPLETED, video_path="./videos/none.mp4")
+
+        async def run():
+            expected = {}
+            # Finished while no dispatcher runs, then the process "restarts"
+            queue = JobQueue(db_path=db_path)
+            await queue.init_db()
+            await finish(queue, jobs // 2, expected)
+            await queue.close()
+
+            queue = JobQueue(db_path=db_path)
+            await queue.init_db()
+            dispatcher = WebhookDispatcher(queue)
+            await dispatcher.start()
+            start = time.perf_counter()
+            await finish(queue, jobs - jobs // 2, expected)
+            while (await queue.get_webhook_backlog())[0] and time.perf_counter() - start < 60:
+                await asyncio.sleep(0.05)
+            elapsed = time.perf_counter() - start
+            stats = await dispatcher.stats()
+            await dispatcher.stop()
+            await queue.close()
+            return expected, stats, elapsed
+
+        try:
+            expected, stats, elapsed = asyncio.run(run())
+        finally:
+            server.shutdown()
+            server.server_close()
+            for name, value in defaults.items():
+                setattr(config, name, value)
+
+        with sqlite3.connect(db_path) as conn:
+            outbox = {row[0]: row[1:] for row in conn.execute("""
+                SELECT job_id, id, attempts, delivered_ms, failed_ms, last_status FROM webhook_outbox
+            """)}
+
+    ok = True
+    by_job = {}
+    for path, headers, body in requests:
+        payload = json.loads(body)
+        by_job.setdefault(payload["id"], []).append((path, headers, payload))
+        signed = f"{headers['X-Webhook-Timestamp']}.".encode() + body
+        signature = "sha256=" + hmac.new(b"benchmark-secret", signed, hashlib.sha256).hexdigest()
+        if not hmac.compare_digest(signature, headers["X-Webhook-Signature"]):
+            print(f"✗ Bad signature on delivery {headers['X-Webhook-Id']}")
+            ok = False
+
+    if set(by_job) != set(expected) or set(outbox) != set(expected):
+        print(f"✗ Deliveries for {len(by_job)} jobs and {len(outbox)} outbox rows, expected {len(expected)}")
+        ok = False
+    for job_id, (path, status) in expected.items():
+        _, attempts, delivered = _WEBHOOK_RECEIVERS[path]
+        attempts = attempts or overrides["WEBHOOK_MAX_ATTEMPTS"]
+        received = by_job.get(job_id, [])
+        row = outbox.get(job_id)
+        problems = []
+        if [int(headers["X-Webhook-Attempt"]) for _, headers, _ in received] != list(range(1, attempts + 1)):
+            problems.append(f"{len(received)} attempts, expected {attempts}")
+        if {headers["X-Webhook-Id"] for _, headers, _ in received} != {str(row[0]) if row else None}:
+            problems.append("X-Webhook-Id not stable across attempts")
+        if any(p != path or payload["status"] != status for p, _, payload in received):
+            problems.append("wrong URL or status in body")
+        if row is None or (row[2] is not None) != delivered or (row[3] is not None) == delivered:
+            problems.append(f"outbox row {row}")
+        if problems:
+            print(f"✗ {job_id} ({path}): {', '.join(problems)}")
+            ok = False
+
+    print(f"Jobs: {len(expected)} with callbacks, half finished before a restart")
+    print(f"  delivered  {len(requests)} requests over {len(connections)} connections in {elapsed * 1000:.0f} ms")
+    print(f"  outcomes   {stats}")
+    print("✓ Every webhook delivered or abandoned as its receiver dictated" if ok else "✗ Webhook check failed")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    claims = subparsers.add_parser('claims', help='Multi-process claim race check')
+    claims.add_argument('--processes', type=int, default=8)
+    claims.add_argument('--jobs', type=int, default=400)
+
+    broker = subparsers.add_parser('broker', help='Broker delivery and counters across processes')
+    broker.add_argument('--processes', type=int, default=4)
+    broker.add_argument('--messages', type=int, default=50)
+    broker.add_argument('--redis-url', help='Also check a Redis broker, e.g. redis://localhost:6379/0')
+
+    list_jobs = subparsers.add_parser('list-jobs', help='list_jobs time and memory per row')
+    list_jobs.add_argument('--rows', type=int, default=10000)
+    list_jobs.add_argument('--repeat', type=int, default=5)
+
+    faststart = subparsers.add_parser('faststart', help='MP4 probe and faststart remux check')
+    faststart.add_argument('--size-mb', type=int, default=32)
+    faststart.add_argument('--chunks', type=int, default=2000)
+
+    postprocess = subparsers.add_parser('postprocess', help='Post-processing pool over completed video jobs')
+    postprocess.add_argument('--videos', type=int, default=10)
+    postprocess.add_argument('--size-mb', type=int, default=2)
+    postprocess.add_argument('--workers', type=int, default=2)
+
+    schema = subparsers.add_parser('schema', help='Hot query timings before/after schema migration')
+    schema.add_argument('--rows', type=int, default=200000)
+    schema.add_argument('--pending', type=int, default=200)
+    schema.add_argument('--repeat', type=int, default=200)
+
+    startup = subparsers.add_parser('startup', help='Import time and time to first served request')
+    startup.add_argument('--runs', type=int, default=5)
+
+    json_extract = subparsers.add_parser('json-extract', help='JSON extraction from long brace-heavy replies')
+    json_extract.add_argument('--kib', type=int, default=256)
+
+    writes = subparsers.add_parser('writes', help='Job write throughput with and without group commit')
+    writes.add_argument('--bursts', default='1,8,64', help='Comma-separated concurrent writes per burst')
+    writes.add_argument('--jobs', type=int, default=512)
+
+    claim_index = subparsers.add_parser('claim-index', help='Claims from SQL against the in-memory pending index')
+    claim_index.add_argument('--rows', type=int, default=200000)
+    claim_index.add_argument('--pending', type=int, default=5000)
+    claim_index.add_argument('--claims', type=int, default=1000)
+
+    dedup = subparsers.add_parser('dedup', help='Content-hash deduplication of stored videos')
+    dedup.add_argument('--videos', type=int, default=20)
+    dedup.add_argument('--copies', type=int, default=5)
+    dedup.add_argument('--size-mb', type=int, default=4)
+
+    webhooks = subparsers.add_parser('webhooks', help='Webhook outbox delivery and retries against a local receiver')
+    webhooks.add_argument('--jobs', type=int, default=50)
+
+    args = parser.parse_args()
+
+    if args.command == 'claims':
+        ok = bench_claims(args.processes, args.jobs)
+    elif args.command == 'broker':
+        ok = bench_broker(args.processes, args.messages, args.redis_url)
+    elif args.command == 'list-jobs':
+        ok = bench_list_jobs(args.rows, args.repeat)
+    elif args.command == 'faststart':
+        ok = bench_faststart(args.size_mb, args.chunks)
+    elif args.command == 'postprocess':
+        ok = bench_postprocess(args.videos, args.size_mb, args.workers)
+    elif args.command == 'schema':
+        ok = bench_schema(args.rows, args.pending, args.repeat)
+    elif args.command == 'startup':
+        ok = bench_startup(args.runs)
+    elif args.command == 'json-extract':
+        ok = bench_json_extract(args.kib)
+    elif args.command == 'writes':
+        ok = bench_writes([int(burst) for burst in args.bursts.split(',')], args.jobs)
+    elif args.command == 'claim-index':
+        ok = bench_claim_index(args.rows, args.pending, args.claims)
+    elif args.command == 'dedup':
+        ok = bench_dedup(args.videos, args.copies, args.size_mb)
+    elif args.command == 'webhooks':
+        ok = bench_webhooks(args.jobs)
+    else:
+        ok = False
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
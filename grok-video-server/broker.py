@@ -0,0 +1,319 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, Dict, Optional, Set, Tuple
+
+import aiosqlite
+import config
+from group_commit import GroupCommitWriter
+from migrations import migrate
+
+
+class Subscription:
+    """Messages on one channel published since the subscription was opened"""
+
+    async def wait(self, timeout: float) -> Optional[str]:
+        """Wait for the next message; returns None on timeout"""
+        raise NotImplementedError
+
+
+class Broker:
+    """
+    Cross-process coordination for job notifications, completion waits and counters.
+
+    Messages are wake-up hints only: SQLite stays the source of truth, so callers
+    always re-read job state after `wait` returns (or times out). To check state
+    and then wait without missing a message published in between, check inside
+    `listen`.
+    """
+
+    async def init(self):
+        """Prepare backing storage"""
+
+    async def close(self):
+        """Release connections"""
+
+    async def publish(self, channel: str, message: str = ""):
+        raise NotImplementedError
+
+    def listen(self, channel: str) -> AsyncContextManager[Subscription]:
+        """Subscribe to channel for the duration of an async with block"""
+        raise NotImplementedError
+
+    async def wait(self, channel: str, timeout: float) -> Optional[str]:
+        """Wait for the next message on channel; returns None on timeout"""
+        async with self.listen(channel) as subscription:
+            return await subscription.wait(timeout)
+
+    async def incr(self, key: str, delta: int, ttl_seconds: float) -> int:
+        """
+        Add delta to a counter shared by all server processes and return its new value
+
+        A counter not changed for ttl_seconds counts from 0 again, so increments
+        left behind by a process that died expire.
+        """
+        raise NotImplementedError
+
+
+class SQLiteBroker(Broker):
+    """
+    Default broker. Within one process, waiters are woken directly. When other
+    processes share the jobs database (SERVER_WORKERS above 1, or a separate
+    upload sink), messages also go through its broker_events table, which they
+    poll; that works across processes on one host.
+    """
+
+    EVENT_RETENTION_SECONDS = 60
+
+    def __init__(self, db_path: str = None, poll_interval: float = None, shared: bool = None):
+        self.db_path = db_path or config.DB_PATH
+        self.poll_interval = poll_interval if poll_interval is not None else config.BROKER_POLL_INTERVAL_SECONDS
+        self.shared = shared if shared is not None else config.SERVER_WORKERS > 1 or bool(config.UPLOAD_SINK_URL)
+        self._local_waiters: Dict[str, Set[asyncio.Future]] = {}
+        # key -> (value, expires_at) while not shared
+        self._counters: Dict[str, Tuple[int, float]] = {}
+        self._last_prune = 0.0
+        # Events published together (e.g. a burst of submissions) share one commit
+        self.writer = GroupCommitWriter(self._connect)
+
+    def _connect(self):
+        return aiosqlite.connect(self.db_path, timeout=config.DB_BUSY_TIMEOUT_SECONDS)
+
+    async def init(self):
+        if self.shared:
+            # broker_events is part of the jobs schema; this also covers a separate broker file
+            async with self._connect() as db:
+                await migrate(db)
+
+    async def close(self):
+        await self.writer.close()
+
+    async def publish(self, channel: str, message: str = ""):
+        if self.shared:
+            await self._insert_event(channel, message)
+
+        for waiter in self._local_waiters.pop(channel, set()):
+            if not waiter.done():
+                waiter.set_result(message)
+
+    async def _insert_event(self, channel: str, message: str):
+        now = time.time()
+        prune = now - self._last_prune > self.EVENT_RETENTION_SECONDS
+        if prune:
+            self._last_prune = now
+
+        async def insert(db):
+            await db.execute("""
+                INSERT INTO broker_events (channel, message, created_at) VALUES (?, ?, ?)
+            """, (channel, message, now))
+            if prune:
+                await db.execute("""
+                    DELETE FROM broker_events WHERE created_at < ?
+                """, (now - self.EVENT_RETENTION_SECONDS,))
+                await db.execute("DELETE FROM broker_counters WHERE expires_at < ?", (now,))
+
+        await self.writer.submit(insert)
+
+    @asynccontextmanager
+    async def listen(self, channel: str):
+        waiter = asyncio.get_running_loop().create_future()
+        self._local_waiters.setdefault(channel, set()).add(waiter)
+
+        try:
+            if not self.shared:
+                yield _SQLiteSubscription(None, channel, waiter, 0, self.poll_interval)
+                return
+            async with self._connect() as db:
+                async with db.execute("""
+                    SELECT COALESCE(MAX(id), 0) FROM broker_events
+                """) as cursor:
+                    last_id = (await cursor.fetchone())[0]
+                yield _SQLiteSubscription(db, channel, waiter, last_id, self.poll_interval)
+        finally:
+            waiters = self._local_waiters.get(channel)
+            if waiters is not None:
+                waiters.discard(waiter)
+                if not waiters:
+                    self._local_waiters.pop(channel, None)
+            if not waiter.done():
+                waiter.cancel()
+
+    async def incr(self, key: str, delta: int, ttl_seconds: float) -> int:
+        now = time.time()
+        if not self.shared:
+            value, expires_at = self._counters.get(key, (0, now))
+            value = (value if expires_at > now else 0) + delta
+            if value > 0:
+                self._counters[key] = (value, now + ttl_seconds)
+            else:
+                self._counters.pop(key, None)
+            return value
+
+        async def add(db):
+            async with db.execute("""
+                INSERT INTO broker_counters (key, value, expires_at) VALUES (?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    value = CASE WHEN expires_at > ? THEN value ELSE 0 END + excluded.value,
+                    expires_at = excluded.expires_at
+                RETURNING value
+            """, (key, delta, now + ttl_seconds, now)) as cursor:
+                value = (await cursor.fetchone())[0]
+            if value <= 0:
+                await db.execute("DELETE FROM broker_counters WHERE key = ?", (key,))
+            return value
+
+        return await self.writer.submit(add)
+
+
+class _SQLiteSubscription(Subscription):
+    """Woken directly by publishers in this process; polls broker_events for the others, if shared"""
+
+    def __init__(self, db: Optional[aiosqlite.Connection], channel: str, waiter: asyncio.Future,
+                 last_id: int, poll_interval: float):
+        self.db = db
+        self.channel = channel
+        self.waiter = waiter
+        self.last_id = last_id
+        self.poll_interval = poll_interval
+
+    async def wait(self, timeout: float) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                return await asyncio.wait_for(asyncio.shield(self.waiter),
+                                              min(self.poll_interval, remaining) if self.db else remaining)
+            except asyncio.TimeoutError:
+                if self.db is None:
+                    return None
+
+            # Pick up messages published by other processes.
+            async with self.db.execute("""
+                SELECT message FROM broker_events
+                WHERE channel = ? AND id > ?
+                ORDER BY id ASC
+                LIMIT 1
+            """, (self.channel, self.last_id)) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                return row[0]
+
+
+class _RedisSubscription(Subscription):
+    def __init__(self, pubsub):
+        self.pubsub = pubsub
+
+    async def wait(self, timeout: float) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            message = await self.pubsub.get_message(ignore_subscribe_messages=True, timeout=remaining)
+            if message is not None:
+                return message["data"]
+
+
+class RedisBroker(Broker):
+    """Redis pub/sub broker for deployments spanning several hosts"""
+
+    KEY_PREFIX = "grok:"
+
+    def __init__(self, url: str):
+        # Imported here so deployments without Redis never pay for loading it
+        try:
+            import redis.asyncio as aioredis
+        except ImportError:  # Redis support is optional
+            raise RuntimeError("BROKER_URL points at Redis but the 'redis' package is not installed")
+        self._aioredis = aioredis
+        self.url = url
+        self._redis = None
+
+    async def init(self):
+        self._redis = self._aioredis.from_url(self.url, decode_responses=True)
+        await self._redis.ping()
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+    async def publish(self, channel: str, message: str = ""):
+        await self._redis.publish(self.KEY_PREFIX + channel, message)
+
+    @asynccontextmanager
+    async def listen(self, channel: str):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.KEY_PREFIX + channel)
+        try:
+            # Read the confirmation: from then on every publish reaches this subscriber
+            await pubsub.get_message(timeout=1.0)
+            yield _RedisSubscription(pubsub)
+        finally:
+            await pubsub.unsubscribe()
+            await pubsub.close()
+
+    async def incr(self, key: str, delta: int, ttl_seconds: float) -> int:
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.incrby(self.KEY_PREFIX + key, delta)
+            pipe.expire(self.KEY_PREFIX + key, max(1, int(ttl_seconds)))
+            value, _ = await pipe.execute()
+        if value <= 0:
+            await self._redis.delete(self.KEY_PREFIX + key)
+        return value
+
+
+def create_broker(url: str = None, shared: bool = None) -> Broker:
+    """
+    Build broker from BROKER_URL (empty or sqlite → SQLiteBroker, redis:// → RedisBroker)
+
+    shared forces whether a SQLite broker reaches other processes (default: from settings).
+    """
+    url = config.BROKER_URL if url is None else url
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisBroker(url)
+    if url.startswith("sqlite:///"):
+        return SQLiteBroker(db_path=url[len("sqlite:///"):], shared=shared)
+    return SQLiteBroker(shared=shared)
+
+
+class LazyBroker(Broker):
+    """Creates the configured broker on first use, so importing this module reads no settings"""
+
+    def __init__(self):
+        self._broker: Optional[Broker] = None
+        # Set before first use to override whether the broker reaches other processes
+        self.shared: Optional[bool] = None
+
+    @property
+    def backend(self) -> Broker:
+        if self._broker is None:
+            self._broker = create_broker(shared=self.shared)
+        return self._broker
+
+    async def init(self):
+        await self.backend.init()
+
+    async def close(self):
+        if self._broker is not None:
+            await self._broker.close()
+
+    async def publish(self, channel: str, message: str = ""):
+        await self.backend.publish(channel, message)
+
+    def listen(self, channel: str) -> AsyncContextManager[Subscription]:
+        return self.backend.listen(channel)
+
+    async def wait(self, channel: str, timeout: float) -> Optional[str]:
+        return await self.backend.wait(channel, timeout)
+
+    async def incr(self, key: str, delta: int, ttl_seconds: float) -> int:
+        return await self.backend.incr(key, delta, ttl_seconds)
+
+
+# Global broker instance
+broker = LazyBroker()
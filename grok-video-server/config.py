@@ -2,24 +2,133 @@ import os
 import json
 from pathlib import Path
 
-# Try to load shared config.json from extension directory
-_config_data = {}
+# Settings are resolved on first access (see __getattr__ below) so importing this
+# module, or anything that imports it, does no file I/O.
 _config_path = Path(__file__).parent.parent / 'grok-video-extension' / 'config.json'
+_settings = None
 
-if _config_path.exists():
-    try:
-        with open(_config_path, 'r') as f:
-            _config_data = json.load(f).get('server', {})
-    except Exception as e:
-        print(f"Warning: Could not load config.json: {e}")
-
-# Configuration with priority: Environment Variables > config.json > Defaults
-SERVER_HOST = os.getenv('SERVER_HOST', _config_data.get('host', '0.0.0.0'))
-SERVER_PORT = int(os.getenv('SERVER_PORT', _config_data.get('port', 8000)))
-VIDEO_STORAGE_PATH = os.getenv('VIDEO_STORAGE_PATH', _config_data.get('videoStoragePath', './videos'))
-LOG_PATH = os.getenv('LOG_PATH', _config_data.get('logPath', './logs'))
-DB_PATH = os.getenv('DB_PATH', _config_data.get('dbPath', './jobs.db'))
-MAX_VIDEO_AGE_DAYS = int(os.getenv('MAX_VIDEO_AGE_DAYS', _config_data.get('maxVideoAgeDays', 7)))
-JOB_TIMEOUT_SECONDS = int(os.getenv('JOB_TIMEOUT_SECONDS', _config_data.get('jobTimeoutSeconds', 300)))
-CHAT_JOB_TIMEOUT_SECONDS = int(os.getenv('CHAT_JOB_TIMEOUT_SECONDS', _config_data.get('chatJobTimeoutSeconds', 60)))
-CHAT_COMPLETION_WAIT_SECONDS = int(os.getenv('CHAT_COMPLETION_WAIT_SECONDS', _config_data.get('chatCompletionWaitSeconds', 60)))
+
+def _load_config_data() -> dict:
+    """Read the 'server' section of the extension's shared config.json, if present"""
+    if _config_path.exists():
+        try:
+            with open(_config_path, 'r') as f:
+                return json.load(f).get('server', {})
+        except Exception as e:
+            print(f"Warning: Could not load config.json: {e}")
+    return {}
+
+
+def _build_settings(_config_data: dict) -> dict:
+    # Configuration with priority: Environment Variables > config.json > Defaults
+    SERVER_HOST = os.getenv('SERVER_HOST', _config_data.get('host', '0.0.0.0'))
+    SERVER_PORT = int(os.getenv('SERVER_PORT', _config_data.get('port', 8000)))
+    VIDEO_STORAGE_PATH = os.getenv('VIDEO_STORAGE_PATH', _config_data.get('videoStoragePath', './videos'))
+    LOG_PATH = os.getenv('LOG_PATH', _config_data.get('logPath', './logs'))
+    DB_PATH = os.getenv('DB_PATH', _config_data.get('dbPath', './jobs.db'))
+    MAX_VIDEO_AGE_DAYS = int(os.getenv('MAX_VIDEO_AGE_DAYS', _config_data.get('maxVideoAgeDays', 7)))
+    JOB_TIMEOUT_SECONDS = int(os.getenv('JOB_TIMEOUT_SECONDS', _config_data.get('jobTimeoutSeconds', 300)))
+    CHAT_JOB_TIMEOUT_SECONDS = int(os.getenv('CHAT_JOB_TIMEOUT_SECONDS', _config_data.get('chatJobTimeoutSeconds', 60)))
+    CHAT_COMPLETION_WAIT_SECONDS = int(os.getenv('CHAT_COMPLETION_WAIT_SECONDS', _config_data.get('chatCompletionWaitSeconds', 60)))
+    # How long a chat job submitted with an Idempotency-Key outlives its last waiting caller
+    # before it is cancelled, so a retry can pick it up
+    CHAT_ABANDON_GRACE_SECONDS = float(os.getenv('CHAT_ABANDON_GRACE_SECONDS', _config_data.get('chatAbandonGraceSeconds', 30)))
+    # Extra worker runs for a chat job whose output fails its json_schema response_format
+    CHAT_SCHEMA_MAX_RETRIES = int(os.getenv('CHAT_SCHEMA_MAX_RETRIES', _config_data.get('chatSchemaMaxRetries', 2)))
+    # How long a chat session's next turn waits for the worker that served the previous one
+    CHAT_SESSION_AFFINITY_SECONDS = float(os.getenv('CHAT_SESSION_AFFINITY_SECONDS', _config_data.get('chatSessionAffinitySeconds', 30)))
+    # How long an Idempotency-Key maps retries of a submission to the job it created
+    IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_KEY_TTL_SECONDS', _config_data.get('idempotencyKeyTtlSeconds', 86400)))
+
+    # Deployment: more than one worker process disables auto-reload (production mode)
+    SERVER_WORKERS = int(os.getenv('SERVER_WORKERS', _config_data.get('workers', 1)))
+    DB_BUSY_TIMEOUT_SECONDS = float(os.getenv('DB_BUSY_TIMEOUT_SECONDS', _config_data.get('dbBusyTimeoutSeconds', 30)))
+    # Group commit: queued writes share one transaction, committed after WRITE_BATCH_MAX_OPS writes or
+    # WRITE_BATCH_WINDOW_MS after the first (0 commits whatever is queued right away)
+    WRITE_BATCH_MAX_OPS = int(os.getenv('WRITE_BATCH_MAX_OPS', _config_data.get('writeBatchMaxOps', 64)))
+    WRITE_BATCH_WINDOW_MS = float(os.getenv('WRITE_BATCH_WINDOW_MS', _config_data.get('writeBatchWindowMs', 2)))
+    # Broker for cross-process notifications: empty/sqlite:///path uses SQLite, redis://host:port/0 uses Redis
+    BROKER_URL = os.getenv('BROKER_URL', _config_data.get('brokerUrl', ''))
+    BROKER_POLL_INTERVAL_SECONDS = float(os.getenv('BROKER_POLL_INTERVAL_SECONDS', _config_data.get('brokerPollIntervalSeconds', 0.25)))
+
+    # Admission control for submission endpoints: opt-in, 0 (the default) disables a limit
+    RATE_LIMIT_PER_MINUTE = float(os.getenv('RATE_LIMIT_PER_MINUTE', _config_data.get('rateLimitPerMinute', 0)))
+    RATE_LIMIT_BURST = int(os.getenv('RATE_LIMIT_BURST', _config_data.get('rateLimitBurst', 10)))
+    MAX_PENDING_VIDEO_JOBS = int(os.getenv('MAX_PENDING_VIDEO_JOBS', _config_data.get('maxPendingVideoJobs', 0)))
+    MAX_PENDING_CHAT_JOBS = int(os.getenv('MAX_PENDING_CHAT_JOBS', _config_data.get('maxPendingChatJobs', 0)))
+    QUEUE_STATS_REFRESH_SECONDS = float(os.getenv('QUEUE_STATS_REFRESH_SECONDS', _config_data.get('queueStatsRefreshSeconds', 1)))
+    DRAIN_RATE_WINDOW_SECONDS = int(os.getenv('DRAIN_RATE_WINDOW_SECONDS', _config_data.get('drainRateWindowSeconds', 300)))
+    # Window of the shed-rate metric (jobs failed at dispatch because their deadline could not be met)
+    SHED_RATE_WINDOW_SECONDS = int(os.getenv('SHED_RATE_WINDOW_SECONDS', _config_data.get('shedRateWindowSeconds', 300)))
+
+    # Request logging: buffered writer and per-route sampling ("/route/template=rate,...")
+    LOG_FLUSH_INTERVAL_SECONDS = float(os.getenv('LOG_FLUSH_INTERVAL_SECONDS', _config_data.get('logFlushIntervalSeconds', 1)))
+    LOG_BUFFER_MAX_ENTRIES = int(os.getenv('LOG_BUFFER_MAX_ENTRIES', _config_data.get('logBufferMaxEntries', 500)))
+    LOG_SAMPLE_RATES = os.getenv('LOG_SAMPLE_RATES', _config_data.get(
+        'logSampleRates', '/extension/poll=0,/jobs=0,/api/logs=0,/api/logs/stats=0,/api/logs/summary=0,/api/dispatch/stats=0,/api/webhooks/stats=0,/api/db/stats=0,/api/storage/stats=0,/health=0,/=0'))
+    # Log rotation: the day's file is closed at midnight or once it reaches LOG_MAX_FILE_BYTES, then
+    # gzipped with a per-file rollup. Archives older than LOG_RETENTION_DAYS, and the oldest beyond
+    # LOG_RETENTION_BYTES in total, are deleted (0 disables a limit; rollups only expire by age)
+    LOG_MAX_FILE_BYTES = int(os.getenv('LOG_MAX_FILE_BYTES', _config_data.get('logMaxFileBytes', 64 * 1024 * 1024)))
+    LOG_RETENTION_DAYS = int(os.getenv('LOG_RETENTION_DAYS', _config_data.get('logRetentionDays', 30)))
+    LOG_RETENTION_BYTES = int(os.getenv('LOG_RETENTION_BYTES', _config_data.get('logRetentionBytes', 1024 * 1024 * 1024)))
+    LOG_ARCHIVE_INTERVAL_SECONDS = float(os.getenv('LOG_ARCHIVE_INTERVAL_SECONDS', _config_data.get('logArchiveIntervalSeconds', 60)))
+
+    # Completion webhooks for jobs with a callback_url: at most WEBHOOK_CONCURRENCY deliveries in
+    # flight, retried with exponential backoff from WEBHOOK_RETRY_BASE_SECONDS (capped at
+    # WEBHOOK_RETRY_MAX_SECONDS) for up to WEBHOOK_MAX_ATTEMPTS tries; bodies are signed when
+    # WEBHOOK_SECRET is set
+    WEBHOOK_CONCURRENCY = int(os.getenv('WEBHOOK_CONCURRENCY', _config_data.get('webhookConcurrency', 16)))
+    WEBHOOK_TIMEOUT_SECONDS = float(os.getenv('WEBHOOK_TIMEOUT_SECONDS', _config_data.get('webhookTimeoutSeconds', 10)))
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv('WEBHOOK_MAX_ATTEMPTS', _config_data.get('webhookMaxAttempts', 8)))
+    WEBHOOK_RETRY_BASE_SECONDS = float(os.getenv('WEBHOOK_RETRY_BASE_SECONDS', _config_data.get('webhookRetryBaseSeconds', 2)))
+    WEBHOOK_RETRY_MAX_SECONDS = float(os.getenv('WEBHOOK_RETRY_MAX_SECONDS', _config_data.get('webhookRetryMaxSeconds', 600)))
+    WEBHOOK_POLL_INTERVAL_SECONDS = float(os.getenv('WEBHOOK_POLL_INTERVAL_SECONDS', _config_data.get('webhookPollIntervalSeconds', 1)))
+    WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', _config_data.get('webhookSecret', ''))
+
+    # Per-job trace export: empty disables, a file path appends OTLP/JSON lines,
+    # an http(s) URL posts to an OTLP/HTTP collector such as http://localhost:4318/v1/traces
+    TRACE_EXPORT = os.getenv('TRACE_EXPORT', _config_data.get('traceExport', ''))
+    TRACE_SERVICE_NAME = os.getenv('TRACE_SERVICE_NAME', _config_data.get('traceServiceName', 'grok-video-server'))
+
+    # Chunked video uploads from extension workers
+    UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', _config_data.get('uploadChunkSize', 4 * 1024 * 1024)))
+    UPLOAD_MAX_CHUNK_BYTES = int(os.getenv('UPLOAD_MAX_CHUNK_BYTES', _config_data.get('uploadMaxChunkBytes', 16 * 1024 * 1024)))
+    # Direct uploads: workers send video to UPLOAD_SINK_URL (default: this server's /upload)
+    # with a signed token from /extension/poll; an empty secret uses one generated in storage
+    UPLOAD_SINK_URL = os.getenv('UPLOAD_SINK_URL', _config_data.get('uploadSinkUrl', ''))
+    UPLOAD_TOKEN_SECRET = os.getenv('UPLOAD_TOKEN_SECRET', _config_data.get('uploadTokenSecret', ''))
+    UPLOAD_TOKEN_TTL_SECONDS = int(os.getenv('UPLOAD_TOKEN_TTL_SECONDS', _config_data.get('uploadTokenTtlSeconds', 1800)))
+
+    # Image-to-video ingest: validate, downsize and re-encode submitted images
+    IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', _config_data.get('imageMaxDimension', 1536)))
+    IMAGE_MAX_INPUT_BYTES = int(os.getenv('IMAGE_MAX_INPUT_BYTES', _config_data.get('imageMaxInputBytes', 20 * 1024 * 1024)))
+    IMAGE_JPEG_QUALITY = int(os.getenv('IMAGE_JPEG_QUALITY', _config_data.get('imageJpegQuality', 88)))
+    IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', _config_data.get('imageProcessWorkers', 2)))
+
+    # Video post-processing (metadata probe, faststart remux, thumbnails via ffmpeg when available)
+    VIDEO_POSTPROCESS_WORKERS = int(os.getenv('VIDEO_POSTPROCESS_WORKERS', _config_data.get('videoPostprocessWorkers', 2)))
+    VIDEO_POSTPROCESS_QUEUE_SIZE = int(os.getenv('VIDEO_POSTPROCESS_QUEUE_SIZE', _config_data.get('videoPostprocessQueueSize', 100)))
+    FFMPEG_PATH = os.getenv('FFMPEG_PATH', _config_data.get('ffmpegPath', 'ffmpeg'))
+    FFMPEG_TIMEOUT_SECONDS = int(os.getenv('FFMPEG_TIMEOUT_SECONDS', _config_data.get('ffmpegTimeoutSeconds', 60)))
+    THUMBNAIL_WIDTH = int(os.getenv('THUMBNAIL_WIDTH', _config_data.get('thumbnailWidth', 320)))
+    PREVIEW_SECONDS = int(os.getenv('PREVIEW_SECONDS', _config_data.get('previewSeconds', 3)))
+
+    return {name: value for name, value in locals().items() if name.isupper()}
+
+
+def load():
+    """Resolve all settings now (environment variables > config.json > defaults)"""
+    global _settings
+    if _settings is None:
+        _settings = _build_settings(_load_config_data())
+        globals().update(_settings)
+    return _settings
+
+
+def __getattr__(name: str):
+    if name.isupper() and _settings is None:
+        settings = load()
+        if name in settings:
+            return settings[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,159 @@
+"""
+Group commit for SQLite writes.
+
+A transaction per write pays its own fsync and takes the database write lock
+on its own, so bursts of submissions or completions queue up behind disk syncs.
+GroupCommitWriter owns one write connection per process and runs queued
+mutations back to back in a single transaction. While writes keep arriving
+it lets them join the batch, for at most WRITE_BATCH_WINDOW_MS or until
+WRITE_BATCH_MAX_OPS are queued, then commits and resolves every caller. A lone
+write is committed without waiting, and writes queued while a batch commits
+form the next one. A caller's await returns only after the
+commit that includes its mutation, so durability is unchanged; the fsync and
+the lock are shared by the whole batch.
+
+Each mutation runs inside a SAVEPOINT: one that raises is rolled back alone and
+its exception is raised to its caller while the rest of the batch commits. If
+the transaction itself fails (e.g. the lock wait times out), every caller in
+the batch gets the error.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiosqlite
+
+import config
+
+Operation = Callable[[aiosqlite.Connection], Awaitable[Any]]
+
+
+class GroupCommitWriter:
+    """
+    Runs write operations for one database through a single batching task.
+
+    An operation is an async callable taking the write connection. It must only
+    use that connection (no commit or rollback) and should not wait on anything
+    else, since the batch holds the write lock while it runs.
+    """
+
+    def __init__(self, connect: Callable[[], aiosqlite.Connection]):
+        self._connect = connect
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._batch: List[Tuple[Operation, asyncio.Future]] = []
+        self._stats = {"batches": 0, "operations": 0, "failed_batches": 0, "max_batch": 0}
+
+    async def submit(self, operation: Operation) -> Any:
+        """Run operation in the next batch; returns its result once the batch is committed"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            # Started lazily, and again under a new event loop (scripts calling asyncio.run repeatedly)
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._task = loop.create_task(self._run(self._queue))
+        future = loop.create_future()
+        self._queue.put_nowait((operation, future))
+        return await future
+
+    async def close(self):
+        """Commit what is queued, then close the write connection"""
+        if self._task is None or self._task.done() or self._loop is not asyncio.get_running_loop():
+            return
+        await self.submit(_noop)
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    async def _run(self, queue: asyncio.Queue):
+        db = None
+        stopped: BaseException = RuntimeError("Database writer stopped")
+        try:
+            db = await self._connect()
+            loop = asyncio.get_running_loop()
+            while True:
+                batch = [await queue.get()]
+                self._batch = batch
+                self._drain(queue, batch)
+                deadline = loop.time() + config.WRITE_BATCH_WINDOW_MS / 1000
+                while len(batch) < config.WRITE_BATCH_MAX_OPS and loop.time() < deadline:
+                    # Let callers that are about to write join, as long as some do
+                    size = len(batch)
+                    await asyncio.sleep(0)
+                    self._drain(queue, batch)
+                    if len(batch) == size:
+                        break
+                await self._commit(db, batch)
+                self._batch = []
+        except Exception as e:
+            # Raised to the callers waiting now; the next submit starts a new writer
+            stopped = e
+        finally:
+            while not queue.empty():
+                self._batch.append(queue.get_nowait())
+            for _, future in self._batch:
+                if not future.done():
+                    future.set_exception(stopped)
+            self._batch = []
+            if db is not None:
+                await db.close()
+
+    @staticmethod
+    def _drain(queue: asyncio.Queue, batch: list):
+        while len(batch) < config.WRITE_BATCH_MAX_OPS and not queue.empty():
+            batch.append(queue.get_nowait())
+
+    async def _commit(self, db: aiosqlite.Connection, batch: List[Tuple[Operation, asyncio.Future]]):
+        # Callers that gave up before their turn are skipped, as if they had never called
+        batch = [(operation, future) for operation, future in batch if not future.done()]
+        if not batch:
+            return
+
+        outcomes = []
+        try:
+            await db.execute("BEGIN IMMEDIATE")
+            for operation, future in batch:
+                await db.execute("SAVEPOINT operation")
+                try:
+                    result = await operation(db)
+                except Exception as e:
+                    await db.execute("ROLLBACK TO operation")
+                    await db.execute("RELEASE operation")
+                    outcomes.append((future, None, e))
+                else:
+                    await db.execute("RELEASE operation")
+                    outcomes.append((future, result, None))
+            await db.execute("COMMIT")
+        except Exception as e:
+            if db.in_transaction:
+                await db.execute("ROLLBACK")
+            self._stats["failed_batches"] += 1
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self._stats["batches"] += 1
+        self._stats["operations"] += len(batch)
+        self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+        for future, result, error in outcomes:
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        """Batches committed by this process and their sizes"""
+        batches = self._stats["batches"]
+        return {
+            **self._stats,
+            "mean_batch": round(self._stats["operations"] / batches, 2) if batches else 0,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+        }
+
+
+async def _noop(db: aiosqlite.Connection):
+    return None
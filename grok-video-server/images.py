@@ -0,0 +1,123 @@
+import asyncio
+import base64
+import binascii
+import io
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import config
+
+# Magic-byte prefixes of formats Grok accepts
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+
+
+class ImageValidationError(ValueError):
+    """Submitted image is not a decodable, supported image"""
+
+
+def _sniff_mime(data: bytes) -> Optional[str]:
+    for signature, mime in _SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def _decode_image_string(image: str) -> bytes:
+    """Accept a data URL or bare base64 string"""
+    if image.startswith("data:"):
+        header, sep, image = image.partition(",")
+        if not sep or ";base64" not in header:
+            raise ImageValidationError("Image data URL must be base64 encoded")
+    if len(image) * 3 // 4 > config.IMAGE_MAX_INPUT_BYTES:
+        raise ImageValidationError(f"Image larger than {config.IMAGE_MAX_INPUT_BYTES} bytes")
+    try:
+        return base64.b64decode(image, validate=True)
+    except (binascii.Error, ValueError):
+        raise ImageValidationError("Image is not valid base64")
+
+
+def _encode_data_url(data: bytes, mime: str) -> str:
+    return f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def _load_pillow():
+    """Import Pillow in the worker process only; None if it is not installed"""
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:  # Without Pillow images are validated but passed through unchanged
+        return None
+    return Image, ImageOps
+
+
+def _reencode(data: bytes, Image, ImageOps) -> Tuple[bytes, str]:
+    """Downsize to IMAGE_MAX_DIMENSION and re-encode without metadata (JPEG, or PNG when transparent)"""
+    try:
+        with Image.open(io.BytesIO(data)) as source:
+            source.load()
+            image = ImageOps.exif_transpose(source)
+    except Image.DecompressionBombError:
+        raise ImageValidationError("Image dimensions are too large")
+    except Exception:
+        raise ImageValidationError("Image could not be decoded")
+
+    image.thumbnail((config.IMAGE_MAX_DIMENSION, config.IMAGE_MAX_DIMENSION), Image.LANCZOS)
+
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    output = io.BytesIO()
+    if has_alpha:
+        image.convert("RGBA").save(output, format="PNG", optimize=True)
+        mime = "image/png"
+    else:
+        image.convert("RGB").save(output, format="JPEG", quality=config.IMAGE_JPEG_QUALITY, optimize=True)
+        mime = "image/jpeg"
+    return output.getvalue(), mime
+
+
+def normalize_image(image: str) -> str:
+    """
+    Validate a submitted base64 image and return a compact data URL.
+
+    Runs in a worker process: decoding and resizing are CPU-bound.
+    """
+    data = _decode_image_string(image)
+    mime = _sniff_mime(data)
+    if mime is None:
+        raise ImageValidationError("Unsupported image format (expected PNG, JPEG, WEBP or GIF)")
+
+    pillow = _load_pillow()
+    if pillow is not None:
+        data, mime = _reencode(data, *pillow)
+
+    return _encode_data_url(data, mime)
+
+
+class ImagePreprocessor:
+    """Runs normalize_image in a lazily started process pool, off the event loop"""
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    async def process(self, image: Optional[str]) -> Optional[str]:
+        if not image:
+            return image
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers or config.IMAGE_PROCESS_WORKERS)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, normalize_image, image)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Global image preprocessor instance
+image_preprocessor = ImagePreprocessor()
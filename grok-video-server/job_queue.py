@@ -1,295 +1,775 @@
 import aiosqlite
+import time
 import uuid
-import json
 from datetime import datetime
-from typing import Optional, List
+from typing import Any, Optional, List, Dict, NamedTuple, Tuple
 from models import JobStatus, JobType
+from broker import broker
+from serialization import dumps_with_raw, loads
+from migrations import migrate
+from group_commit import GroupCommitWriter
+from pending_index import PendingEntry, PendingIndex
 import config
 
 
-class Job:
-    def __init__(self, job_id: str, prompt: str, image: Optional[str] = None,
-                 status: str = JobStatus.PENDING, job_type: str = JobType.VIDEO,
-                 client_id: Optional[str] = None,
-                 request_payload: Optional[str] = None, text_response: Optional[str] = None,
-                 created_at: int = None,
-                 completed_at: Optional[int] = None, video_path: Optional[str] = None,
-                 error: Optional[str] = None):
-        self.job_id = job_id
-        self.prompt = prompt
-        self.image = image
-        self.status = status
-        self.job_type = job_type.value if isinstance(job_type, JobType) else job_type
-        self.client_id = client_id
-        self.request_payload = request_payload
-        self.text_response = text_response
-        self.created_at = created_at or int(datetime.now().timestamp())
-        self.completed_at = completed_at
-        self.video_path = video_path
-        self.error = error
+class IdempotencyKeyConflict(ValueError):
+    """Idempotency-Key reused with a request that differs from the original"""
+
+
+class Job(NamedTuple):
+    """Immutable job record; fields are in JOB_COLUMNS order so rows map positionally"""
+    job_id: str
+    prompt: str
+    image: Optional[str] = None
+    status: str = JobStatus.PENDING.value
+    job_type: str = JobType.VIDEO.value
+    client_id: Optional[str] = None
+    request_payload: Optional[str] = None
+    text_response: Optional[str] = None
+    created_at: Optional[int] = None
+    completed_at: Optional[int] = None
+    video_path: Optional[str] = None
+    error: Optional[str] = None
+    duration: Optional[float] = None
+    width: Optional[int] = None
+    height: Optional[int] = None
+    video_codec: Optional[str] = None
+    thumbnail_path: Optional[str] = None
+    preview_path: Optional[str] = None
+    postprocessed_at: Optional[int] = None
+    updated_at: int = 0
+    # Phase timestamps (epoch milliseconds); see PHASE_COLUMNS
+    enqueued_ms: Optional[int] = None
+    claimed_ms: Optional[int] = None
+    first_heartbeat_ms: Optional[int] = None
+    upload_started_ms: Optional[int] = None
+    upload_done_ms: Optional[int] = None
+    completed_ms: Optional[int] = None
+    # Chat session affinity (schema version 6)
+    session_id: Optional[str] = None
+    previous_job_id: Optional[str] = None
+    preferred_client_id: Optional[str] = None
+    # Re-dispatches after rejected output (schema version 7)
+    attempts: int = 0
+    # Latest useful completion time, epoch ms (schema version 8)
+    deadline_ms: Optional[int] = None
+    # Completion webhook target (schema version 9)
+    callback_url: Optional[str] = None
+    # SHA-256 of the uploaded video, naming its blob in storage (schema version 11)
+    video_sha256: Optional[str] = None
+
+    @property
+    def request(self) -> Optional[Dict[str, Any]]:
+        """Decoded request_payload; parsed on access only"""
+        return loads(self.request_payload) if self.request_payload else None
 
     def to_dict(self):
-        return {
-            'job_id': self.job_id,
-            'prompt': self.prompt,
-            'image': self.image,
-            'status': self.status,
-            'job_type': self.job_type,
-            'client_id': self.client_id,
-            'request_payload': json.loads(self.request_payload) if self.request_payload else None,
-            'text_response': self.text_response,
-            'created_at': self.created_at,
-            'completed_at': self.completed_at,
-            'video_path': self.video_path,
-            'error': self.error
-        }
+        data = self._asdict()
+        data['request_payload'] = self.request
+        return data
+
+    def to_json(self, include_image: bool = True) -> bytes:
+        """Serialize like to_dict, passing the stored request_payload JSON through untouched"""
+        data = self._asdict()
+        del data['request_payload']
+        if not include_image:
+            del data['image']
+        return dumps_with_raw(data, request_payload=self.request_payload)
+
+
+JOB_COLUMNS = Job._fields
+JOB_SELECT = ", ".join(JOB_COLUMNS)
+# Critical-path phases of a job, in the order they happen
+PHASE_COLUMNS = ('enqueued_ms', 'claimed_ms', 'first_heartbeat_ms',
+                 'upload_started_ms', 'upload_done_ms', 'completed_ms')
+
+
+# Integer codes stored for status and job_type (schema version 2)
+STATUS_NAMES = (JobStatus.PENDING.value, JobStatus.PROCESSING.value,
+                JobStatus.COMPLETED.value, JobStatus.FAILED.value, JobStatus.CANCELLED.value)
+STATUS_CODES = {name: code for code, name in enumerate(STATUS_NAMES)}
+JOB_TYPE_NAMES = (JobType.VIDEO.value, JobType.CHAT.value)
+JOB_TYPE_CODES = {name: code for code, name in enumerate(JOB_TYPE_NAMES)}
+PENDING_CODE, PROCESSING_CODE, COMPLETED_CODE, FAILED_CODE, CANCELLED_CODE = range(len(STATUS_NAMES))
+# Status codes are inlined into SQL rather than bound so the planner can match the
+# partial pending index; a bound status also costs a re-prepare per execution.
+
+_STATUS_INDEX = JOB_COLUMNS.index('status')
+_JOB_TYPE_INDEX = JOB_COLUMNS.index('job_type')
+assert _JOB_TYPE_INDEX == _STATUS_INDEX + 1
+
+
+def status_code(status) -> int:
+    """Stored code for a JobStatus or its string value"""
+    return STATUS_CODES[status.value if isinstance(status, JobStatus) else status]
+
+
+def job_type_code(job_type) -> int:
+    """Stored code for a JobType or its string value"""
+    return JOB_TYPE_CODES[job_type.value if isinstance(job_type, JobType) else job_type]
+
+
+def job_row_factory(cursor, row) -> Job:
+    """sqlite3 row factory for queries selecting JOB_SELECT; decodes enum codes"""
+    return Job._make(row[:_STATUS_INDEX]
+                     + (STATUS_NAMES[row[_STATUS_INDEX]], JOB_TYPE_NAMES[row[_JOB_TYPE_INDEX]])
+                     + row[_JOB_TYPE_INDEX + 1:])
+
+
+# Change feed reads re-scan this far behind the client's cursor: a writer in another
+# process may commit after a reader has already seen later timestamps.
+CHANGE_FEED_OVERLAP_MS = 2000
+
+# A change feed position: the (updated_at, job_id) of the last row a client has read
+ChangePosition = Tuple[int, str]
+
+
+def parse_change_cursor(cursor: str) -> ChangePosition:
+    """Position from a change feed cursor: "<updated_at>:<job_id>", or plain epoch ms"""
+    updated_at, _, job_id = cursor.partition(':')
+    return int(updated_at), job_id
+
+
+def format_change_cursor(position: ChangePosition) -> str:
+    updated_at, job_id = position
+    return f"{updated_at}:{job_id}" if job_id else str(updated_at)
+
+# Columns of a pending job's index entry, in PendingEntry order
+PENDING_ENTRY_SELECT = ("created_at, COALESCE(enqueued_ms, 0), job_id, job_type, "
+                        "preferred_client_id, affinity_until_ms, deadline_ms")
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _pending_entry(row) -> PendingEntry:
+    """PendingEntry from a row selecting PENDING_ENTRY_SELECT"""
+    return PendingEntry(row[0], row[1], row[2], JOB_TYPE_NAMES[row[3]], row[4], row[5], row[6])
+
+
+def _affinity_until_ms(job: 'Job') -> Optional[int]:
+    """When a chat turn stops being held for the worker of its previous turn"""
+    if job.previous_job_id is None:
+        return None
+    return job.enqueued_ms + int(config.CHAT_SESSION_AFFINITY_SECONDS * 1000)
 
 
 class JobQueue:
-    def __init__(self, db_path: str = None):
-        self.db_path = db_path or config.DB_PATH
+    def __init__(self, db_path: str = None, broker=None):
+        self._db_path = db_path
+        self.broker = broker
+        # All writes go through one connection and are committed in batches
+        self.writer = GroupCommitWriter(self._connect)
+        # Claim candidates; loaded from the pending rows at startup or on the first claim
+        self.pending = PendingIndex()
+        self._pending_synced_at = 0.0
+
+    @property
+    def db_path(self) -> str:
+        return self._db_path or config.DB_PATH
+
+    def _connect(self):
+        """Open a connection that waits on the write lock held by other processes"""
+        return aiosqlite.connect(self.db_path, timeout=config.DB_BUSY_TIMEOUT_SECONDS)
+
+    async def _notify(self, channel: str, message: str = ""):
+        if self.broker is not None:
+            await self.broker.publish(channel, message)
+
+    @staticmethod
+    def _shares_database() -> bool:
+        """Whether other server processes may add pending jobs this one has not seen"""
+        return config.SERVER_WORKERS > 1
+
+    async def _load_pending(self, db: aiosqlite.Connection):
+        """Rebuild the pending index from the jobs table"""
+        async with db.execute("SELECT MAX(updated_at) FROM jobs") as cursor:
+            synced_ms = (await cursor.fetchone())[0] or 0
+        async with db.execute(f"""
+            SELECT {PENDING_ENTRY_SELECT} FROM jobs WHERE status = {PENDING_CODE}
+        """) as cursor:
+            rows = await cursor.fetchall()
+        self.pending.reset(map(_pending_entry, rows), _now_ms())
+        self.pending.synced_ms = synced_ms
+        self._pending_synced_at = time.monotonic()
+
+    async def _sync_pending(self, db: aiosqlite.Connection):
+        """
+        Index jobs other processes made pending since the last sync
+
+        Jobs they claimed, cancelled or finished are left in the index; a claim
+        drops them when its conditional UPDATE finds they are no longer pending.
+        """
+        async with db.execute(f"""
+            SELECT updated_at, {PENDING_ENTRY_SELECT} FROM jobs INDEXED BY idx_pending_updated
+            WHERE status = {PENDING_CODE} AND updated_at > ?
+        """, (self.pending.synced_ms - CHANGE_FEED_OVERLAP_MS,)) as cursor:
+            rows = await cursor.fetchall()
+        now_ms = _now_ms()
+        for row in rows:
+            self.pending.add(_pending_entry(row[1:]), now_ms)
+            self.pending.synced_ms = max(self.pending.synced_ms, row[0])
+        self._pending_synced_at = time.monotonic()
+
+    def _index_pending(self, job: Job):
+        self.pending.add(PendingEntry(job.created_at, job.enqueued_ms or 0, job.job_id, job.job_type,
+                                      job.preferred_client_id, _affinity_until_ms(job), job.deadline_ms),
+                         _now_ms())
+
+    async def _execute_write(self, sql: str, params: tuple) -> int:
+        """Run one write statement in the next group commit; returns the affected row count"""
+        async def execute(db):
+            async with db.execute(sql, params) as cursor:
+                return cursor.rowcount
+
+        return await self.writer.submit(execute)
 
     async def init_db(self):
-        """Initialize database and create tables"""
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS jobs (
-                    job_id TEXT PRIMARY KEY,
-                    prompt TEXT NOT NULL,
-                    image TEXT,
-                    status TEXT NOT NULL,
-                    job_type TEXT NOT NULL DEFAULT 'video',
-                    client_id TEXT,
-                    request_payload TEXT,
-                    text_response TEXT,
-                    created_at INTEGER NOT NULL,
-                    completed_at INTEGER,
-                    video_path TEXT,
-                    error TEXT
-                )
-            """)
-            # Lightweight migration for existing DBs.
-            async with db.execute("PRAGMA table_info(jobs)") as cursor:
-                columns = {row[1] for row in await cursor.fetchall()}
-
-            if 'job_type' not in columns:
-                await db.execute("ALTER TABLE jobs ADD COLUMN job_type TEXT NOT NULL DEFAULT 'video'")
-            if 'client_id' not in columns:
-                await db.execute("ALTER TABLE jobs ADD COLUMN client_id TEXT")
-            if 'request_payload' not in columns:
-                await db.execute("ALTER TABLE jobs ADD COLUMN request_payload TEXT")
-            if 'text_response' not in columns:
-                await db.execute("ALTER TABLE jobs ADD COLUMN text_response TEXT")
+        """Initialize database and apply pending schema migrations"""
+        async with self._connect() as db:
+            # WAL lets pollers in other worker processes read while one of them writes.
+            await db.execute("PRAGMA journal_mode=WAL")
+            await migrate(db)
+            await self._load_pending(db)
+
+    async def close(self):
+        """Commit queued writes and close the write connection"""
+        await self.writer.close()
+
+    @staticmethod
+    def _new_job(prompt: str, image: Optional[str], job_type: str, request_payload: Optional[str],
+                 session_id: Optional[str] = None, deadline_ms: Optional[int] = None,
+                 callback_url: Optional[str] = None) -> Job:
+        now_ms = _now_ms()
+        return Job(
+            job_id=f"job_{uuid.uuid4().hex[:12]}",
+            prompt=prompt,
+            image=image,
+            job_type=job_type.value if isinstance(job_type, JobType) else job_type,
+            request_payload=request_payload,
+            created_at=now_ms // 1000,
+            updated_at=now_ms,
+            enqueued_ms=now_ms,
+            session_id=session_id,
+            deadline_ms=deadline_ms,
+            callback_url=callback_url
+        )
 
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_status ON jobs(status)
-            """)
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_status_job_type ON jobs(status, job_type)
-            """)
-            await db.execute("""
-                CREATE INDEX IF NOT EXISTS idx_created_at ON jobs(created_at)
-            """)
-            await db.commit()
+    @staticmethod
+    async def _insert_job(db: aiosqlite.Connection, job: Job, idempotency_key: Optional[str] = None,
+                          fingerprint: Optional[str] = None, expires_at: Optional[int] = None) -> Job:
+        """Insert a new job, first linking it to the previous turn of its session; returns the stored job"""
+        affinity_until_ms = None
+        if job.session_id is not None:
+            async with db.execute(f"""
+                SELECT job_id, client_id FROM jobs
+                WHERE session_id = ? AND status = {COMPLETED_CODE}
+                ORDER BY created_at DESC
+                LIMIT 1
+            """, (job.session_id,)) as cursor:
+                previous = await cursor.fetchone()
+            if previous is not None:
+                job = job._replace(previous_job_id=previous[0], preferred_client_id=previous[1])
+                affinity_until_ms = _affinity_until_ms(job)
+
+        await db.execute("""
+            INSERT INTO jobs (job_id, prompt, image, status, job_type, request_payload, created_at, updated_at,
+                              enqueued_ms, idempotency_key, idempotency_fingerprint, idempotency_expires_at,
+                              session_id, previous_job_id, preferred_client_id, affinity_until_ms, deadline_ms,
+                              callback_url)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (job.job_id, job.prompt, job.image, status_code(job.status), job_type_code(job.job_type),
+              job.request_payload, job.created_at, job.updated_at, job.enqueued_ms,
+              idempotency_key, fingerprint, expires_at,
+              job.session_id, job.previous_job_id, job.preferred_client_id, affinity_until_ms, job.deadline_ms,
+              job.callback_url))
+        return job
 
     async def create_job(self, prompt: str, image: Optional[str] = None,
                          job_type: str = JobType.VIDEO,
-                         request_payload: Optional[str] = None) -> Job:
+                         request_payload: Optional[str] = None,
+                         session_id: Optional[str] = None,
+                         deadline_ms: Optional[int] = None,
+                         callback_url: Optional[str] = None) -> Job:
         """Create a new job"""
-        job_id = f"job_{uuid.uuid4().hex[:12]}"
-        job = Job(
-            job_id=job_id,
-            prompt=prompt,
-            image=image,
-            job_type=job_type,
-            request_payload=request_payload
-        )
+        job = self._new_job(prompt, image, job_type, request_payload, session_id, deadline_ms, callback_url)
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
-                INSERT INTO jobs (job_id, prompt, image, status, job_type, request_payload, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            """, (job.job_id, job.prompt, job.image, job.status, job.job_type, job.request_payload, job.created_at))
-            await db.commit()
+        job = await self.writer.submit(lambda db: self._insert_job(db, job))
+        self._index_pending(job)
 
+        await self._notify(f"jobs:{job.job_type}", job.job_id)
         return job
 
+    @staticmethod
+    async def _find_idempotent(db: aiosqlite.Connection, idempotency_key: str,
+                               fingerprint: str) -> Tuple[Optional[Job], bool]:
+        """
+        (job, expired) for the job holding idempotency_key, or (None, False)
+
+        Raises:
+            IdempotencyKeyConflict: the key is held by a different request
+        """
+        async with db.execute(f"""
+            SELECT {JOB_SELECT}, idempotency_fingerprint, idempotency_expires_at
+            FROM jobs WHERE idempotency_key = ?
+        """, (idempotency_key,)) as cursor:
+            row = await cursor.fetchone()
+        if row is None:
+            return None, False
+        if row[-1] <= _now_ms():
+            return None, True
+        if row[-2] != fingerprint:
+            raise IdempotencyKeyConflict("Idempotency-Key was already used for a different request")
+        return job_row_factory(cursor, row[:-2]), False
+
+    async def get_idempotent_job(self, idempotency_key: str, fingerprint: str) -> Optional[Job]:
+        """Job created by an earlier submission with this key, if the key has not expired"""
+        async with self._connect() as db:
+            job, _ = await self._find_idempotent(db, idempotency_key, fingerprint)
+            return job
+
+    async def create_idempotent_job(self, idempotency_key: str, fingerprint: str, prompt: str,
+                                    image: Optional[str] = None, job_type: str = JobType.VIDEO,
+                                    request_payload: Optional[str] = None,
+                                    session_id: Optional[str] = None,
+                                    deadline_ms: Optional[int] = None,
+                                    callback_url: Optional[str] = None) -> Tuple[Job, bool]:
+        """
+        Create a job unless an unexpired one already holds idempotency_key
+
+        The lookup and insert run in one write transaction, so concurrent retries in
+        any worker process end up with the same job.
+
+        Returns:
+            (job, created); created is False when an earlier submission's job is returned
+
+        Raises:
+            IdempotencyKeyConflict: the key is held by a different request
+        """
+        async def create(db):
+            existing, expired = await self._find_idempotent(db, idempotency_key, fingerprint)
+            if existing is not None:
+                return existing, False
+            if expired:
+                # Release the key from the old job; the job itself is kept
+                await db.execute("""
+                    UPDATE jobs SET idempotency_key = NULL WHERE idempotency_key = ?
+                """, (idempotency_key,))
+
+            job = self._new_job(prompt, image, job_type, request_payload, session_id, deadline_ms,
+                                callback_url)
+            expires_at = job.updated_at + config.IDEMPOTENCY_KEY_TTL_SECONDS * 1000
+            return await self._insert_job(db, job, idempotency_key, fingerprint, expires_at), True
+
+        job, created = await self.writer.submit(create)
+        if created:
+            self._index_pending(job)
+            await self._notify(f"jobs:{job.job_type}", job.job_id)
+        return job, created
+
     async def get_job(self, job_id: str) -> Optional[Job]:
         """Get job by ID"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute("""
-                SELECT * FROM jobs WHERE job_id = ?
+        async with self._connect() as db:
+            db.row_factory = job_row_factory
+            async with db.execute(f"""
+                SELECT {JOB_SELECT} FROM jobs WHERE job_id = ?
             """, (job_id,)) as cursor:
-                row = await cursor.fetchone()
-
-                if row:
-                    return Job(
-                        job_id=row['job_id'],
-                        prompt=row['prompt'],
-                        image=row['image'],
-                        status=row['status'],
-                        job_type=row['job_type'],
-                        client_id=row['client_id'],
-                        request_payload=row['request_payload'],
-                        text_response=row['text_response'],
-                        created_at=row['created_at'],
-                        completed_at=row['completed_at'],
-                        video_path=row['video_path'],
-                        error=row['error']
-                    )
-
-        return None
+                return await cursor.fetchone()
 
     async def get_next_pending_job(self, job_type: Optional[str] = None) -> Optional[Job]:
         """Get next pending job from queue (non-claiming read)"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
+            db.row_factory = job_row_factory
             if job_type:
-                query = """
-                    SELECT * FROM jobs
-                    WHERE status = ? AND job_type = ?
+                query = f"""
+                    SELECT {JOB_SELECT} FROM jobs
+                    WHERE status = {PENDING_CODE} AND job_type = ?
                     ORDER BY created_at ASC
                     LIMIT 1
                 """
-                params = (JobStatus.PENDING, job_type)
+                params = (job_type_code(job_type),)
             else:
-                query = """
-                    SELECT * FROM jobs
-                    WHERE status = ?
+                query = f"""
+                    SELECT {JOB_SELECT} FROM jobs
+                    WHERE status = {PENDING_CODE}
                     ORDER BY created_at ASC
                     LIMIT 1
                 """
-                params = (JobStatus.PENDING,)
+                params = ()
 
             async with db.execute(query, params) as cursor:
-                row = await cursor.fetchone()
-
-                if row:
-                    return Job(
-                        job_id=row['job_id'],
-                        prompt=row['prompt'],
-                        image=row['image'],
-                        status=row['status'],
-                        job_type=row['job_type'],
-                        client_id=row['client_id'],
-                        request_payload=row['request_payload'],
-                        text_response=row['text_response'],
-                        created_at=row['created_at'],
-                        completed_at=row['completed_at'],
-                        video_path=row['video_path'],
-                        error=row['error']
-                    )
-
-        return None
-
-    async def claim_next_pending_job(self, job_type: str, client_id: str) -> Optional[Job]:
-        """Atomically claim next pending job for a worker client"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
-            await db.execute("BEGIN IMMEDIATE")
-
-            async with db.execute("""
-                SELECT job_id
-                FROM jobs
-                WHERE status = ? AND job_type = ?
-                ORDER BY created_at ASC
-                LIMIT 1
-            """, (JobStatus.PENDING, job_type)) as cursor:
-                row = await cursor.fetchone()
-
-            if not row:
-                await db.commit()
-                return None
-
-            job_id = row['job_id']
-            update_cursor = await db.execute("""
+                return await cursor.fetchone()
+
+    async def claim_next_pending_job(self, job_type: str, client_id: str,
+                                     min_deadline_ms: int = 0) -> Optional[Job]:
+        """
+        Atomically claim next pending job for a worker client
+
+        Chat jobs continuing a session are held for the worker that served the
+        previous turn (it takes them ahead of other jobs) until their affinity
+        expires, after which any worker may claim them. Jobs with a deadline
+        before min_deadline_ms are skipped.
+
+        Candidates come from the in-memory pending index, oldest first, and are
+        claimed with a conditional UPDATE; with several server processes the index
+        first catches up on their changes (see _sync_pending).
+        """
+        job_type = job_type.value if isinstance(job_type, JobType) else job_type
+
+        async def claim(db):
+            if not self.pending.loaded:
+                await self._load_pending(db)
+            elif (self._shares_database()
+                  and time.monotonic() - self._pending_synced_at > config.BROKER_POLL_INTERVAL_SECONDS):
+                await self._sync_pending(db)
+
+            synced = not self._shares_database()
+            while True:
+                now_ms = _now_ms()
+                entry = self.pending.pop(job_type, client_id, now_ms, min_deadline_ms)
+                if entry is None:
+                    if synced:
+                        return None
+                    # Another process may have added jobs since the last sync
+                    await self._sync_pending(db)
+                    synced = True
+                    continue
+
+                # The index may be stale; the conditional update decides
+                async with db.execute(f"""
+                    UPDATE jobs
+                    SET status = {PROCESSING_CODE}, client_id = ?, updated_at = ?, claimed_ms = ?
+                    WHERE job_id = ? AND status = {PENDING_CODE}
+                    RETURNING {JOB_SELECT}
+                """, (client_id, now_ms, now_ms, entry.job_id)) as cursor:
+                    row = await cursor.fetchone()
+                if row is not None:
+                    return job_row_factory(cursor, row)
+
+        try:
+            return await self.writer.submit(claim)
+        except Exception:
+            # Candidates popped in a rolled-back batch are still pending
+            self.pending.invalidate()
+            raise
+
+    async def shed_pending_jobs(self, job_type: str, min_deadline_ms: int, reason: str) -> List[str]:
+        """
+        Fail pending jobs whose deadline is before min_deadline_ms; returns their IDs
+
+        Nothing is written unless the pending index holds such a job. Jobs another
+        process added are shed once a claim has synced them into the index; until
+        then claims skip them anyway.
+        """
+        if self.pending.loaded:
+            earliest = self.pending.earliest_deadline(job_type)
+            if earliest is None or earliest >= min_deadline_ms:
+                return []
+
+        now_ms = _now_ms()
+
+        async def shed(db):
+            async with db.execute(f"""
                 UPDATE jobs
-                SET status = ?, client_id = ?
-                WHERE job_id = ? AND status = ?
-            """, (JobStatus.PROCESSING, client_id, job_id, JobStatus.PENDING))
-
-            if update_cursor.rowcount != 1:
-                await db.commit()
-                return None
-
-            async with db.execute("""
-                SELECT * FROM jobs WHERE job_id = ?
-            """, (job_id,)) as cursor:
-                claimed = await cursor.fetchone()
-
-            await db.commit()
-
-            if not claimed:
-                return None
-
-            return Job(
-                job_id=claimed['job_id'],
-                prompt=claimed['prompt'],
-                image=claimed['image'],
-                status=claimed['status'],
-                job_type=claimed['job_type'],
-                client_id=claimed['client_id'],
-                request_payload=claimed['request_payload'],
-                text_response=claimed['text_response'],
-                created_at=claimed['created_at'],
-                completed_at=claimed['completed_at'],
-                video_path=claimed['video_path'],
-                error=claimed['error']
-            )
+                SET status = {FAILED_CODE}, error = ?, completed_at = ?, completed_ms = ?, updated_at = ?
+                WHERE status = {PENDING_CODE} AND job_type = ? AND deadline_ms < ?
+                RETURNING job_id
+            """, (reason, now_ms // 1000, now_ms, now_ms, job_type_code(job_type), min_deadline_ms)) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
+
+        job_ids = await self.writer.submit(shed)
+
+        for job_id in job_ids:
+            self.pending.discard(job_id)
+            await self._notify(f"job:{job_id}", JobStatus.FAILED.value)
+        return job_ids
+
+    async def get_service_times(self, job_type: str, limit: int = 50) -> List[int]:
+        """Claim-to-completion milliseconds of the most recent completed jobs of a type"""
+        async with self._connect() as db:
+            async with db.execute(f"""
+                SELECT completed_ms - claimed_ms FROM jobs
+                WHERE status = {COMPLETED_CODE} AND job_type = ? AND claimed_ms IS NOT NULL
+                ORDER BY created_at DESC
+                LIMIT ?
+            """, (job_type_code(job_type), limit)) as cursor:
+                return [row[0] for row in await cursor.fetchall()]
 
     async def update_job_status(self, job_id: str, status: str,
                                video_path: Optional[str] = None,
                                text_response: Optional[str] = None,
-                               error: Optional[str] = None):
-        """Update job status"""
-        completed_at = None
+                               error: Optional[str] = None,
+                               upload_started_ms: Optional[int] = None,
+                               upload_done_ms: Optional[int] = None,
+                               video_sha256: Optional[str] = None) -> bool:
+        """
+        Update job status; upload phase timestamps are only set if not already recorded
+
+        Returns:
+            False if the job was cancelled (a cancelled job keeps that status) or does not exist
+        """
+        now_ms = _now_ms()
+        completed_at = completed_ms = None
         if status in [JobStatus.COMPLETED, JobStatus.FAILED]:
-            completed_at = int(datetime.now().timestamp())
-
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+            completed_at, completed_ms = now_ms // 1000, now_ms
+
+        updated = await self._execute_write(f"""
+            UPDATE jobs
+            SET status = ?, completed_at = ?, video_path = ?, video_sha256 = ?, text_response = ?, error = ?,
+                updated_at = ?, completed_ms = ?,
+                upload_started_ms = COALESCE(upload_started_ms, ?),
+                upload_done_ms = COALESCE(upload_done_ms, ?)
+            WHERE job_id = ? AND status != {CANCELLED_CODE}
+        """, (status_code(status), completed_at, video_path, video_sha256, text_response, error, now_ms,
+              completed_ms, upload_started_ms, upload_done_ms, job_id)) == 1
+
+        if updated:
+            if status_code(status) == PENDING_CODE:
+                self._index_pending(await self.get_job(job_id))
+            else:
+                self.pending.discard(job_id)
+            await self._notify(f"job:{job_id}", status.value if isinstance(status, JobStatus) else status)
+        return updated
+
+    async def cancel_job(self, job_id: str, reason: str, release_key: bool = True) -> bool:
+        """
+        Cancel a pending or processing job
+
+        A worker running it learns on its next heartbeat. With release_key the
+        Idempotency-Key is released, so a retried request creates a new job instead
+        of replaying this one; otherwise retries get the cancelled job.
+
+        Returns:
+            False if the job does not exist or has already finished
+        """
+        now_ms = _now_ms()
+        release = ", idempotency_key = NULL" if release_key else ""
+        cancelled = await self._execute_write(f"""
+            UPDATE jobs
+            SET status = {CANCELLED_CODE}, error = ?, completed_at = ?, completed_ms = ?, updated_at = ?{release}
+            WHERE job_id = ? AND status IN ({PENDING_CODE}, {PROCESSING_CODE})
+        """, (reason, now_ms // 1000, now_ms, now_ms, job_id)) == 1
+
+        if cancelled:
+            self.pending.discard(job_id)
+            await self._notify(f"job:{job_id}", JobStatus.CANCELLED.value)
+        return cancelled
+
+    async def requeue_job(self, job_id: str, error: str, max_attempts: int) -> bool:
+        """
+        Return a processing job to the pending queue for another worker run, at most
+        max_attempts times; the partial text is discarded and the reason kept in error
+
+        Returns:
+            False if the job is not processing or has no attempts left
+        """
+        async def requeue(db):
+            async with db.execute(f"""
+                UPDATE jobs
+                SET status = {PENDING_CODE}, client_id = NULL, text_response = NULL, error = ?,
+                    attempts = attempts + 1, updated_at = ?
+                WHERE job_id = ? AND status = {PROCESSING_CODE} AND attempts < ?
+                RETURNING {PENDING_ENTRY_SELECT}
+            """, (error, _now_ms(), job_id, max_attempts)) as cursor:
+                return await cursor.fetchone()
+
+        row = await self.writer.submit(requeue)
+
+        if row is None:
+            return False
+        entry = _pending_entry(row)
+        self.pending.add(entry, _now_ms())
+        await self._notify(f"jobs:{entry.job_type}", job_id)
+        await self._notify(f"job:{job_id}", JobStatus.PENDING.value)
+        return True
+
+    async def record_phase(self, job_id: str, column: str, at_ms: Optional[int] = None) -> bool:
+        """Set a phase timestamp (one of PHASE_COLUMNS) unless it is already recorded"""
+        if column not in PHASE_COLUMNS:
+            raise ValueError(f"Unknown job phase: {column}")
+        return await self._execute_write(f"""
+            UPDATE jobs SET {column} = ? WHERE job_id = ? AND {column} IS NULL
+        """, (at_ms or _now_ms(), job_id)) == 1
+
+    async def record_heartbeat(self, job_id: str) -> Optional[str]:
+        """
+        Note that a worker is alive on a job; the first one is kept as a phase timestamp
+
+        Returns:
+            The job's current status, or None if the job does not exist
+        """
+        async def heartbeat(db):
+            await db.execute(f"""
+                UPDATE jobs SET first_heartbeat_ms = ?
+                WHERE job_id = ? AND status = {PROCESSING_CODE} AND first_heartbeat_ms IS NULL
+            """, (_now_ms(), job_id))
+            async with db.execute("SELECT status FROM jobs WHERE job_id = ?", (job_id,)) as cursor:
+                return await cursor.fetchone()
+
+        row = await self.writer.submit(heartbeat)
+        return STATUS_NAMES[row[0]] if row else None
+
+    async def append_text_response(self, job_id: str, content: str, offset: Optional[int] = None) -> bool:
+        """
+        Append a streamed delta to a processing job's partial text_response.
+
+        With offset, the text is truncated to that length first so a retried delta
+        is not appended twice; a delta starting past the current end is rejected.
+        Returns False if nothing was applied.
+        """
+        if offset is None:
+            updated = await self._execute_write(f"""
                 UPDATE jobs
-                SET status = ?, completed_at = ?, video_path = ?, text_response = ?, error = ?
-                WHERE job_id = ?
-            """, (status, completed_at, video_path, text_response, error, job_id))
-            await db.commit()
+                SET text_response = COALESCE(text_response, '') || ?, updated_at = ?
+                WHERE job_id = ? AND status = {PROCESSING_CODE}
+            """, (content, _now_ms(), job_id)) == 1
+        else:
+            updated = await self._execute_write(f"""
+                UPDATE jobs
+                SET text_response = substr(COALESCE(text_response, ''), 1, ?) || ?, updated_at = ?
+                WHERE job_id = ? AND status = {PROCESSING_CODE} AND length(COALESCE(text_response, '')) >= ?
+            """, (offset, content, _now_ms(), job_id, offset)) == 1
+
+        if updated:
+            await self._notify(f"job:{job_id}", "delta")
+        return updated
+
+    async def update_media_info(self, job_id: str, duration: Optional[float] = None,
+                                width: Optional[int] = None, height: Optional[int] = None,
+                                video_codec: Optional[str] = None, thumbnail_path: Optional[str] = None,
+                                preview_path: Optional[str] = None):
+        """Store post-processing results for a completed video job"""
+        await self._execute_write("""
+            UPDATE jobs
+            SET duration = ?, width = ?, height = ?, video_codec = ?,
+                thumbnail_path = ?, preview_path = ?, postprocessed_at = ?, updated_at = ?
+            WHERE job_id = ?
+        """, (duration, width, height, video_codec, thumbnail_path, preview_path,
+              int(datetime.now().timestamp()), _now_ms(), job_id))
+
+    async def list_unprocessed_videos(self, limit: int = 100) -> List[Job]:
+        """Completed video jobs not yet post-processed (e.g. after a restart)"""
+        async with self._connect() as db:
+            db.row_factory = job_row_factory
+            async with db.execute(f"""
+                SELECT {JOB_SELECT} FROM jobs
+                WHERE status = {COMPLETED_CODE} AND job_type = ?
+                  AND video_path IS NOT NULL AND postprocessed_at IS NULL
+                ORDER BY completed_at DESC
+                LIMIT ?
+            """, (job_type_code(JobType.VIDEO), limit)) as cursor:
+                return await cursor.fetchall()
+
+    async def find_processed_video(self, video_sha256: str, exclude_job_id: str) -> Optional[Job]:
+        """The latest other post-processed job whose video has this content hash"""
+        async with self._connect() as db:
+            db.row_factory = job_row_factory
+            async with db.execute(f"""
+                SELECT {JOB_SELECT} FROM jobs
+                WHERE video_sha256 = ? AND postprocessed_at IS NOT NULL AND job_id != ?
+                ORDER BY postprocessed_at DESC
+                LIMIT 1
+            """, (video_sha256, exclude_job_id)) as cursor:
+                return await cursor.fetchone()
 
     async def list_jobs(self, status: Optional[str] = None, limit: int = 100) -> List[Job]:
         """List jobs with optional status filter"""
-        async with aiosqlite.connect(self.db_path) as db:
-            db.row_factory = aiosqlite.Row
+        async with self._connect() as db:
+            db.row_factory = job_row_factory
 
             if status:
-                query = "SELECT * FROM jobs WHERE status = ? ORDER BY created_at DESC LIMIT ?"
-                params = (status, limit)
+                if status not in STATUS_CODES:
+                    return []
+                query = f"SELECT {JOB_SELECT} FROM jobs WHERE status = {STATUS_CODES[status]} ORDER BY created_at DESC LIMIT ?"
+                params = (limit,)
             else:
-                query = "SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?"
+                query = f"SELECT {JOB_SELECT} FROM jobs ORDER BY created_at DESC LIMIT ?"
                 params = (limit,)
 
             async with db.execute(query, params) as cursor:
-                rows = await cursor.fetchall()
-
-                return [Job(
-                    job_id=row['job_id'],
-                    prompt=row['prompt'],
-                    image=row['image'],
-                    status=row['status'],
-                    job_type=row['job_type'],
-                    client_id=row['client_id'],
-                    request_payload=row['request_payload'],
-                    text_response=row['text_response'],
-                    created_at=row['created_at'],
-                    completed_at=row['completed_at'],
-                    video_path=row['video_path'],
-                    error=row['error']
-                ) for row in rows]
+                return await cursor.fetchall()
+
+    async def get_change_position(self) -> ChangePosition:
+        """Position of the latest change ((0, '') when empty); a starting point for list_changes"""
+        async with self._connect() as db:
+            async with db.execute("""
+                SELECT updated_at, job_id FROM jobs ORDER BY updated_at DESC, job_id DESC LIMIT 1
+            """) as cursor:
+                row = await cursor.fetchone()
+        return tuple(row) if row is not None else (0, '')
+
+    async def list_changes(self, since: ChangePosition,
+                           limit: int = 500) -> Tuple[List[Job], Optional[int], ChangePosition]:
+        """
+        Jobs created or modified after position `since`, oldest change first
+
+        Pages are keyed by (updated_at, job_id), so a burst of changes larger than
+        `limit` is read page by page. Once a page is not full the caller has caught
+        up, and rows up to CHANGE_FEED_OVERLAP_MS before `since` are returned again
+        (callers merge by job_id). Also returns the time jobs were cleared if that
+        happened after `since` (the caller must drop what it holds), otherwise None,
+        and the position to pass back next.
+        """
+        async with self._connect() as db:
+            async with db.execute("SELECT value FROM meta WHERE key = 'jobs_cleared_at'") as cursor:
+                row = await cursor.fetchone()
+            cleared_at = row[0] if row is not None and row[0] > since[0] else None
+
+            db.row_factory = job_row_factory
+            async with db.execute(f"""
+                SELECT {JOB_SELECT} FROM jobs
+                WHERE (updated_at, job_id) > (?, ?)
+                ORDER BY updated_at, job_id
+                LIMIT ?
+            """, (*since, limit)) as cursor:
+                jobs = await cursor.fetchall()
+
+            position = max(since, (cleared_at or 0, ''), *((job.updated_at, job.job_id) for job in jobs))
+            if len(jobs) < limit:
+                async with db.execute(f"""
+                    SELECT {JOB_SELECT} FROM jobs
+                    WHERE updated_at > ? AND (updated_at, job_id) <= (?, ?)
+                    ORDER BY updated_at DESC, job_id DESC
+                    LIMIT ?
+                """, (since[0] - CHANGE_FEED_OVERLAP_MS, *since, limit)) as cursor:
+                    jobs[:0] = reversed(await cursor.fetchall())
+        return jobs, cleared_at, position
+
+    async def get_queue_stats(self, finished_since: int) -> Dict[str, Tuple[int, int]]:
+        """Return {job_type: (pending_count, finished_since_count)} for admission control"""
+        stats = {job_type.value: (0, 0) for job_type in JobType}
+
+        async with self._connect() as db:
+            async with db.execute(f"""
+                SELECT job_type, COUNT(*) FROM jobs
+                WHERE status = {PENDING_CODE}
+                GROUP BY job_type
+            """) as cursor:
+                pending = {JOB_TYPE_NAMES[code]: count for code, count in await cursor.fetchall()}
+
+            async with db.execute(f"""
+                SELECT job_type, COUNT(*) FROM jobs
+                WHERE completed_at >= ? AND status != {CANCELLED_CODE}
+                GROUP BY job_type
+            """, (finished_since,)) as cursor:
+                finished = {JOB_TYPE_NAMES[code]: count for code, count in await cursor.fetchall()}
+
+        for job_type in set(stats) | set(pending) | set(finished):
+            stats[job_type] = (pending.get(job_type, 0), finished.get(job_type, 0))
+        return stats
 
     async def clear_jobs(self):
         """Delete all jobs from queue storage"""
-        async with aiosqlite.connect(self.db_path) as db:
+        async def clear(db):
             await db.execute("DELETE FROM jobs")
-            await db.commit()
+            await db.execute("DELETE FROM webhook_outbox")
+            await db.execute("""
+                INSERT OR REPLACE INTO meta (key, value) VALUES ('jobs_cleared_at', ?)
+            """, (_now_ms(),))
+
+        await self.writer.submit(clear)
+        self.pending.reset()
 
     async def cleanup_stale_jobs(self, video_timeout_seconds: int = None,
                                  chat_timeout_seconds: int = None):
@@ -299,27 +779,82 @@ class JobQueue:
         if chat_timeout_seconds is None:
             chat_timeout_seconds = config.CHAT_JOB_TIMEOUT_SECONDS
 
-        now_ts = int(datetime.now().timestamp())
+        now_ms = _now_ms()
+        now_ts = now_ms // 1000
         video_cutoff = now_ts - video_timeout_seconds
         chat_cutoff = now_ts - chat_timeout_seconds
 
-        async with aiosqlite.connect(self.db_path) as db:
-            await db.execute("""
+        async def cleanup(db):
+            await db.execute(f"""
                 UPDATE jobs
-                SET status = ?, error = ?, completed_at = ?
-                WHERE status = ? AND job_type = ? AND created_at < ?
-            """, (JobStatus.FAILED, "Video job timed out", now_ts,
-                  JobStatus.PROCESSING, JobType.VIDEO.value, video_cutoff))
+                SET status = {FAILED_CODE}, error = ?, completed_at = ?, updated_at = ?, completed_ms = ?
+                WHERE status = {PROCESSING_CODE} AND job_type = ? AND created_at < ?
+            """, ("Video job timed out", now_ts, now_ms, now_ms, job_type_code(JobType.VIDEO), video_cutoff))
 
-            await db.execute("""
+            await db.execute(f"""
                 UPDATE jobs
-                SET status = ?, error = ?, completed_at = ?
-                WHERE status = ? AND job_type = ? AND created_at < ?
-            """, (JobStatus.FAILED, "Chat job timed out", now_ts,
-                  JobStatus.PROCESSING, JobType.CHAT.value, chat_cutoff))
+                SET status = {FAILED_CODE}, error = ?, completed_at = ?, updated_at = ?, completed_ms = ?
+                WHERE status = {PROCESSING_CODE} AND job_type = ? AND created_at < ?
+            """, ("Chat job timed out", now_ts, now_ms, now_ms, job_type_code(JobType.CHAT), chat_cutoff))
+
+        await self.writer.submit(cleanup)
+
+    async def claim_webhook_deliveries(self, limit: int, lease_ms: int) -> List[Tuple[int, str, str, int]]:
+        """
+        Claim up to `limit` due webhook deliveries, oldest first
+
+        Claimed rows are not due again for lease_ms, so a process that dies mid-delivery
+        only delays them. Returns (delivery_id, job_id, url, attempt) tuples.
+        """
+        now_ms = _now_ms()
+
+        async def claim(db):
+            async with db.execute("""
+                UPDATE webhook_outbox
+                SET next_attempt_ms = ?, attempts = attempts + 1
+                WHERE id IN (
+                    SELECT id FROM webhook_outbox
+                    WHERE delivered_ms IS NULL AND failed_ms IS NULL AND next_attempt_ms <= ?
+                    ORDER BY next_attempt_ms
+                    LIMIT ?
+                )
+                RETURNING id, job_id, url, attempts
+            """, (now_ms + lease_ms, now_ms, limit)) as cursor:
+                return [tuple(row) for row in await cursor.fetchall()]
+
+        return await self.writer.submit(claim)
+
+    async def record_webhook_results(self, results: List[Tuple[int, Optional[int], Optional[int],
+                                                               Optional[int], Optional[int], Optional[str]]]):
+        """
+        Store delivery outcomes in one transaction, as (delivery_id, delivered_ms,
+        failed_ms, next_attempt_ms, last_status, last_error) tuples; a None
+        next_attempt_ms leaves the lease in place
+        """
+        await self.writer.submit(lambda db: db.executemany("""
+            UPDATE webhook_outbox
+            SET delivered_ms = ?, failed_ms = ?, next_attempt_ms = COALESCE(?, next_attempt_ms),
+                last_status = ?, last_error = ?
+            WHERE id = ?
+        """, [(delivered_ms, failed_ms, next_attempt_ms, last_status, last_error, delivery_id)
+              for delivery_id, delivered_ms, failed_ms, next_attempt_ms, last_status, last_error in results]))
+
+    async def get_webhook_backlog(self) -> Tuple[int, Optional[int]]:
+        """(undelivered count, enqueue time of the oldest in epoch ms) of webhooks still to deliver"""
+        async with self._connect() as db:
+            async with db.execute("""
+                SELECT COUNT(*), MIN(created_ms) FROM webhook_outbox
+                WHERE delivered_ms IS NULL AND failed_ms IS NULL
+            """) as cursor:
+                return tuple(await cursor.fetchone())
 
-            await db.commit()
+    async def prune_webhook_deliveries(self, before_ms: int) -> int:
+        """Delete delivered or abandoned webhooks finished before before_ms; returns the count"""
+        return await self._execute_write("""
+            DELETE FROM webhook_outbox
+            WHERE delivered_ms < ? OR failed_ms < ?
+        """, (before_ms, before_ms))
 
 
 # Global job queue instance
-job_queue = JobQueue()
+job_queue = JobQueue(broker=broker)
@@ -0,0 +1,452 @@
+"""
+Rotation, compression, retention and rollups for the request logs.
+
+The logger appends to requests_YYYY-MM-DD.jsonl. Once that file would grow past
+LOG_MAX_FILE_BYTES it is renamed to requests_YYYY-MM-DD.N.jsonl (N = 1, 2, ...)
+and a new one is started; at midnight the day's file is simply left behind. A
+background thread gzips every closed file to .jsonl.gz and writes a small
+.rollup.json beside it: entry, status and error counts plus latency percentiles
+and a latency histogram, overall and per path. Summaries over past days merge
+rollups instead of decompressing raw logs.
+
+Retention then deletes archives older than LOG_RETENTION_DAYS, and the oldest
+archives while they total more than LOG_RETENTION_BYTES. Rollups are kept until
+they reach the age limit, so summaries outlive the raw logs they came from.
+
+Several server processes may share the log directory: rotation and archiving
+claim files with rename/link, which only one process can win.
+"""
+
+import bisect
+import gzip
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import config
+from serialization import loads
+
+_LOG_NAME = re.compile(r'^requests_(\d{4}-\d{2}-\d{2})(?:\.(\d+))?\.(jsonl|jsonl\.gz|rollup\.json)$')
+_JOB_ID = re.compile(r'job_[0-9a-f]{12}')
+
+# Upper bounds (ms) of the rollup latency histogram buckets; one more bucket holds the rest
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000, 120000)
+# A process that opened the active file just before another rotated it may still
+# be appending; closed files are left alone for this long after their last write
+CLOSED_FILE_GRACE_SECONDS = 5
+
+
+def parse_log_name(name: str) -> Optional[Tuple[str, Optional[int], str]]:
+    """(date, segment number or None, kind) for a log directory entry, None for other files"""
+    match = _LOG_NAME.match(name)
+    if match is None:
+        return None
+    day, segment, kind = match.groups()
+    return day, int(segment) if segment else None, kind
+
+
+def _segment_order(name: str) -> Tuple[str, float]:
+    """Chronological sort key: a day's numbered segments come before its unnumbered last file"""
+    day, segment, _ = parse_log_name(name)
+    return day, segment if segment is not None else float('inf')
+
+
+def path_key(method: str, path: str) -> str:
+    """Rollup key for a request: method and path without the query string, job IDs folded"""
+    return f"{method} {_JOB_ID.sub('{job_id}', path.partition('?')[0])}"
+
+
+class _LatencyStats:
+    __slots__ = ('count', 'errors', 'durations')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.durations: List[float] = []
+
+    def add(self, duration_ms: float, error: bool):
+        self.count += 1
+        self.errors += error
+        self.durations.append(duration_ms)
+
+    def to_dict(self) -> Dict[str, Any]:
+        durations = sorted(self.durations)
+        histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        for duration in durations:
+            histogram[bisect.bisect_left(LATENCY_BUCKETS_MS, duration)] += 1
+
+        def percentile(fraction: float) -> Optional[float]:
+            if not durations:
+                return None
+            return round(durations[min(len(durations) - 1, int(fraction * len(durations)))], 3)
+
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "p50_ms": percentile(0.5),
+            "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99),
+            "max_ms": round(durations[-1], 3) if durations else None,
+            "histogram": histogram,
+        }
+
+
+def rollup_lines(lines: Iterable[bytes]) -> Dict[str, Any]:
+    """Counts and latency statistics, overall and per path, of one file's log lines"""
+    overall = _LatencyStats()
+    paths: Dict[str, _LatencyStats] = {}
+    statuses: Counter = Counter()
+    first_timestamp = last_timestamp = None
+
+    for line in lines:
+        try:
+            entry = loads(line)
+        except ValueError:
+            continue
+        if not isinstance(entry, dict) or entry.get('type') != 'request':
+            continue
+        status = entry.get('status', 0)
+        error = status >= 400 or 'error' in entry
+        duration_ms = entry.get('duration', 0) * 1000
+        overall.add(duration_ms, error)
+        key = path_key(entry.get('method', ''), entry.get('path', ''))
+        stats = paths.get(key)
+        if stats is None:
+            stats = paths[key] = _LatencyStats()
+        stats.add(duration_ms, error)
+        statuses[str(status)] += 1
+        timestamp = entry.get('timestamp')
+        if timestamp:
+            first_timestamp = min(first_timestamp or timestamp, timestamp)
+            last_timestamp = max(last_timestamp or timestamp, timestamp)
+
+    return {
+        "first_timestamp": first_timestamp,
+        "last_timestamp": last_timestamp,
+        "statuses": dict(statuses),
+        "latency": overall.to_dict(),
+        "paths": {key: stats.to_dict() for key, stats in sorted(paths.items())},
+    }
+
+
+def _histogram_percentile(histogram: List[int], fraction: float, max_ms: Optional[float]) -> Optional[float]:
+    """Upper bound of the bucket holding the percentile (the maximum for the last bucket)"""
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = min(total - 1, int(fraction * total))
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if seen > rank:
+            bound = LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else max_ms
+            return min(bound, max_ms) if max_ms is not None else bound
+    return max_ms
+
+
+def _merge_stats(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Combine per-file latency stats; percentiles of several files come from the merged histogram"""
+    if len(parts) == 1:
+        return parts[0]
+    histogram = [sum(counts) for counts in zip(*(part['histogram'] for part in parts))]
+    maxima = [part['max_ms'] for part in parts if part['max_ms'] is not None]
+    max_ms = max(maxima) if maxima else None
+    return {
+        "count": sum(part['count'] for part in parts),
+        "errors": sum(part['errors'] for part in parts),
+        "p50_ms": _histogram_percentile(histogram, 0.5, max_ms),
+        "p95_ms": _histogram_percentile(histogram, 0.95, max_ms),
+        "p99_ms": _histogram_percentile(histogram, 0.99, max_ms),
+        "max_ms": max_ms,
+        "histogram": histogram,
+    }
+
+
+def merge_rollups(rollups: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """One rollup covering all the given ones"""
+    statuses: Counter = Counter()
+    paths: Dict[str, List[Dict[str, Any]]] = {}
+    for rollup in rollups:
+        statuses.update(rollup['statuses'])
+        for key, stats in rollup['paths'].items():
+            paths.setdefault(key, []).append(stats)
+    firsts = [r['first_timestamp'] for r in rollups if r['first_timestamp']]
+    lasts = [r['last_timestamp'] for r in rollups if r['last_timestamp']]
+    return {
+        "first_timestamp": min(firsts) if firsts else None,
+        "last_timestamp": max(lasts) if lasts else None,
+        "statuses": dict(statuses),
+        "latency": _merge_stats([r['latency'] for r in rollups]) if rollups else _LatencyStats().to_dict(),
+        "paths": {key: _merge_stats(parts) for key, parts in sorted(paths.items())},
+    }
+
+
+class LogArchiver:
+    """
+    Background rotation, compression and retention for one log directory.
+
+    Archiving is best-effort: a failure leaves the closed file in place to be
+    retried on the next pass, never affects logging.
+    """
+
+    def __init__(self, log_dir: Callable[[], Path], active_file: Callable[[], Path]):
+        self._log_dir = log_dir
+        self._active_file = active_file
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = False
+        self._lock = threading.Lock()
+        # Rollups of uncompressed files, keyed by (name, size, mtime)
+        self._live_rollups: Dict[str, Tuple[Tuple[int, int], Dict[str, Any]]] = {}
+        self._stats = {
+            "files_rotated": 0,
+            "files_archived": 0,
+            "archived_raw_bytes": 0,
+            "archived_bytes": 0,
+            "files_deleted": 0,
+            "archive_errors": 0,
+            "archive_seconds": 0.0,
+        }
+
+    @property
+    def log_dir(self) -> Path:
+        return self._log_dir()
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopped = False
+            self._thread = threading.Thread(target=self._loop, name='log-archiver', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        thread = self._thread
+        if thread is not None:
+            self._stopped = True
+            self._wakeup.set()
+            thread.join(timeout=5)
+            self._thread = None
+
+    def _loop(self):
+        while not self._stopped:
+            self.run_once()
+            self._wakeup.wait(config.LOG_ARCHIVE_INTERVAL_SECONDS)
+            self._wakeup.clear()
+
+    def rotate(self, path: Path) -> bool:
+        """
+        Close an active file that has reached LOG_MAX_FILE_BYTES by renaming it to
+        the day's next segment number; False if another process rotated it first
+        """
+        claimed = path.with_name(f"{path.name}.rotating.{os.getpid()}")
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return False
+        day = parse_log_name(path.name)[0]
+        segment = 1 + max([parse_log_name(p.name)[1] or 0 for p in self.log_dir.glob(f"requests_{day}.*")
+                           if parse_log_name(p.name)], default=0)
+        while True:
+            # link() fails if the name is taken, so concurrent rotations never share a segment number
+            try:
+                os.link(claimed, path.with_name(f"requests_{day}.{segment}.jsonl"))
+                break
+            except FileExistsError:
+                segment += 1
+        claimed.unlink()
+        self._stats["files_rotated"] += 1
+        self._wakeup.set()
+        return True
+
+    def closed_files(self) -> List[Path]:
+        """Uncompressed log files no longer written to, oldest first"""
+        active = self._active_file().name
+        cutoff = time.time() - CLOSED_FILE_GRACE_SECONDS
+        closed = []
+        for path in self.log_dir.glob("requests_*.jsonl"):
+            parsed = parse_log_name(path.name)
+            if parsed is None or path.name == active:
+                continue
+            try:
+                if path.stat().st_mtime > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            closed.append(path)
+        return sorted(closed, key=lambda p: _segment_order(p.name))
+
+    def run_once(self):
+        for path in self.closed_files():
+            if self._stopped:
+                return
+            try:
+                self.archive(path)
+            except Exception as e:
+                self._stats["archive_errors"] += 1
+                print(f"Failed to archive log {path.name}: {e}")
+        try:
+            self.apply_retention()
+        except Exception as e:
+            print(f"Failed to apply log retention: {e}")
+
+    def archive(self, path: Path) -> Optional[Path]:
+        """Gzip a closed file and write its rollup in one pass; None if another process did it first"""
+        started = time.perf_counter()
+        stem = path.name[:-len('.jsonl')]
+        archive_path = path.with_name(f"{stem}.jsonl.gz")
+        rollup_path = path.with_name(f"{stem}.rollup.json")
+        tmp_archive = path.with_name(f"{stem}.jsonl.gz.{os.getpid()}")
+        tmp_rollup = path.with_name(f"{stem}.rollup.json.{os.getpid()}")
+
+        try:
+            with open(path, 'rb') as source, gzip.open(tmp_archive, 'wb') as target:
+                def lines():
+                    for line in source:
+                        target.write(line)
+                        yield line
+                rollup = rollup_lines(lines())
+        except FileNotFoundError:
+            tmp_archive.unlink(missing_ok=True)
+            return None
+
+        raw_bytes = path.stat().st_size
+        rollup.update(file=archive_path.name, date=parse_log_name(path.name)[0],
+                      raw_bytes=raw_bytes, compressed_bytes=tmp_archive.stat().st_size)
+        # Rollup before the archive: a file with an archive always has its rollup
+        tmp_rollup.write_text(json.dumps(rollup), encoding='utf-8')
+        os.replace(tmp_rollup, rollup_path)
+        try:
+            os.link(tmp_archive, archive_path)
+            won = True
+        except FileExistsError:
+            won = False
+        finally:
+            tmp_archive.unlink(missing_ok=True)
+        path.unlink(missing_ok=True)
+        self._live_rollups.pop(path.name, None)
+
+        if not won:
+            return None
+        self._stats["files_archived"] += 1
+        self._stats["archived_raw_bytes"] += raw_bytes
+        self._stats["archived_bytes"] += rollup["compressed_bytes"]
+        self._stats["archive_seconds"] += time.perf_counter() - started
+        return archive_path
+
+    def apply_retention(self, today: date = None):
+        """Delete archives and rollups past LOG_RETENTION_DAYS, then the oldest archives over LOG_RETENTION_BYTES"""
+        today = today or datetime.now().date()
+        oldest_kept = (today - timedelta(days=config.LOG_RETENTION_DAYS)).isoformat()
+        archives = []
+        for path in self.log_dir.glob("requests_*"):
+            parsed = parse_log_name(path.name)
+            if parsed is None or parsed[2] == 'jsonl':
+                continue
+            if config.LOG_RETENTION_DAYS and parsed[0] < oldest_kept:
+                path.unlink(missing_ok=True)
+                self._stats["files_deleted"] += 1
+            elif parsed[2] == 'jsonl.gz':
+                archives.append(path)
+
+        if not config.LOG_RETENTION_BYTES:
+            return
+        sizes = {}
+        for path in archives:
+            try:
+                sizes[path] = path.stat().st_size
+            except FileNotFoundError:
+                pass
+        total = sum(sizes.values())
+        for path in sorted(sizes, key=lambda p: _segment_order(p.name)):
+            if total <= config.LOG_RETENTION_BYTES:
+                break
+            path.unlink(missing_ok=True)
+            total -= sizes[path]
+            self._stats["files_deleted"] += 1
+
+    def _live_rollup(self, path: Path) -> Optional[Dict[str, Any]]:
+        """Rollup of a file not archived yet, recomputed only when it has changed"""
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return None
+        version = (stat.st_size, stat.st_mtime_ns)
+        cached = self._live_rollups.get(path.name)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        with open(path, 'rb') as f:
+            rollup = rollup_lines(f)
+        rollup.update(file=path.name, date=parse_log_name(path.name)[0],
+                      raw_bytes=stat.st_size, compressed_bytes=None, raw_available=True)
+        self._live_rollups[path.name] = (version, rollup)
+        return rollup
+
+    def rollups(self, start: str = None, end: str = None) -> List[Dict[str, Any]]:
+        """Rollups of every log file dated start..end (inclusive, YYYY-MM-DD), oldest first"""
+        rollups = []
+        for path in self.log_dir.glob("requests_*"):
+            parsed = parse_log_name(path.name)
+            if parsed is None or parsed[2] == 'jsonl.gz':
+                continue
+            if (start and parsed[0] < start) or (end and parsed[0] > end):
+                continue
+            try:
+                if parsed[2] == 'jsonl':
+                    rollup = self._live_rollup(path)
+                else:
+                    rollup = json.loads(path.read_text(encoding='utf-8'))
+                    # False once retention has removed the archive; the rollup still counts
+                    rollup["raw_available"] = path.with_name(rollup["file"]).exists()
+            except (FileNotFoundError, ValueError):
+                continue
+            if rollup is not None:
+                rollups.append(rollup)
+        return sorted(rollups, key=lambda r: _segment_order(r["file"].removesuffix('.gz')))
+
+    def day_files(self, day: str) -> List[Path]:
+        """A day's raw log files, oldest first: one per segment, compressed once archived"""
+        files: Dict[Optional[int], Path] = {}
+        for path in self.log_dir.glob(f"requests_{day}.*"):
+            parsed = parse_log_name(path.name)
+            if parsed is None or parsed[0] != day or parsed[2] == 'rollup.json':
+                continue
+            # While a segment is being archived both exist; the uncompressed one is read
+            if parsed[2] == 'jsonl' or parsed[1] not in files:
+                files[parsed[1]] = path
+        return sorted(files.values(), key=lambda p: _segment_order(p.name))
+
+    def tail(self, day: str, limit: int) -> List[bytes]:
+        """The last limit lines logged on day, oldest first, read across its segments"""
+        lines: deque = deque()
+        for path in reversed(self.day_files(day)):
+            if len(lines) >= limit:
+                break
+            # A segment archived since it was listed is read from its archive
+            for candidate in (path, path.with_name(path.name[:-len('.jsonl')] + '.jsonl.gz')):
+                try:
+                    with (gzip.open if candidate.name.endswith('.gz') else open)(candidate, 'rb') as f:
+                        lines.extendleft(reversed(deque(f, maxlen=limit - len(lines))))
+                    break
+                except FileNotFoundError:
+                    if candidate.name.endswith('.gz'):
+                        break
+        return list(lines)
+
+    def summary(self, start: str = None, end: str = None) -> Dict[str, Any]:
+        """Per-file totals and merged per-path statistics over a date range"""
+        rollups = self.rollups(start, end)
+        files = [{key: rollup.get(key) for key in ("file", "date", "first_timestamp", "last_timestamp",
+                                                     "raw_bytes", "compressed_bytes", "raw_available")}
+                 | {"count": rollup["latency"]["count"], "errors": rollup["latency"]["errors"]}
+                 for rollup in rollups]
+        return {"start": start, "end": end, "files": files, "total": merge_rollups(rollups)}
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats)
@@ -1,89 +1,208 @@
-import json
-import logging
+import contextvars
+import random
+import re
+import threading
+import time
 from datetime import datetime
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional
 import config
+from log_archive import LogArchiver
+from serialization import dumps
 
-# Setup log directory
-LOG_DIR = Path(config.LOG_PATH)
-LOG_DIR.mkdir(exist_ok=True)
+# Per-request annotations (job_id, payload summary, error) filled in by handlers
+_log_context: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar('log_context', default=None)
+
+
+def _parse_sample_rates(spec: str) -> Dict[str, float]:
+    rates = {}
+    for item in spec.split(','):
+        route, sep, rate = item.strip().rpartition('=')
+        if sep and route:
+            rates[route] = max(0.0, min(1.0, float(rate)))
+    return rates
+
+
+# Query parameters holding credentials; their values never reach the log files
+_SECRET_QUERY = re.compile(r'(^|&)(token|access_token|api_key)=[^&]*')
+
+
+def redact_query(query: str) -> str:
+    """Query string with credential values replaced, for logging"""
+    return _SECRET_QUERY.sub(r'\1\2=REDACTED', query)
+
+
+def describe_image(image: Optional[str]) -> Optional[str]:
+    """Placeholder for base64 image data so logs never hold the image itself"""
+    if isinstance(image, str) and len(image) > 100:
+        return f"<base64_data:{len(image)}_chars>"
+    return image
 
 
 class StructuredLogger:
-    def __init__(self):
-        self.log_dir = LOG_DIR
+    def __init__(self, log_dir: str = None):
+        self._root = log_dir
+        self._log_dir: Optional[Path] = None
+        self._sample_rates: Optional[Dict[str, float]] = None
+        self._buffer: List[bytes] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._writer: Optional[threading.Thread] = None
+        self._stopped = False
+        self.archiver = LogArchiver(lambda: self.log_dir, self.get_log_file)
+        self._stats = {
+            "entries_logged": 0,
+            "entries_sampled_out": 0,
+            "entries_written": 0,
+            "flushes": 0,
+            "write_seconds": 0.0,
+            "overhead_seconds": 0.0,
+        }
+
+    @property
+    def log_dir(self) -> Path:
+        """Log directory, created on first use rather than at import"""
+        if self._log_dir is None:
+            log_dir = Path(self._root or config.LOG_PATH)
+            log_dir.mkdir(parents=True, exist_ok=True)
+            self._log_dir = log_dir
+        return self._log_dir
+
+    @property
+    def sample_rates(self) -> Dict[str, float]:
+        if self._sample_rates is None:
+            self._sample_rates = _parse_sample_rates(config.LOG_SAMPLE_RATES)
+        return self._sample_rates
 
     def get_log_file(self) -> Path:
         """Get today's log file path"""
         date_str = datetime.now().strftime('%Y-%m-%d')
         return self.log_dir / f"requests_{date_str}.jsonl"
 
-    def log_request(self, method: str, path: str, job_id: str = None, payload: Dict[str, Any] = None):
-        """Log incoming request"""
+    def begin_request(self) -> contextvars.Token:
+        """Start collecting annotations for the current request"""
+        return _log_context.set({})
+
+    def end_request(self, token: contextvars.Token) -> Dict[str, Any]:
+        annotations = _log_context.get() or {}
+        _log_context.reset(token)
+        return annotations
+
+    def annotate(self, **fields):
+        """Attach fields (job_id, payload, error, ...) to the current request's log entry"""
+        context = _log_context.get()
+        if context is not None:
+            context.update((key, value) for key, value in fields.items() if value is not None)
+
+    def should_log(self, route: str, status: int, annotations: Dict[str, Any]) -> bool:
+        """Errors and job-bearing requests are always kept; the rest are sampled per route"""
+        if status >= 400 or 'job_id' in annotations or 'error' in annotations:
+            return True
+        rate = self.sample_rates.get(route, 1.0)
+        return rate >= 1.0 or (rate > 0.0 and random.random() < rate)
+
+    def log_http(self, timestamp: str, method: str, path: str, route: str, status: int,
+                 duration: float, request_size: int, response_size: int,
+                 annotations: Dict[str, Any]):
+        """Record one completed HTTP request"""
+        started = time.perf_counter()
+        if not self.should_log(route, status, annotations):
+            self._stats["entries_sampled_out"] += 1
+            self._stats["overhead_seconds"] += time.perf_counter() - started
+            return
+
         log_entry = {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "timestamp": timestamp,
             "type": "request",
             "method": method,
             "path": path,
+            "status": status,
+            "duration": round(duration, 6),
+            "request_size": request_size,
+            "response_size": response_size,
         }
-
-        if job_id:
-            log_entry["job_id"] = job_id
-
-        if payload:
-            # Sanitize large base64 data
-            log_entry["payload"] = self._sanitize_payload(payload)
-
+        log_entry.update(annotations)
         self._write_log(log_entry)
+        self._stats["overhead_seconds"] += time.perf_counter() - started
 
-    def _sanitize_payload(self, payload: Dict[str, Any]) -> Dict[str, Any]:
-        """Remove or truncate large base64 data from payload"""
-        sanitized = payload.copy()
+    def _write_log(self, log_entry: Dict[str, Any]):
+        """Queue log entry for the background writer"""
+        line = dumps(log_entry) + b'\n'
+        with self._lock:
+            self._buffer.append(line)
+            pending = len(self._buffer)
+        self._stats["entries_logged"] += 1
 
-        if 'image' in sanitized and sanitized['image']:
-            # If image is present, just log that it exists and its size
-            image_data = sanitized['image']
-            if isinstance(image_data, str) and len(image_data) > 100:
-                sanitized['image'] = f"<base64_data:{len(image_data)}_chars>"
+        if self._writer is None:
+            self._start_writer()
+        if pending >= config.LOG_BUFFER_MAX_ENTRIES:
+            self._wakeup.set()
 
-        return sanitized
+    def _start_writer(self):
+        with self._lock:
+            if self._writer is not None:
+                return
+            self._stopped = False
+            self._writer = threading.Thread(target=self._writer_loop, name='log-writer', daemon=True)
+            self._writer.start()
+        self.archiver.start()
 
-    def log_response(self, job_id: str = None, status: str = None, duration: float = None,
-                     video_size: int = None, error: str = None):
-        """Log response"""
-        log_entry = {
-            "timestamp": datetime.utcnow().isoformat() + "Z",
-            "type": "response",
-        }
+    def _writer_loop(self):
+        while not self._stopped:
+            self._wakeup.wait(config.LOG_FLUSH_INTERVAL_SECONDS)
+            self._wakeup.clear()
+            self.flush()
 
-        if job_id:
-            log_entry["job_id"] = job_id
-        if status:
-            log_entry["status"] = status
-        if duration is not None:
-            log_entry["duration"] = duration
-        if video_size:
-            log_entry["video_size"] = video_size
-        if error:
-            log_entry["error"] = error
-
-        self._write_log(log_entry)
+    def flush(self):
+        """Write buffered entries to today's log file in one append, rotating it first if full"""
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if not lines:
+            return
 
-    def _write_log(self, log_entry: Dict[str, Any]):
-        """Write log entry to file"""
+        started = time.perf_counter()
         try:
             log_file = self.get_log_file()
-            with open(log_file, 'a', encoding='utf-8') as f:
-                f.write(json.dumps(log_entry) + '\n')
+            data = b''.join(lines)
+            if config.LOG_MAX_FILE_BYTES:
+                try:
+                    size = log_file.stat().st_size
+                except FileNotFoundError:
+                    size = 0
+                if size and size + len(data) > config.LOG_MAX_FILE_BYTES:
+                    self.archiver.rotate(log_file)
+            with open(log_file, 'ab') as f:
+                f.write(data)
+            self._stats["entries_written"] += len(lines)
         except Exception as e:
             print(f"Failed to write log: {e}")
+        self._stats["flushes"] += 1
+        self._stats["write_seconds"] += time.perf_counter() - started
+
+    def close(self):
+        """Stop the background writer and flush remaining entries"""
+        writer = self._writer
+        if writer is not None:
+            self._stopped = True
+            self._wakeup.set()
+            writer.join(timeout=5)
+            self._writer = None
+        self.archiver.stop()
+        self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        """Logging counters, including time spent on the request path and in the writer"""
+        with self._lock:
+            buffered = len(self._buffer)
+        return {**self._stats, "buffered": buffered, "archive": self.archiver.stats()}
 
     def clear_logs(self) -> int:
-        """Delete all structured log files and return deleted count"""
+        """Delete all structured log files, archives and rollups and return deleted count"""
+        with self._lock:
+            self._buffer = []
         deleted = 0
         try:
-            for file_path in self.log_dir.glob("requests_*.jsonl"):
+            for file_path in self.log_dir.glob("requests_*"):
                 file_path.unlink(missing_ok=True)
                 deleted += 1
         except Exception as e:
@@ -91,5 +210,82 @@ class StructuredLogger:
         return deleted
 
 
+class RequestLoggingMiddleware:
+    """
+    ASGI middleware that logs every HTTP request once, after the response is sent.
+
+    Request and response bodies are only measured as they stream through, never
+    buffered or copied; handlers add job ids and payload summaries via
+    `logger.annotate`.
+    """
+
+    def __init__(self, app, structured_logger: StructuredLogger = None):
+        self.app = app
+        self.logger = structured_logger or logger
+        self._route_paths: Dict[Any, str] = {}
+
+    def _route_template(self, scope) -> str:
+        """Path template of the matched route (e.g. /videos/{job_id}.mp4), used for sampling"""
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return scope.get("path", "")
+        template = self._route_paths.get(endpoint)
+        if template is None:
+            template = next(
+                (route.path for route in getattr(scope.get("app"), "routes", [])
+                 if getattr(route, "endpoint", None) is endpoint),
+                scope.get("path", "")
+            )
+            self._route_paths[endpoint] = template
+        return template
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timestamp = datetime.utcnow().isoformat() + "Z"
+        started = time.perf_counter()
+        # Arrival time before the body is read, as request.state.received_at (epoch seconds)
+        scope.setdefault("state", {})["received_at"] = time.time()
+        sizes = {"request": 0, "response": 0}
+        status = 500
+
+        async def counting_receive():
+            message = await receive()
+            if message["type"] == "http.request":
+                sizes["request"] += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                sizes["response"] += len(message.get("body", b""))
+            await send(message)
+
+        token = self.logger.begin_request()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            annotations = self.logger.end_request(token)
+            path = scope.get("path", "")
+            query = scope.get("query_string", b"")
+            if query:
+                path = f"{path}?{redact_query(query.decode('latin-1'))}"
+            self.logger.log_http(
+                timestamp=timestamp,
+                method=scope.get("method", ""),
+                path=path,
+                route=self._route_template(scope),
+                status=status,
+                duration=time.perf_counter() - started,
+                request_size=sizes["request"],
+                response_size=sizes["response"],
+                annotations=annotations
+            )
+
+
 # Global logger instance
 logger = StructuredLogger()
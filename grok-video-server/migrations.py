@@ -0,0 +1,319 @@
+"""
+Versioned schema migrations for the jobs database.
+
+The applied version is kept in `PRAGMA user_version`. Each migration runs once,
+in order, inside its own write transaction, so several server processes starting
+together apply it exactly once. Migrations are frozen: never edit one that has
+shipped, add a new one instead.
+"""
+
+from typing import Awaitable, Callable, List, Tuple
+
+import aiosqlite
+
+
+async def _baseline(db: aiosqlite.Connection):
+    """Version 1: the jobs table as it was before versioning (TEXT enums)"""
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            prompt TEXT NOT NULL,
+            image TEXT,
+            status TEXT NOT NULL,
+            job_type TEXT NOT NULL DEFAULT 'video',
+            client_id TEXT,
+            request_payload TEXT,
+            text_response TEXT,
+            created_at INTEGER NOT NULL,
+            completed_at INTEGER,
+            video_path TEXT,
+            error TEXT,
+            duration REAL,
+            width INTEGER,
+            height INTEGER,
+            video_codec TEXT,
+            thumbnail_path TEXT,
+            preview_path TEXT,
+            postprocessed_at INTEGER
+        )
+    """)
+
+    # Databases created before versioning may lack columns added over time.
+    async with db.execute("PRAGMA table_info(jobs)") as cursor:
+        columns = {row[1] for row in await cursor.fetchall()}
+    for column, definition in (
+        ('job_type', "TEXT NOT NULL DEFAULT 'video'"),
+        ('client_id', 'TEXT'),
+        ('request_payload', 'TEXT'),
+        ('text_response', 'TEXT'),
+        ('duration', 'REAL'),
+        ('width', 'INTEGER'),
+        ('height', 'INTEGER'),
+        ('video_codec', 'TEXT'),
+        ('thumbnail_path', 'TEXT'),
+        ('preview_path', 'TEXT'),
+        ('postprocessed_at', 'INTEGER'),
+    ):
+        if column not in columns:
+            await db.execute(f"ALTER TABLE jobs ADD COLUMN {column} {definition}")
+
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_status ON jobs(status)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_status_job_type ON jobs(status, job_type)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_created_at ON jobs(created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_completed_at ON jobs(completed_at)")
+
+
+async def _integer_enums(db: aiosqlite.Connection):
+    """
+    Version 2: store status and job_type as small integers and index for the claim query.
+
+    status: 0 pending, 1 processing, 2 completed, 3 failed, 4 cancelled (added after
+    version 7 without a migration; the column needed no change)
+    job_type: 0 video, 1 chat
+    """
+    await db.execute("""
+        CREATE TABLE jobs_v2 (
+            job_id TEXT PRIMARY KEY,
+            prompt TEXT NOT NULL,
+            image TEXT,
+            status INTEGER NOT NULL,
+            job_type INTEGER NOT NULL DEFAULT 0,
+            client_id TEXT,
+            request_payload TEXT,
+            text_response TEXT,
+            created_at INTEGER NOT NULL,
+            completed_at INTEGER,
+            video_path TEXT,
+            error TEXT,
+            duration REAL,
+            width INTEGER,
+            height INTEGER,
+            video_codec TEXT,
+            thumbnail_path TEXT,
+            preview_path TEXT,
+            postprocessed_at INTEGER
+        )
+    """)
+    await db.execute("""
+        INSERT INTO jobs_v2
+        SELECT job_id, prompt, image,
+               CASE status WHEN 'pending' THEN 0 WHEN 'processing' THEN 1
+                           WHEN 'completed' THEN 2 ELSE 3 END,
+               CASE job_type WHEN 'chat' THEN 1 ELSE 0 END,
+               client_id, request_payload, text_response, created_at, completed_at,
+               video_path, error, duration, width, height, video_codec,
+               thumbnail_path, preview_path, postprocessed_at
+        FROM jobs
+    """)
+    await db.execute("DROP TABLE jobs")
+    await db.execute("ALTER TABLE jobs_v2 RENAME TO jobs")
+
+    # Claim/list by status and type in created_at order without a sort step. Not covering:
+    # the claim reads the row's other columns, one rowid lookup for the single row it takes.
+    await db.execute("CREATE INDEX idx_status_type_created ON jobs(status, job_type, created_at)")
+    # Only pending rows: stays tiny however many finished jobs accumulate
+    await db.execute("CREATE INDEX idx_pending ON jobs(job_type, created_at) WHERE status = 0")
+    await db.execute("CREATE INDEX idx_created_at ON jobs(created_at)")
+    await db.execute("CREATE INDEX idx_completed_at ON jobs(completed_at)")
+
+
+async def _updated_at(db: aiosqlite.Connection):
+    """Version 3: updated_at (epoch milliseconds) on every row for the change feed"""
+    await db.execute("ALTER TABLE jobs ADD COLUMN updated_at INTEGER NOT NULL DEFAULT 0")
+    await db.execute("UPDATE jobs SET updated_at = COALESCE(completed_at, created_at) * 1000")
+    await db.execute("CREATE INDEX idx_updated_at ON jobs(updated_at)")
+    # Small key/value table; holds jobs_cleared_at so feeds can tell clients to reset
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER
+        )
+    """)
+
+
+async def _idempotency_keys(db: aiosqlite.Connection):
+    """Version 4: Idempotency-Key of the submission that created a job, unique while held"""
+    await db.execute("ALTER TABLE jobs ADD COLUMN idempotency_key TEXT")
+    # Hash of the original request, to reject a key reused for a different request
+    await db.execute("ALTER TABLE jobs ADD COLUMN idempotency_fingerprint TEXT")
+    await db.execute("ALTER TABLE jobs ADD COLUMN idempotency_expires_at INTEGER")
+    # Partial: most jobs carry no key and stay out of the index
+    await db.execute("""
+        CREATE UNIQUE INDEX idx_idempotency_key ON jobs(idempotency_key)
+        WHERE idempotency_key IS NOT NULL
+    """)
+
+
+async def _phase_timestamps(db: aiosqlite.Connection):
+    """Version 5: epoch-millisecond timestamp of each phase a job passes through"""
+    for column in ('enqueued_ms', 'claimed_ms', 'first_heartbeat_ms',
+                   'upload_started_ms', 'upload_done_ms', 'completed_ms'):
+        await db.execute(f"ALTER TABLE jobs ADD COLUMN {column} INTEGER")
+    # Only the endpoints are known for existing jobs
+    await db.execute("UPDATE jobs SET enqueued_ms = created_at * 1000, completed_ms = completed_at * 1000")
+
+
+async def _chat_sessions(db: aiosqlite.Connection):
+    """Version 6: session affinity, so a conversation's next turn goes back to the same worker"""
+    await db.execute("ALTER TABLE jobs ADD COLUMN session_id TEXT")
+    # Latest completed turn of the session when this job was created, and its worker
+    await db.execute("ALTER TABLE jobs ADD COLUMN previous_job_id TEXT")
+    await db.execute("ALTER TABLE jobs ADD COLUMN preferred_client_id TEXT")
+    # Other workers may claim the job from this time (epoch ms)
+    await db.execute("ALTER TABLE jobs ADD COLUMN affinity_until_ms INTEGER")
+    await db.execute("""
+        CREATE INDEX idx_session ON jobs(session_id, created_at)
+        WHERE session_id IS NOT NULL
+    """)
+
+
+async def _dispatch_attempts(db: aiosqlite.Connection):
+    """Version 7: count of re-dispatches after output that failed response_format validation"""
+    await db.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+
+async def _deadlines(db: aiosqlite.Connection):
+    """Version 8: per-job deadline (epoch ms) for deadline-aware dispatch; NULL means none"""
+    await db.execute("ALTER TABLE jobs ADD COLUMN deadline_ms INTEGER")
+    # Finds pending jobs that can no longer finish without scanning the backlog
+    await db.execute("CREATE INDEX idx_pending_deadline ON jobs(job_type, deadline_ms) WHERE status = 0")
+
+
+async def _webhooks(db: aiosqlite.Connection):
+    """Version 9: per-job callback URL and the outbox of completion webhooks to deliver"""
+    await db.execute("ALTER TABLE jobs ADD COLUMN callback_url TEXT")
+    await db.execute("""
+        CREATE TABLE webhook_outbox (
+            id INTEGER PRIMARY KEY,
+            job_id TEXT NOT NULL,
+            url TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_ms INTEGER NOT NULL,
+            created_ms INTEGER NOT NULL,
+            delivered_ms INTEGER,
+            failed_ms INTEGER,
+            last_status INTEGER,
+            last_error TEXT
+        )
+    """)
+    await db.execute("""
+        CREATE INDEX idx_webhook_due ON webhook_outbox(next_attempt_ms)
+        WHERE delivered_ms IS NULL AND failed_ms IS NULL
+    """)
+    # Queued in the same transaction as the status change, whichever code path finishes
+    # the job (completion, failure, cancellation, shedding, stale cleanup), and only once
+    await db.execute("""
+        CREATE TRIGGER jobs_webhook_outbox AFTER UPDATE OF status ON jobs
+        WHEN NEW.callback_url IS NOT NULL AND NEW.status IN (2, 3, 4) AND OLD.status NOT IN (2, 3, 4)
+        BEGIN
+            INSERT INTO webhook_outbox (job_id, url, next_attempt_ms, created_ms)
+            VALUES (NEW.job_id, NEW.callback_url, NEW.updated_at, NEW.updated_at);
+        END
+    """)
+
+
+async def _pending_changes(db: aiosqlite.Connection):
+    """Version 10: pending jobs by updated_at, for syncing the in-memory pending index"""
+    # Other server processes' new and requeued jobs are found without reading finished rows
+    await db.execute("CREATE INDEX idx_pending_updated ON jobs(updated_at) WHERE status = 0")
+
+
+async def _video_hashes(db: aiosqlite.Connection):
+    """Version 11: content hash of each job's video, for sharing storage and post-processing"""
+    await db.execute("ALTER TABLE jobs ADD COLUMN video_sha256 TEXT")
+    await db.execute("CREATE INDEX idx_jobs_video_sha256 ON jobs(video_sha256) WHERE video_sha256 IS NOT NULL")
+
+
+async def _change_feed_keyset(db: aiosqlite.Connection):
+    """Version 12: change feed pages by (updated_at, job_id), so ties never stall a full page"""
+    await db.execute("CREATE INDEX idx_updated_job ON jobs(updated_at, job_id)")
+    await db.execute("DROP INDEX idx_updated_at")
+
+
+async def _broker_events(db: aiosqlite.Connection):
+    """Version 13: messages the SQLite broker passes between server processes"""
+    # Created on demand by earlier versions of the broker
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS broker_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            channel TEXT NOT NULL,
+            message TEXT,
+            created_at REAL NOT NULL
+        )
+    """)
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_broker_events_channel ON broker_events(channel, id)")
+    await db.execute("DROP TABLE IF EXISTS broker_cache")
+
+
+async def _broker_counters(db: aiosqlite.Connection):
+    """Version 14: counters the SQLite broker shares between server processes"""
+    await db.execute("""
+        CREATE TABLE broker_counters (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    """)
+
+
+Migration = Tuple[int, str, Callable[[aiosqlite.Connection], Awaitable[None]]]
+
+MIGRATIONS: List[Migration] = [
+    (1, "baseline jobs table", _baseline),
+    (2, "integer enums, claim-order and partial pending indexes", _integer_enums),
+    (3, "updated_at change feed column", _updated_at),
+    (4, "idempotency keys", _idempotency_keys),
+    (5, "job phase timestamps", _phase_timestamps),
+    (6, "chat session affinity", _chat_sessions),
+    (7, "re-dispatch attempts", _dispatch_attempts),
+    (8, "job deadlines", _deadlines),
+    (9, "completion webhooks", _webhooks),
+    (10, "pending change index", _pending_changes),
+    (11, "video content hashes", _video_hashes),
+    (12, "change feed keyset index", _change_feed_keyset),
+    (13, "broker events", _broker_events),
+    (14, "broker counters", _broker_counters),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+async def get_version(db: aiosqlite.Connection) -> int:
+    async with db.execute("PRAGMA user_version") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def migrate(db: aiosqlite.Connection, target: int = LATEST_VERSION) -> List[int]:
+    """
+    Apply pending migrations up to target
+
+    Returns:
+        Versions applied by this call (empty if another process got there first)
+    """
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if version > target:
+            break
+        if version <= await get_version(db):
+            continue
+
+        # Re-check under the write lock: another process may have just applied it.
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            if version <= await get_version(db):
+                await db.commit()
+                continue
+            await apply(db)
+            await db.execute(f"PRAGMA user_version = {version}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+        print(f"Applied schema migration {version}: {description}")
+        applied.append(version)
+
+    if applied:
+        # Table rebuilds leave the whole table in the WAL; fold it back so readers
+        # do not pay for WAL lookups until the next automatic checkpoint.
+        await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return applied
@@ -8,6 +8,7 @@ class JobStatus(str, Enum):
     PROCESSING = "processing"
     COMPLETED = "completed"
     FAILED = "failed"
+    CANCELLED = "cancelled"
 
 
 class JobType(str, Enum):
@@ -19,6 +20,8 @@ class VideoGenerationRequest(BaseModel):
     model: str = Field(default="grok", description="Model to use for video generation")
     prompt: str = Field(..., description="Text prompt for video generation")
     image: Optional[str] = Field(None, description="Base64 encoded image (optional)")
+    callback_url: Optional[str] = Field(None, max_length=2048, pattern=r"^https?://",
+                                        description="URL to POST the finished job to (optional)")
 
 
 class VideoGenerationResponse(BaseModel):
@@ -29,6 +32,7 @@ class VideoGenerationResponse(BaseModel):
     status: JobStatus = Field(..., description="Current job status")
     video_url: Optional[str] = Field(None, description="URL to download completed video")
     error: Optional[str] = Field(None, description="Error message if failed")
+    timings: Optional[Dict[str, Any]] = Field(None, description="Phase timestamps (epoch ms) and per-phase durations")
 
 
 class ExtensionPollResponse(BaseModel):
@@ -38,6 +42,11 @@ class ExtensionPollResponse(BaseModel):
     prompt: str = Field(..., description="Prompt for job processing")
     image: Optional[str] = Field(None, description="Base64 encoded image or null")
     request: Optional[Dict[str, Any]] = Field(None, description="Raw OpenAI-style request for chat jobs")
+    session_id: Optional[str] = Field(None, description="Chat session the job belongs to")
+    continue_from_job_id: Optional[str] = Field(None, description="Previous turn of the session, served by this worker; only the newest turn needs sending")
+    upload_url: Optional[str] = Field(None, description="Direct upload URL for the video (video jobs)")
+    upload_token: Optional[str] = Field(None, description="Signed token authorizing uploads to upload_url")
+    upload_token_expires_at: Optional[int] = Field(None, description="Unix timestamp when upload_token expires")
 
 
 class ExtensionErrorRequest(BaseModel):
@@ -45,14 +54,44 @@ class ExtensionErrorRequest(BaseModel):
     error: str = Field(..., description="Error message")
 
 
+class ExtensionHeartbeatRequest(BaseModel):
+    job_id: str = Field(..., description="Job ID the worker is processing")
+    status: Optional[str] = Field(None, description="Worker's progress status text")
+
+
 class ExtensionChatCompleteRequest(BaseModel):
     job_id: str = Field(..., description="Job ID that completed")
     content: str = Field(..., description="Assistant text content")
 
 
+class ExtensionUploadInitRequest(BaseModel):
+    job_id: str = Field(..., description="Job ID the video belongs to")
+    size: int = Field(..., gt=0, description="Total video size in bytes")
+
+
+class ExtensionUploadCompleteRequest(BaseModel):
+    sha256: str = Field(..., min_length=64, max_length=64, description="Hex SHA-256 of the whole video")
+
+
+class ExtensionUploadStatusResponse(BaseModel):
+    upload_id: str = Field(..., description="Upload ID for chunk and finalize calls")
+    size: int = Field(..., description="Total video size in bytes")
+    chunk_size: int = Field(..., description="Suggested chunk size in bytes")
+    received: List[List[int]] = Field(..., description="Received [start, end) byte ranges")
+    missing: List[List[int]] = Field(..., description="Missing [start, end) byte ranges")
+
+
+class ExtensionChatDeltaRequest(BaseModel):
+    job_id: str = Field(..., description="Job ID being generated")
+    content: str = Field(..., description="New assistant text since the previous delta")
+    offset: Optional[int] = Field(None, ge=0, description="Character offset of content in the full response; makes retries idempotent")
+
+
 class ChatCompletionRequest(BaseModel):
     model: str = Field(default="grok-vision", description="Model to use")
     messages: List[Dict[str, Any]] = Field(..., description="OpenAI chat messages")
     temperature: Optional[float] = Field(default=0.2, description="Sampling temperature")
     max_tokens: Optional[int] = Field(default=512, description="Max tokens for completion")
-    response_format: Optional[Dict[str, Any]] = Field(default=None, description="Optional response format, e.g. {\"type\":\"json_object\"}")
+    response_format: Optional[Dict[str, Any]] = Field(default=None, description="Optional response format: {\"type\":\"json_object\"} or {\"type\":\"json_schema\",\"json_schema\":{\"name\":...,\"schema\":{...}}}")
+    stream: bool = Field(default=False, description="Stream chat.completion.chunk events over SSE")
+    session_id: Optional[str] = Field(default=None, max_length=128, description="Conversation ID; turns of one session prefer the same worker")
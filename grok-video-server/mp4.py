@@ -0,0 +1,256 @@
+"""
+Minimal ISO BMFF (MP4) box parsing: metadata probe and faststart remux.
+
+Pure Python so post-processing works without ffmpeg; only the boxes needed for
+duration, resolution, codec and chunk offsets are understood.
+"""
+
+import os
+import shutil
+import struct
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+# Boxes whose payload is a plain list of child boxes
+CONTAINER_BOXES = {b"moov", b"trak", b"mdia", b"minf", b"stbl", b"edts", b"dinf", b"udta", b"mvex"}
+
+
+class MP4Error(ValueError):
+    """File is not an MP4 this module can handle"""
+
+
+class Box:
+    __slots__ = ("type", "offset", "size", "header_size")
+
+    def __init__(self, box_type: bytes, offset: int, size: int, header_size: int):
+        self.type = box_type
+        self.offset = offset
+        self.size = size
+        self.header_size = header_size
+
+    @property
+    def payload_offset(self) -> int:
+        return self.offset + self.header_size
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.size
+
+
+def _read_header(read, offset: int, end: int) -> Optional[Box]:
+    """Parse one box header; `read(offset, n)` returns up to n bytes at offset"""
+    if end - offset < 8:
+        return None
+    header = read(offset, 16)
+    if len(header) < 8:
+        return None
+    size, box_type = struct.unpack(">I4s", header[:8])
+    header_size = 8
+    if size == 1:
+        if len(header) < 16:
+            raise MP4Error(f"Truncated 64-bit size for box {box_type!r}")
+        size = struct.unpack(">Q", header[8:16])[0]
+        header_size = 16
+    elif size == 0:
+        size = end - offset
+    if size < header_size or offset + size > end:
+        raise MP4Error(f"Box {box_type!r} at {offset} has invalid size {size}")
+    return Box(box_type, offset, size, header_size)
+
+
+def iter_file_boxes(f: BinaryIO, file_size: int) -> Iterator[Box]:
+    """Top-level boxes of an open file"""
+    def read(offset, n):
+        f.seek(offset)
+        return f.read(n)
+
+    offset = 0
+    while True:
+        box = _read_header(read, offset, file_size)
+        if box is None:
+            return
+        yield box
+        offset = box.end
+
+
+def iter_boxes(data: bytes, start: int = 0, end: int = None) -> Iterator[Box]:
+    """Child boxes within data[start:end]; offsets are relative to data"""
+    end = len(data) if end is None else end
+    offset = start
+    while True:
+        box = _read_header(lambda o, n: data[o:o + n], offset, end)
+        if box is None:
+            return
+        yield box
+        offset = box.end
+
+
+def _find(data: bytes, parent: Box, box_type: bytes) -> Optional[Box]:
+    for box in iter_boxes(data, parent.payload_offset, parent.end):
+        if box.type == box_type:
+            return box
+    return None
+
+
+def _find_path(data: bytes, parent: Box, *path: bytes) -> Optional[Box]:
+    box = parent
+    for box_type in path:
+        box = _find(data, box, box_type)
+        if box is None:
+            return None
+    return box
+
+
+def read_moov(path: Path) -> Tuple[bytes, Box, List[Box]]:
+    """Return the moov box bytes (moov at offset 0), its file position and all top-level boxes"""
+    file_size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        boxes = list(iter_file_boxes(f, file_size))
+        moov = next((box for box in boxes if box.type == b"moov"), None)
+        if moov is None:
+            raise MP4Error("No moov box")
+        f.seek(moov.offset)
+        data = f.read(moov.size)
+    return data, moov, boxes
+
+
+def _parse_mvhd(data: bytes, box: Box) -> Tuple[int, int]:
+    """(timescale, duration) from a movie header"""
+    p = box.payload_offset
+    if data[p] == 1:
+        timescale, duration = struct.unpack(">IQ", data[p + 20:p + 32])
+    else:
+        timescale, duration = struct.unpack(">II", data[p + 12:p + 20])
+    return timescale, duration
+
+
+def probe(path: Path) -> Dict[str, object]:
+    """
+    Duration, resolution and codec of the first video track
+
+    Returns:
+        Dict with duration (seconds), width, height and video_codec (sample entry
+        fourcc such as avc1 or hvc1); missing values are None
+    """
+    data, moov, _ = read_moov(path)
+    moov = Box(b"moov", 0, moov.size, moov.header_size)
+
+    info = {"duration": None, "width": None, "height": None, "video_codec": None}
+
+    mvhd = _find(data, moov, b"mvhd")
+    if mvhd is not None:
+        timescale, duration = _parse_mvhd(data, mvhd)
+        if timescale:
+            info["duration"] = round(duration / timescale, 3)
+
+    for trak in iter_boxes(data, moov.payload_offset, moov.end):
+        if trak.type != b"trak":
+            continue
+        hdlr = _find_path(data, trak, b"mdia", b"hdlr")
+        if hdlr is None or data[hdlr.payload_offset + 8:hdlr.payload_offset + 12] != b"vide":
+            continue
+
+        tkhd = _find(data, trak, b"tkhd")
+        if tkhd is not None:
+            # Width and height are the last two 16.16 fixed-point fields.
+            width, height = struct.unpack(">II", data[tkhd.end - 8:tkhd.end])
+            info["width"], info["height"] = width >> 16, height >> 16
+
+        stsd = _find_path(data, trak, b"mdia", b"minf", b"stbl", b"stsd")
+        if stsd is not None:
+            # Version/flags and entry count, then the first sample entry's header
+            entry = stsd.payload_offset + 8
+            info["video_codec"] = data[entry + 4:entry + 8].decode("latin-1").strip() or None
+        break
+
+    return info
+
+
+def _chunk_offset_tables(data: bytes, parent: Box) -> Iterator[Box]:
+    """All stco/co64 boxes below a container"""
+    for box in iter_boxes(data, parent.payload_offset, parent.end):
+        if box.type in (b"stco", b"co64"):
+            yield box
+        elif box.type in CONTAINER_BOXES:
+            yield from _chunk_offset_tables(data, box)
+
+
+def _shift_chunk_offsets(moov: bytearray, shift: int):
+    """Add shift to every chunk offset in a moov box, in place"""
+    root = Box(b"moov", 0, len(moov), 8)
+    for table in _chunk_offset_tables(moov, root):
+        p = table.payload_offset + 4
+        count = struct.unpack(">I", moov[p:p + 4])[0]
+        p += 4
+        if table.type == b"stco":
+            offsets = struct.unpack(f">{count}I", moov[p:p + 4 * count])
+            if offsets and max(offsets) + shift > 0xFFFFFFFF:
+                raise MP4Error("Chunk offsets overflow 32 bits after moving moov")
+            moov[p:p + 4 * count] = struct.pack(f">{count}I", *(o + shift for o in offsets))
+        else:
+            offsets = struct.unpack(f">{count}Q", moov[p:p + 8 * count])
+            moov[p:p + 8 * count] = struct.pack(f">{count}Q", *(o + shift for o in offsets))
+
+
+def is_faststart(path: Path) -> bool:
+    """True if moov precedes the first mdat"""
+    _, moov, boxes = read_moov(path)
+    mdat = next((box for box in boxes if box.type == b"mdat"), None)
+    return mdat is None or moov.offset < mdat.offset
+
+
+def faststart(src: Path, dst: Path) -> bool:
+    """
+    Write src to dst with the moov box moved in front of the media data.
+
+    Boxes keep their order otherwise; chunk offsets are shifted by the moov size.
+
+    Returns:
+        False (and writes nothing) if src is already faststart
+    """
+    moov_data, moov, boxes = read_moov(src)
+    first_media = next((box for box in boxes if box.type == b"mdat"), None)
+    if first_media is None or moov.offset < first_media.offset:
+        return False
+    if moov.header_size != 8:
+        raise MP4Error("64-bit moov size is not supported")
+    if any(box.type == b"mdat" and box.offset > moov.offset for box in boxes):
+        raise MP4Error("Media data after moov is not supported")
+
+    # Everything between the first mdat and the old moov position moves back by moov.size.
+    moov_data = bytearray(moov_data)
+    _shift_chunk_offsets(moov_data, moov.size)
+
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        for box in boxes:
+            if box is first_media:
+                fout.write(moov_data)
+            if box is moov:
+                continue
+            fin.seek(box.offset)
+            _copy_range(fin, fout, box.size)
+    return True
+
+
+def _copy_range(fin: BinaryIO, fout: BinaryIO, length: int, block_size: int = 1024 * 1024):
+    remaining = length
+    while remaining > 0:
+        block = fin.read(min(block_size, remaining))
+        if not block:
+            raise MP4Error("Unexpected end of file")
+        fout.write(block)
+        remaining -= len(block)
+
+
+def faststart_in_place(path: Path, tmp_dir: Path) -> bool:
+    """Remux path for faststart through a temp file, replacing it atomically"""
+    tmp_path = Path(tmp_dir) / f"{Path(path).stem}.faststart"
+    try:
+        changed = faststart(path, tmp_path)
+        if changed:
+            shutil.copystat(path, tmp_path)
+            os.replace(tmp_path, path)
+        return changed
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
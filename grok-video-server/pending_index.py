@@ -0,0 +1,151 @@
+"""
+In-memory index of pending jobs, used to pick claim candidates.
+
+Each job type has a heap in claim order. Chat jobs held for the worker that
+served the previous turn of their session sit in that worker's own heap and
+join the shared heap when their affinity expires. Removal is lazy: a heap slot
+is live only while the entry it holds is still the job's current entry, so
+claims, cancellations and re-adds never search a heap.
+
+The index is a cache. SQLite stays the source of truth: a candidate is only
+claimed by a conditional UPDATE, and one that turns out not to be pending is
+dropped.
+"""
+
+import heapq
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+
+class PendingEntry(NamedTuple):
+    """A pending job; claims take the smallest (created_at, enqueued_ms, job_id) first"""
+    created_at: int
+    enqueued_ms: int
+    job_id: str
+    job_type: str
+    preferred_client_id: Optional[str] = None
+    affinity_until_ms: Optional[int] = None
+    deadline_ms: Optional[int] = None
+
+
+class PendingIndex:
+    """Pending jobs per job type in claim order"""
+
+    # Heaps are rebuilt once stale slots outnumber live entries by this factor
+    COMPACT_RATIO = 4
+
+    def __init__(self):
+        self._entries: Dict[str, PendingEntry] = {}
+        self._open: Dict[str, List[PendingEntry]] = {}
+        self._held: Dict[Tuple[str, str], List[PendingEntry]] = {}
+        self._expiring: List[Tuple[int, str, PendingEntry]] = []
+        # Entries with a deadline per job type, earliest first, so shedding knows when it has work
+        self._deadlines: Dict[str, List[Tuple[int, str, PendingEntry]]] = {}
+        self._slots = 0
+        self.loaded = False
+        # Latest updated_at read from the jobs table, for syncing with other processes
+        self.synced_ms = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def reset(self, entries: Iterable[PendingEntry] = (), now_ms: int = 0):
+        """Replace the contents, e.g. with the pending rows read at startup"""
+        self._entries.clear()
+        self._open.clear()
+        self._held.clear()
+        self._expiring.clear()
+        self._deadlines.clear()
+        self._slots = 0
+        for entry in entries:
+            self.add(entry, now_ms)
+        self.loaded = True
+
+    def invalidate(self):
+        """Forget everything; the owner reloads the index before its next claim"""
+        self.reset()
+        self.loaded = False
+
+    def add(self, entry: PendingEntry, now_ms: int):
+        """Index a pending job unless it already is"""
+        if entry.job_id in self._entries:
+            return
+        self._entries[entry.job_id] = entry
+        if entry.deadline_ms is not None:
+            heapq.heappush(self._deadlines.setdefault(entry.job_type, []), (entry.deadline_ms, entry.job_id, entry))
+            self._slots += 1
+        if entry.preferred_client_id is not None:
+            self._push(self._held.setdefault((entry.job_type, entry.preferred_client_id), []), entry)
+            if entry.affinity_until_ms is not None and entry.affinity_until_ms > now_ms:
+                heapq.heappush(self._expiring, (entry.affinity_until_ms, entry.job_id, entry))
+                self._slots += 1
+                return
+        self._push(self._open.setdefault(entry.job_type, []), entry)
+
+    def discard(self, job_id: str):
+        """Drop a job that is no longer pending; a no-op if it is not indexed"""
+        if self._entries.pop(job_id, None) is not None:
+            self._maybe_compact()
+
+    def pop(self, job_type: str, client_id: str, now_ms: int, min_deadline_ms: int = 0) -> Optional[PendingEntry]:
+        """
+        Remove and return the job a claim by client_id should try first
+
+        Jobs held for this client come first, then the shared queue. Jobs held for
+        another client until after now_ms, or with a deadline before min_deadline_ms,
+        are left in place.
+        """
+        self._release(now_ms)
+        for heap in (self._held.get((job_type, client_id)), self._open.get(job_type)):
+            if not heap:
+                continue
+            skipped = []
+            found = None
+            while heap:
+                entry = heapq.heappop(heap)
+                self._slots -= 1
+                if self._entries.get(entry.job_id) is not entry:
+                    continue
+                if entry.deadline_ms is not None and entry.deadline_ms < min_deadline_ms:
+                    skipped.append(entry)
+                    continue
+                found = entry
+                break
+            for entry in skipped:
+                self._push(heap, entry)
+            if found is not None:
+                del self._entries[found.job_id]
+                self._maybe_compact()
+                return found
+        return None
+
+    def earliest_deadline(self, job_type: str) -> Optional[int]:
+        """Earliest deadline (epoch ms) of the indexed pending jobs of a type; None if none has one"""
+        heap = self._deadlines.get(job_type)
+        while heap and self._entries.get(heap[0][1]) is not heap[0][2]:
+            heapq.heappop(heap)
+            self._slots -= 1
+        return heap[0][0] if heap else None
+
+    def counts(self) -> Dict[str, int]:
+        """Indexed pending jobs per job type"""
+        counts: Dict[str, int] = {}
+        for entry in self._entries.values():
+            counts[entry.job_type] = counts.get(entry.job_type, 0) + 1
+        return counts
+
+    def _push(self, heap: List[PendingEntry], entry: PendingEntry):
+        heapq.heappush(heap, entry)
+        self._slots += 1
+
+    def _release(self, now_ms: int):
+        """Move held jobs whose affinity has expired into their type's shared heap"""
+        while self._expiring and self._expiring[0][0] <= now_ms:
+            _, job_id, entry = heapq.heappop(self._expiring)
+            self._slots -= 1
+            if self._entries.get(job_id) is entry:
+                self._push(self._open.setdefault(entry.job_type, []), entry)
+
+    def _maybe_compact(self):
+        if self._slots > self.COMPACT_RATIO * (len(self._entries) + 16):
+            # Held jobs go back on the expiry heap; those already expired are released on the next pop
+            self.reset(list(self._entries.values()))
@@ -0,0 +1,176 @@
+import asyncio
+import shutil
+from pathlib import Path
+from typing import List, Optional, Set
+
+import config
+import mp4
+from job_queue import Job, job_queue
+from storage import storage
+
+
+class VideoPostProcessor:
+    """
+    Bounded worker pool that post-processes completed videos off the request path.
+
+    Each video is probed for duration/resolution/codec and remuxed for faststart in
+    pure Python; a poster thumbnail and short preview are rendered when ffmpeg is
+    available. A video with the same content as one already processed reuses its
+    results: the remuxed file, the metadata and links to its thumbnail and preview.
+    Jobs are already completed when queued, so a full queue or a failure only
+    means missing metadata, never a failed job.
+    """
+
+    def __init__(self, queue=None, video_storage=None, workers: int = None, max_queued: int = None):
+        self.job_queue = queue or job_queue
+        self.storage = video_storage or storage
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ffmpeg: Optional[str] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._reads: Set[asyncio.Task] = set()
+
+    async def start(self):
+        """Start workers and queue videos left unprocessed by a previous run"""
+        self.workers = self.workers or config.VIDEO_POSTPROCESS_WORKERS
+        self.max_queued = self.max_queued or config.VIDEO_POSTPROCESS_QUEUE_SIZE
+        self.ffmpeg = shutil.which(config.FFMPEG_PATH)
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        for job in await self.job_queue.list_unprocessed_videos(limit=self.max_queued):
+            self.submit(job.job_id, job.video_path)
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        # Reads still opening their connection are let finish, so no connection outlives the loop
+        await asyncio.gather(*self._reads, return_exceptions=True)
+        self._tasks = []
+        self._queue = None
+
+    def submit(self, job_id: str, video_path: str) -> bool:
+        """Queue a completed video; returns False if the pool is stopped or full"""
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait((job_id, video_path))
+            return True
+        except asyncio.QueueFull:
+            print(f"Post-processing queue full, skipping {job_id}")
+            return False
+
+    async def _worker(self):
+        while True:
+            job_id, video_path = await self._queue.get()
+            try:
+                await self.process(job_id, Path(video_path))
+            except Exception as e:
+                print(f"Post-processing failed for {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def process(self, job_id: str, video_path: Path):
+        """Probe, remux and render thumbnails for one video, then store the results"""
+        job = await self._read(self.job_queue.get_job(job_id))
+        video_sha256 = job.video_sha256 if job else None
+        if video_sha256:
+            source = await self._read(self.job_queue.find_processed_video(video_sha256, job_id))
+            if source is not None and await self._reuse(job_id, source):
+                return
+
+        info = {"duration": None, "width": None, "height": None, "video_codec": None}
+        try:
+            info = await asyncio.to_thread(mp4.probe, video_path)
+            await self.storage.faststart(job_id, video_sha256)
+        except mp4.MP4Error as e:
+            print(f"Skipping MP4 processing for {job_id}: {e}")
+
+        thumbnail_path = preview_path = None
+        if self.ffmpeg:
+            thumbnail_path = await self._render_thumbnail(job_id, video_path, info["duration"])
+            preview_path = await self._render_preview(job_id, video_path)
+
+        await self.job_queue.update_media_info(
+            job_id,
+            thumbnail_path=thumbnail_path,
+            preview_path=preview_path,
+            **info
+        )
+
+    async def _read(self, query):
+        """Run a database read that stop() waits for instead of cancelling it mid-connect"""
+        task = asyncio.ensure_future(query)
+        self._reads.add(task)
+        task.add_done_callback(self._reads.discard)
+        return await asyncio.shield(task)
+
+    async def _reuse(self, job_id: str, source: Job) -> bool:
+        """Take the results of an earlier job with the same video; False if its output is gone"""
+        media = {}
+        for column, target in (("thumbnail_path", self.storage.thumbnail_path(job_id)),
+                               ("preview_path", self.storage.preview_path(job_id))):
+            media[column] = None
+            if getattr(source, column):
+                if not await asyncio.to_thread(self.storage.link_media, Path(getattr(source, column)), target):
+                    return False
+                media[column] = str(target)
+
+        try:
+            # Moves this job onto the blob the source's post-processing remuxed
+            await self.storage.faststart(job_id, source.video_sha256)
+        except mp4.MP4Error as e:
+            print(f"Skipping MP4 processing for {job_id}: {e}")
+
+        await self.job_queue.update_media_info(
+            job_id,
+            duration=source.duration,
+            width=source.width,
+            height=source.height,
+            video_codec=source.video_codec,
+            **media
+        )
+        return True
+
+    async def _run_ffmpeg(self, *args: str) -> bool:
+        process = await asyncio.create_subprocess_exec(
+            self.ffmpeg, "-hide_banner", "-loglevel", "error", "-y", *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), timeout=config.FFMPEG_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            print(f"ffmpeg timed out after {config.FFMPEG_TIMEOUT_SECONDS}s")
+            return False
+        if process.returncode != 0:
+            print(f"ffmpeg failed: {stderr.decode(errors='replace').strip()[:500]}")
+            return False
+        return True
+
+    async def _render_thumbnail(self, job_id: str, video_path: Path, duration: Optional[float]) -> Optional[str]:
+        """Poster frame from a quarter of the way in, so it is past any fade-in"""
+        output = self.storage.thumbnail_path(job_id)
+        seek = f"{(duration or 0) / 4:.3f}"
+        ok = await self._run_ffmpeg(
+            "-ss", seek, "-i", str(video_path), "-frames:v", "1",
+            "-vf", f"scale={config.THUMBNAIL_WIDTH}:-2", "-q:v", "4", str(output)
+        )
+        return str(output) if ok else None
+
+    async def _render_preview(self, job_id: str, video_path: Path) -> Optional[str]:
+        """Short, small, silent faststart clip for hover previews"""
+        output = self.storage.preview_path(job_id)
+        ok = await self._run_ffmpeg(
+            "-i", str(video_path), "-t", str(config.PREVIEW_SECONDS), "-an",
+            "-vf", f"scale={config.THUMBNAIL_WIDTH}:-2", "-c:v", "libx264", "-preset", "veryfast",
+            "-crf", "30", "-movflags", "+faststart", str(output)
+        )
+        return str(output) if ok else None
+
+
+# Global post-processor instance
+postprocessor = VideoPostProcessor()
@@ -0,0 +1,601 @@
+#!/usr/bin/env python3
+"""
+Replay recorded traffic from the structured request logs against a server
+
+Reads the logs/requests_YYYY-MM-DD.jsonl files written by StructuredLogger and
+re-issues the client requests at the recorded pace, or --speed times faster,
+while simulated extension workers claim and finish the jobs through the worker
+protocol (poll, heartbeat, upload, complete/error):
+
+    python replay.py logs/requests_2026-10-18.jsonl --server http://localhost:8000 --speed 10
+
+Logs hold no image data or chat messages, so stand-ins are synthesized: a PNG
+of the logged size for each <base64_data:N_chars> placeholder, and chat
+messages of the logged count padded to the logged request size. Each simulated
+job takes its recorded generation time (dispatch to upload or answer), ends the
+way it ended in the recording, and uploads a video of the recorded size. Worker
+counts default to the distinct client IDs that claimed jobs in the recording.
+Arrival gaps and generation times are both divided by --speed, so load relative
+to worker capacity matches the recording.
+
+Every --interval seconds a row of queue depth, in-flight jobs, finished jobs
+and enqueue-to-completion latency is printed, read from the server's /jobs
+change feed; a summary compares latency with the recording. Replay against a
+dedicated server: every job on it is counted. DELETE /jobs and DELETE /api/logs
+are never replayed.
+"""
+
+import argparse
+import base64
+import gzip
+import json
+import os
+import re
+import statistics
+import struct
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, quote, urlsplit
+
+_PLACEHOLDER = re.compile(r'^<base64_data:(\d+)_chars>$')
+_JOB_ID = re.compile(r'job_[0-9a-f]{12}')
+_CHAT_TAG = re.compile(r'\[replay:([\w-]+)\]')
+
+VIDEO_PATH = '/v1/videos/generations'
+CHAT_PATH = '/v1/chat/completions'
+# Never replayed: they would wipe the server under test
+DESTRUCTIVE = {('DELETE', '/jobs'), ('DELETE', '/api/logs')}
+# Worker heartbeat interval in recorded time, as in the extension
+HEARTBEAT_SECONDS = 15
+# Generation time for jobs without a recorded one, when no job of the type has one either
+DEFAULT_GENERATION_SECONDS = {'video': 60.0, 'chat': 15.0}
+CHANGE_FEED_LIMIT = 5000
+DATA_URL_PREFIX = 'data:image/png;base64,'
+
+
+# ---------------------------------------------------------------------------
+# Stand-in payloads
+# ---------------------------------------------------------------------------
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return (struct.pack('>I', len(data)) + chunk_type + data
+            + struct.pack('>I', zlib.crc32(chunk_type + data)))
+
+
+def synthetic_png(size: int) -> bytes:
+    """
+    Decodable RGB noise PNG of about `size` bytes
+
+    Pixels are stored uncompressed, so the image is as large as a real upload
+    of that size; a private ancillary chunk makes up the remainder.
+    """
+    # Rows are a filter byte plus 3 bytes per pixel; stored deflate blocks add under 1%
+    side = max(1, int(((max(0, size - 80) * 0.99 * 12 + 1) ** 0.5 - 1) / 6))
+    raw = b''.join(b'\x00' + os.urandom(side * 3) for _ in range(side))
+    png = (b'\x89PNG\r\n\x1a\n'
+           + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', side, side, 8, 2, 0, 0, 0))
+           + _png_chunk(b'IDAT', zlib.compress(raw, 0)))
+    padding = size - len(png) - 24
+    if padding >= 0:
+        png += _png_chunk(b'rpLy', bytes(padding))
+    return png + _png_chunk(b'IEND', b'')
+
+
+def synthetic_image(placeholder: Optional[str]) -> Optional[str]:
+    """Data URL as long as the image a logged <base64_data:N_chars> placeholder stood for"""
+    match = _PLACEHOLDER.match(placeholder) if isinstance(placeholder, str) else None
+    if match is None:
+        # Short image strings are logged as sent
+        return placeholder
+    size = max(0, int(match.group(1)) - len(DATA_URL_PREFIX)) * 3 // 4
+    return DATA_URL_PREFIX + base64.b64encode(synthetic_png(size)).decode('ascii')
+
+
+def synthetic_video(size: int) -> bytes:
+    """ftyp box plus an mdat box filling out `size` bytes"""
+    ftyp = struct.pack('>I4s4sI4s4s', 24, b'ftyp', b'isom', 0x200, b'isom', b'mp41')
+    mdat_size = max(8, size - len(ftyp))
+    return ftyp + struct.pack('>I4s', mdat_size, b'mdat') + bytes(mdat_size - 8)
+
+
+def synthetic_chat_request(model: str, messages_count: int, request_size: int, tag: str) -> Dict[str, Any]:
+    """
+    Chat request with the logged message count, alternating roles and ending on a
+    user turn, padded out to about the logged body size. Every user message
+    carries the replay tag, which is how a simulated worker finds its recording.
+    """
+    count = max(1, messages_count)
+    messages = [{"role": "user" if (count - 1 - i) % 2 == 0 else "assistant",
+                 "content": f"[replay:{tag}]"} for i in range(count)]
+    body = {"model": model, "messages": messages}
+    padding = max(0, request_size - len(json.dumps(body))) // count
+    for message in messages:
+        message["content"] += " " + ("lorem ipsum " * (padding // 12 + 1))[:padding]
+    return body
+
+
+# ---------------------------------------------------------------------------
+# Reading the recording
+# ---------------------------------------------------------------------------
+
+def _parse_timestamp(value: str) -> float:
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def read_log_entries(paths: List[str]) -> List[Dict[str, Any]]:
+    """Request entries from the given log files (.jsonl or .jsonl.gz), oldest first"""
+    entries = []
+    for path in paths:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get('type') != 'request' or 'timestamp' not in entry:
+                    continue
+                entry['at'] = _parse_timestamp(entry['timestamp'])
+                entries.append(entry)
+    entries.sort(key=lambda e: e['at'])
+    return entries
+
+
+class Recording:
+    """Client requests to re-issue plus what the workers did with each recorded job"""
+
+    def __init__(self, entries: List[Dict[str, Any]]):
+        self.start = entries[0]['at'] if entries else 0.0
+        self.duration = entries[-1]['at'] - self.start if entries else 0.0
+        self.requests: List[Dict[str, Any]] = []
+        # job_id -> type, created, dispatched, generated, finished, outcome, video_size
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.workers: Dict[str, set] = {'video': set(), 'chat': set()}
+        for entry in entries:
+            self._add(entry)
+
+    def _job(self, job_id: str) -> Dict[str, Any]:
+        return self.jobs.setdefault(job_id, {'type': None, 'created': None, 'dispatched': None,
+                                             'generated': None, 'finished': None, 'outcome': None,
+                                             'video_size': None})
+
+    def _add(self, entry: Dict[str, Any]):
+        parts = urlsplit(entry['path'])
+        path, query = parts.path, parse_qs(parts.query)
+        job_id = entry.get('job_id')
+        ended = entry['at'] + entry.get('duration', 0)
+
+        if not path.startswith(('/extension/', '/upload')):
+            if (entry['method'], path) not in DESTRUCTIVE:
+                self.requests.append(entry)
+            if job_id and entry['method'] == 'POST' and path in (VIDEO_PATH, CHAT_PATH):
+                job = self._job(job_id)
+                job['type'] = 'video' if path == VIDEO_PATH else 'chat'
+                job['created'] = job['created'] or entry['at']
+            return
+        if not job_id:
+            return
+
+        job = self._job(job_id)
+        if path == '/extension/poll':
+            mode = query.get('mode', ['video'])[0]
+            self.workers.setdefault(mode, set()).add(entry.get('client_id'))
+            job['type'] = job['type'] or mode
+            job['dispatched'] = job['dispatched'] or ended
+        elif path in ('/extension/heartbeat', '/extension/chat/delta'):
+            pass
+        elif path == '/extension/error':
+            job['generated'] = job['generated'] or entry['at']
+            job['finished'] = job['finished'] or ended
+            job['outcome'] = job['outcome'] or 'error'
+        else:
+            # Uploads and completions; generation ended when the first of them started
+            job['generated'] = job['generated'] or entry['at']
+            if 'video_size' in entry:
+                job['video_size'] = entry['video_size']
+            elif 'size' in query and query['size'][0].isdigit():
+                job['video_size'] = int(query['size'][0])
+            if entry.get('status', 500) < 400:
+                job['finished'] = ended
+                job['outcome'] = job['outcome'] or 'completed'
+
+    def generation_seconds(self, job_id: Optional[str]) -> Optional[float]:
+        job = self.jobs.get(job_id)
+        if job and job['dispatched'] is not None and job['generated'] is not None:
+            return max(0.0, job['generated'] - job['dispatched'])
+        return None
+
+    def median_generation_seconds(self, job_type: str) -> float:
+        samples = [self.generation_seconds(job_id) for job_id, job in self.jobs.items() if job['type'] == job_type]
+        samples = [s for s in samples if s is not None]
+        return statistics.median(samples) if samples else DEFAULT_GENERATION_SECONDS.get(job_type, 30.0)
+
+    def median_video_size(self) -> int:
+        sizes = [job['video_size'] for job in self.jobs.values() if job['video_size']]
+        return int(statistics.median(sizes)) if sizes else 2 * 1024 * 1024
+
+    def latencies(self, job_type: str) -> List[float]:
+        """Recorded submission-to-completion seconds of completed jobs"""
+        return [job['finished'] - job['created'] for job in self.jobs.values()
+                if job['type'] == job_type and job['outcome'] == 'completed'
+                and job['created'] is not None and job['finished'] is not None]
+
+
+# ---------------------------------------------------------------------------
+# Replay
+# ---------------------------------------------------------------------------
+
+def _percentile(values: List[float], fraction: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def _format_seconds(value: Optional[float]) -> str:
+    return '-' if value is None else f"{value:.1f}"
+
+
+class Replayer:
+    """Re-issues a recording's client traffic and runs simulated workers against a server"""
+
+    def __init__(self, recording: Recording, server: str, speed: float, workers: Dict[str, int],
+                 interval: float, concurrency: int, timeout: float):
+        self.recording = recording
+        self.server = server.rstrip('/')
+        self.speed = speed
+        self.workers = workers
+        self.interval = interval
+        self.timeout = timeout
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.stopping = threading.Event()
+        self.lock = threading.Lock()
+        self.mapped = threading.Condition(self.lock)
+        # Recorded job ID <-> replayed job ID
+        self.new_ids: Dict[str, str] = {}
+        self.original_ids: Dict[str, str] = {}
+        self.counts: Counter = Counter()
+        # Replayed jobs as last seen in the change feed
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.cursor = '0'
+        self.rows: List[Dict[str, Any]] = []
+
+    # -- HTTP --------------------------------------------------------------
+
+    def request(self, method: str, path: str, body: Any = None,
+                timeout: float = None) -> Tuple[int, Any]:
+        """(status, decoded JSON or raw bytes); status 0 if the server could not be reached"""
+        url = path if path.startswith(('http://', 'https://')) else self.server + path
+        headers = {}
+        if isinstance(body, dict):
+            body = json.dumps(body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        request = urllib.request.Request(url, data=body, method=method, headers=headers)
+        try:
+            with urllib.request.urlopen(request, timeout=timeout or self.timeout) as response:
+                status, data = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, data = e.code, e.read()
+        except OSError as e:
+            return 0, str(e)
+        try:
+            return status, json.loads(data) if data else None
+        except ValueError:
+            return status, data
+
+    # -- Clients -----------------------------------------------------------
+
+    def _count(self, *keys: str):
+        with self.lock:
+            self.counts.update(keys)
+
+    def _map(self, original_id: Optional[str], new_id: str):
+        with self.mapped:
+            if original_id:
+                self.new_ids[original_id] = new_id
+            self.original_ids[new_id] = original_id
+            self.mapped.notify_all()
+
+    def _remap_path(self, path: str) -> Optional[str]:
+        """Path with recorded job IDs swapped for replayed ones; None if one has no counterpart yet"""
+        missing = False
+
+        def swap(match):
+            nonlocal missing
+            new_id = self.new_ids.get(match.group(0))
+            missing = missing or new_id is None
+            return new_id or match.group(0)
+
+        path = _JOB_ID.sub(swap, path)
+        return None if missing else path
+
+    def replay_request(self, entry: Dict[str, Any]):
+        path = urlsplit(entry['path']).path
+        recorded_status = entry.get('status', 200)
+        payload = entry.get('payload') or {}
+        if entry['method'] == 'POST' and path in (VIDEO_PATH, CHAT_PATH):
+            job_type = 'video' if path == VIDEO_PATH else 'chat'
+            if not payload and 400 <= recorded_status < 500 and recorded_status != 429:
+                # Rejected as invalid; the log does not say what was wrong with it
+                self._count('skipped')
+                return
+            if job_type == 'video':
+                body = {"model": payload.get('model', 'grok'),
+                        "prompt": payload.get('prompt') or 'Replayed request',
+                        "image": synthetic_image(payload.get('image'))}
+            else:
+                body = synthetic_chat_request(payload.get('model', 'grok'), payload.get('messages_count', 1),
+                                              entry.get('request_size', 0), entry.get('job_id') or '-')
+            self._count(f'{job_type}_submitted')
+            status, data = self.request('POST', path, body)
+            if status != 200:
+                self._count(f'{job_type}_rejected', f'{job_type}_rejected_{status}')
+            elif job_type == 'video':
+                self._map(entry.get('job_id'), data['id'])
+            return
+
+        target = self._remap_path(entry['path'])
+        if target is None:
+            self._count('skipped')
+            return
+        self._count('other_requests')
+        self.request(entry['method'], target)
+
+    # -- Workers -----------------------------------------------------------
+
+    def _original_id(self, job: Dict[str, Any]) -> Optional[str]:
+        """Recorded job a claimed job replays; a video's creation response may still be in flight"""
+        if job['job_type'] == 'chat':
+            match = _CHAT_TAG.search(job.get('prompt') or '')
+            if match is None or match.group(1) == '-':
+                return None
+            self._map(match.group(1), job['job_id'])
+            return match.group(1)
+        with self.mapped:
+            self.mapped.wait_for(lambda: job['job_id'] in self.original_ids, timeout=5)
+            return self.original_ids.get(job['job_id'])
+
+    def _heartbeat_cancelled(self, job_id: str) -> bool:
+        status, data = self.request('POST', '/extension/heartbeat', {"job_id": job_id})
+        return status != 200 or bool(isinstance(data, dict) and data.get('cancel'))
+
+    def process_job(self, job: Dict[str, Any]):
+        job_id, job_type = job['job_id'], job['job_type']
+        original_id = self._original_id(job)
+        original = self.recording.jobs.get(original_id) or {}
+        generation = self.recording.generation_seconds(original_id)
+        if generation is None:
+            generation = self.recording.median_generation_seconds(job_type)
+
+        # Generate, heartbeating at the extension's interval; stop if the job is cancelled
+        if self._heartbeat_cancelled(job_id):
+            return
+        remaining = generation / self.speed
+        while remaining > 0:
+            step = min(remaining, HEARTBEAT_SECONDS / self.speed)
+            if self.stopping.wait(step):
+                return
+            remaining -= step
+            if remaining > 0 and self._heartbeat_cancelled(job_id):
+                return
+
+        if original.get('outcome') == 'error':
+            self.request('POST', '/extension/error', {"job_id": job_id, "error": "Replayed worker error"})
+        elif job_type == 'chat':
+            self.request('POST', '/extension/complete/chat',
+                         {"job_id": job_id, "content": "Replayed answer."})
+        else:
+            video = synthetic_video(original.get('video_size') or self.recording.median_video_size())
+            upload_url = job.get('upload_url') or f"{self.server}/upload/{job_id}"
+            self.request('PUT', f"{upload_url}?token={quote(job.get('upload_token') or '')}", video)
+
+    def worker(self, mode: str, client_id: str):
+        while not self.stopping.is_set():
+            status, job = self.request('GET', f'/extension/poll?mode={mode}&client_id={client_id}&wait=2')
+            if status == 200 and isinstance(job, dict):
+                self.process_job(job)
+            elif status != 204:
+                self.stopping.wait(1)
+
+    # -- Reporting ---------------------------------------------------------
+
+    def _read_changes(self):
+        """Merge the change feed into self.jobs"""
+        while True:
+            status, data = self.request(
+                'GET', f'/jobs?updated_since={quote(self.cursor)}&limit={CHANGE_FEED_LIMIT}&include_images=false'
+            )
+            if status != 200 or not isinstance(data, dict):
+                return
+            for job in data['jobs']:
+                self.jobs[job['job_id']] = job
+            advanced = data['cursor'] != self.cursor
+            self.cursor = data['cursor']
+            if data['count'] < CHANGE_FEED_LIMIT or not advanced:
+                return
+
+    def sample(self, started: float, since_ms: int) -> Dict[str, Any]:
+        self._read_changes()
+        elapsed = time.monotonic() - started
+        row = {"elapsed": round(elapsed, 1), "recorded": round(elapsed * self.speed, 1)}
+        for job_type in ('video', 'chat'):
+            jobs = [job for job in self.jobs.values() if job['job_type'] == job_type]
+            finished = [job for job in jobs if (job.get('completed_ms') or 0) > since_ms]
+            latencies = [(job['completed_ms'] - job['enqueued_ms']) / 1000 for job in finished
+                         if job['status'] == 'completed' and job.get('enqueued_ms')]
+            row[job_type] = {
+                "submitted": self.counts[f'{job_type}_submitted'],
+                "rejected": self.counts[f'{job_type}_rejected'],
+                "pending": sum(job['status'] == 'pending' for job in jobs),
+                "processing": sum(job['status'] == 'processing' for job in jobs),
+                "completed": sum(job['status'] == 'completed' for job in finished),
+                "failed": sum(job['status'] == 'failed' for job in finished),
+                "cancelled": sum(job['status'] == 'cancelled' for job in finished),
+                "p50": _percentile(latencies, 0.5),
+                "p95": _percentile(latencies, 0.95),
+            }
+        self.rows.append(row)
+        return row
+
+    @staticmethod
+    def print_header():
+        columns = 'pend  proc  done  fail   p50s   p95s'
+        print(f"{'elapsed':>8} {'recorded':>9} | video: {columns} | chat: {columns}")
+
+    @staticmethod
+    def print_row(row: Dict[str, Any]):
+        def cells(stats):
+            return (f"{stats['pending']:>4}  {stats['processing']:>4}  {stats['completed']:>4}  "
+                    f"{stats['failed'] + stats['cancelled']:>4}  {_format_seconds(stats['p50']):>5}  "
+                    f"{_format_seconds(stats['p95']):>5}")
+        print(f"{row['elapsed']:>7.1f}s {row['recorded']:>8.1f}s | video: {cells(row['video'])} | "
+              f"chat: {cells(row['chat'])}", flush=True)
+
+    def summary(self) -> Dict[str, Any]:
+        summary = {"speed": self.speed, "workers": self.workers, "skipped": self.counts['skipped'],
+                   "other_requests": self.counts['other_requests']}
+        for job_type in ('video', 'chat'):
+            jobs = [job for job in self.jobs.values() if job['job_type'] == job_type]
+            latencies = [(job['completed_ms'] - job['enqueued_ms']) / 1000 for job in jobs
+                         if job['status'] == 'completed' and job.get('enqueued_ms')]
+            # Recorded latency in replay time, for comparison at any speed
+            recorded = [latency / self.speed for latency in self.recording.latencies(job_type)]
+            summary[job_type] = {
+                "submitted": self.counts[f'{job_type}_submitted'],
+                "rejected": {status.rsplit('_', 1)[1]: count for status, count in self.counts.items()
+                             if status.startswith(f'{job_type}_rejected_')},
+                "statuses": dict(Counter(job['status'] for job in jobs)),
+                "latency": {name: _percentile(latencies, q) for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+                "recorded_latency": {name: _percentile(recorded, q) for name, q in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))},
+            }
+        return summary
+
+    # -- Main loop ---------------------------------------------------------
+
+    def run(self, drain_timeout: float) -> Dict[str, Any]:
+        status, data = self.request('GET', '/jobs?limit=1&include_images=false')
+        if status != 200:
+            raise RuntimeError(f"Cannot reach {self.server}: {data}")
+        self.cursor = data['cursor']
+
+        threads = []
+        for mode, count in self.workers.items():
+            for i in range(count):
+                thread = threading.Thread(target=self.worker, args=(mode, f"R{mode[0].upper()}{i:03d}"), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        self.print_header()
+        started = time.monotonic()
+        last_sample, since_ms = started, int(time.time() * 1000)
+
+        def report():
+            nonlocal last_sample, since_ms
+            if time.monotonic() - last_sample >= self.interval:
+                now_ms = int(time.time() * 1000)
+                self.print_row(self.sample(started, since_ms))
+                last_sample, since_ms = time.monotonic(), now_ms
+
+        futures = []
+        for entry in self.recording.requests:
+            due = started + (entry['at'] - self.recording.start) / self.speed
+            while time.monotonic() < due:
+                time.sleep(max(0.0, min(due - time.monotonic(), 0.05)))
+                report()
+            futures.append(self.pool.submit(self.replay_request, entry))
+
+        # Let the queue drain once every request has been issued
+        drained_by = time.monotonic() + drain_timeout
+        while time.monotonic() < drained_by:
+            time.sleep(0.5)
+            self._read_changes()
+            if all(f.done() for f in futures) and not any(
+                    job['status'] in ('pending', 'processing') for job in self.jobs.values()):
+                break
+            report()
+        for future in futures:
+            if future.done() and future.exception():
+                self._count('client_errors')
+        self.print_row(self.sample(started, since_ms))
+
+        self.stopping.set()
+        for thread in threads:
+            thread.join(timeout=self.timeout)
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        return self.summary()
+
+
+def _print_summary(summary: Dict[str, Any]):
+    print(f"\nSkipped requests: {summary['skipped']}, other requests replayed: {summary['other_requests']}")
+    for job_type in ('video', 'chat'):
+        stats = summary[job_type]
+        latency = stats['latency']
+        recorded = stats['recorded_latency']
+        print(f"{job_type}: submitted {stats['submitted']}, rejected {stats['rejected'] or 0}, "
+              f"statuses {stats['statuses']}")
+        print(f"  latency     p50 {_format_seconds(latency['p50'])}s  p95 {_format_seconds(latency['p95'])}s  "
+              f"p99 {_format_seconds(latency['p99'])}s")
+        print(f"  recorded    p50 {_format_seconds(recorded['p50'])}s  p95 {_format_seconds(recorded['p95'])}s  "
+              f"p99 {_format_seconds(recorded['p99'])}s  (divided by speed)")
+
+
+def _parse_workers(value: Optional[int], recording: Recording, mode: str) -> int:
+    if value is not None:
+        return value
+    return max(1, len(recording.workers.get(mode, ()) - {None}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('logs', nargs='+', help='Request log files (requests_YYYY-MM-DD.jsonl, optionally .gz)')
+    parser.add_argument('--server', default='http://localhost:8000', help='Server to replay against')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay N times faster than recorded')
+    parser.add_argument('--video-workers', type=int, help='Simulated video workers (default: as recorded)')
+    parser.add_argument('--chat-workers', type=int, help='Simulated chat workers (default: as recorded)')
+    parser.add_argument('--interval', type=float, default=5.0, help='Seconds between report rows')
+    parser.add_argument('--concurrency', type=int, default=256, help='Client requests in flight at most')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Per-request timeout in seconds')
+    parser.add_argument('--drain-timeout', type=float, default=120.0,
+                        help='Seconds to wait for queued jobs after the last request')
+    parser.add_argument('--limit', type=int, help='Replay only the first N client requests')
+    parser.add_argument('--output', help='Write report rows and the summary here as JSON lines')
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        parser.error('--speed must be positive')
+    recording = Recording(read_log_entries(args.logs))
+    if args.limit is not None:
+        recording.requests = recording.requests[:args.limit]
+    if not recording.requests:
+        print('No client requests in the given logs')
+        return 1
+
+    workers = {'video': _parse_workers(args.video_workers, recording, 'video'),
+               'chat': _parse_workers(args.chat_workers, recording, 'chat')}
+    print(f"Replaying {len(recording.requests)} requests ({recording.duration:.0f}s recorded) "
+          f"at {args.speed:g}x against {args.server} with {workers['video']} video and "
+          f"{workers['chat']} chat workers\n")
+
+    replayer = Replayer(recording, args.server, args.speed, workers,
+                        args.interval, args.concurrency, args.timeout)
+    summary = replayer.run(args.drain_timeout)
+    _print_summary(summary)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            for row in replayer.rows:
+                f.write(json.dumps(row) + '\n')
+            f.write(json.dumps({"summary": summary}) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
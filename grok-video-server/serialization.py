@@ -0,0 +1,73 @@
+import json
+from typing import Any, Optional
+
+from fastapi.responses import JSONResponse
+
+# Prefer orjson, then msgspec; fall back to the stdlib when neither is installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+if orjson is not None:
+    BACKEND = "orjson"
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+
+    loads = orjson.loads
+elif msgspec is not None:
+    BACKEND = "msgspec"
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+
+    def dumps(obj: Any) -> bytes:
+        return _encoder.encode(obj)
+
+    loads = _decoder.decode
+else:
+    BACKEND = "json"
+
+    def dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+    loads = json.loads
+
+
+def dumps_with_raw(obj: dict, **raw_fields: Optional[str]) -> bytes:
+    """
+    Serialize a non-empty dict and append fields whose values are already JSON text.
+
+    Used to pass stored JSON (e.g. request_payload) through without decoding and
+    re-encoding it.
+    """
+    body = dumps(obj)
+    parts = [body[:-1]]
+    for key, raw in raw_fields.items():
+        value = raw.encode("utf-8") if raw else b"null"
+        parts.append(b',"' + key.encode("utf-8") + b'":' + value)
+    parts.append(b"}")
+    return b"".join(parts)
+
+
+class RawJSON:
+    """Pre-serialized JSON bytes returned as-is by FastJSONResponse"""
+
+    __slots__ = ("body",)
+
+    def __init__(self, body: bytes):
+        self.body = body
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response rendered with the fastest available encoder"""
+
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, RawJSON):
+            return content.body
+        return dumps(content)
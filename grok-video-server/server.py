@@ -1,10 +1,11 @@
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query
-from fastapi.responses import FileResponse, Response, HTMLResponse
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Query, Request
+from fastapi.responses import FileResponse, Response, HTMLResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Optional
 import asyncio
-import uvicorn
+import hashlib
 from datetime import datetime
 import time
 import json
@@ -14,11 +15,23 @@ import config
 from models import (
     VideoGenerationRequest, VideoGenerationResponse,
     ExtensionPollResponse, ExtensionErrorRequest, ExtensionChatCompleteRequest,
+    ExtensionChatDeltaRequest, ExtensionUploadInitRequest, ExtensionUploadCompleteRequest,
+    ExtensionUploadStatusResponse, ExtensionHeartbeatRequest,
     ChatCompletionRequest, JobStatus, JobType
 )
-from job_queue import job_queue
-from storage import storage
-from logger import logger
+from job_queue import job_queue, IdempotencyKeyConflict, format_change_cursor, parse_change_cursor
+from broker import broker, Subscription
+from admission import admission
+from shedding import load_shedder
+from storage import storage, UploadError
+from images import image_preprocessor, ImageValidationError
+from postprocess import postprocessor
+from tracing import span_exporter
+from structured_output import SchemaError, extract_first_json_object, schema_validator, validate_output, wants_json
+from upload_sink import upload_sink, upload_token_signer, upload_url, complete_video_job
+from webhooks import video_generation_body, webhook_dispatcher
+from logger import logger, describe_image, RequestLoggingMiddleware
+from serialization import FastJSONResponse, RawJSON, dumps, dumps_with_raw
 
 
 @asynccontextmanager
@@ -26,11 +39,26 @@ async def lifespan(app: FastAPI):
     """Lifespan context manager for startup/shutdown"""
     # Startup
     await job_queue.init_db()
+    await broker.init()
+    await postprocessor.start()
+    await span_exporter.start()
+    await webhook_dispatcher.start()
     print(f"Server starting on {config.SERVER_HOST}:{config.SERVER_PORT}")
     print(f"Video storage: {config.VIDEO_STORAGE_PATH}")
     print(f"Database: {config.DB_PATH}")
+    print(f"Broker: {type(broker.backend).__name__}")
+    print(f"ffmpeg: {postprocessor.ffmpeg or 'not found (no thumbnails or previews)'}")
+    if span_exporter.target:
+        print(f"Trace export: {span_exporter.target}")
     yield
     # Shutdown
+    await webhook_dispatcher.stop()
+    await span_exporter.stop()
+    await postprocessor.stop()
+    await job_queue.close()
+    await broker.close()
+    image_preprocessor.shutdown()
+    logger.close()
     print("Server shutting down")
 
 
@@ -38,7 +66,8 @@ app = FastAPI(
     title="Grok Imagine API",
     description="OpenAI-compatible video generation API powered by Grok",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=FastJSONResponse
 )
 
 # Enable CORS for local clients
@@ -50,6 +79,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# One log entry per request, written by the buffered background writer
+app.add_middleware(RequestLoggingMiddleware)
+
+# Token-authenticated direct video uploads; also runs standalone (see upload_sink.py)
+app.mount("/upload", upload_sink)
+
 
 def _extract_user_prompt(messages):
     """Best-effort extraction for dashboards/history"""
@@ -74,41 +109,115 @@ def _extract_user_prompt(messages):
     return "Vision chat request"
 
 
-def _wants_json_object_response(request: ChatCompletionRequest) -> bool:
-    response_format = request.response_format
-    if not isinstance(response_format, dict):
-        return False
-    return response_format.get("type") == "json_object"
+def _idempotency_key(http_request: Request) -> Optional[str]:
+    """Validated Idempotency-Key header, or None if the caller sent none"""
+    key = http_request.headers.get("Idempotency-Key")
+    if key is None:
+        return None
+    if not 1 <= len(key) <= 255 or not all(32 <= ord(c) <= 126 for c in key):
+        raise HTTPException(status_code=400, detail="Idempotency-Key must be 1-255 printable ASCII characters")
+    return key
 
 
-def _extract_first_json_object(text: str):
-    """
-    Best-effort extractor for first valid JSON object embedded in free-form text.
-    Returns JSON string if found, otherwise None.
-    """
-    if not text:
+def _request_fingerprint(job_type: str, request) -> str:
+    """Hash identifying a submission, so a reused Idempotency-Key can be checked against it"""
+    return hashlib.blake2b(dumps([job_type, request.model_dump()]), digest_size=16).hexdigest()
+
+
+def _request_timeout(http_request: Request) -> Optional[float]:
+    """X-Request-Timeout header in seconds, or None if the caller sent none"""
+    value = http_request.headers.get("x-request-timeout")
+    if value is None:
         return None
+    try:
+        timeout = float(value)
+    except ValueError:
+        timeout = 0
+    if not 0 < timeout < float("inf"):
+        raise HTTPException(status_code=400, detail="X-Request-Timeout must be a positive number of seconds")
+    return timeout
 
-    decoder = json.JSONDecoder()
-    for i, ch in enumerate(text):
-        if ch != '{':
-            continue
+
+async def _create_job_once(http_request: Request, job_type: str, fingerprint: str,
+                           create_args: Callable[[], Awaitable[dict]]):
+    """
+    Admit and create a job, or return the job an earlier submission with the same
+    Idempotency-Key created. Retries skip admission so they are not rejected while
+    their original job is still queued; create_args (the job's prompt, image, ...)
+    only runs for new jobs.
+
+    Returns:
+        (job, replayed)
+    """
+    key = _idempotency_key(http_request)
+    timeout = _request_timeout(http_request)
+    try:
+        if key is not None:
+            job = await job_queue.get_idempotent_job(key, fingerprint)
+            if job is not None:
+                logger.annotate(job_id=job.job_id, idempotent_replay=True)
+                return job, True
+
+        await admission.admit(http_request, job_type)
+        args = await create_args()
+        args["deadline_ms"] = load_shedder.default_deadline_ms(job_type, timeout)
+        if key is None:
+            job, created = await job_queue.create_job(job_type=job_type, **args), True
+        else:
+            job, created = await job_queue.create_idempotent_job(key, fingerprint, job_type=job_type, **args)
+    except IdempotencyKeyConflict as e:
+        logger.annotate(error=str(e))
+        raise HTTPException(status_code=422, detail=str(e))
+
+    if created:
+        admission.note_enqueued(job_type)
+    else:
+        logger.annotate(idempotent_replay=True)
+    return job, not created
+
+
+def _video_generation_response(job, model: str) -> FastJSONResponse:
+    """Serialize a job directly in the VideoGenerationResponse shape"""
+    return FastJSONResponse(video_generation_body(job, model))
+
+
+class _DashboardCache:
+    """Dashboard HTML kept in memory, re-read only when the file's mtime changes"""
+
+    # Stat the file at most this often so reloads during editing still show up
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._html: Optional[str] = None
+        self._mtime_ns: Optional[int] = None
+        self._checked_at = 0.0
+
+    def get(self) -> Optional[str]:
+        now = time.monotonic()
+        if self._html is not None and now - self._checked_at < self.CHECK_INTERVAL:
+            return self._html
+        self._checked_at = now
         try:
-            parsed, end = decoder.raw_decode(text[i:])
-            if isinstance(parsed, dict):
-                return text[i:i + end]
-        except json.JSONDecodeError:
-            continue
-    return None
+            mtime_ns = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            self._html = self._mtime_ns = None
+            return None
+        if mtime_ns != self._mtime_ns:
+            self._html = self.path.read_text(encoding='utf-8')
+            self._mtime_ns = mtime_ns
+        return self._html
+
+
+_dashboard = _DashboardCache(Path(__file__).parent / 'static' / 'dashboard.html')
 
 
 @app.get("/", response_class=HTMLResponse)
 async def root():
     """Serve dashboard"""
-    static_path = Path(__file__).parent / 'static' / 'dashboard.html'
-    if static_path.exists():
-        with open(static_path, 'r', encoding='utf-8') as f:
-            return f.read()
+    html = _dashboard.get()
+    if html is not None:
+        return html
     return """
     <html>
         <body>
@@ -131,47 +240,30 @@ async def health_check():
 
 
 @app.post("/v1/videos/generations", response_model=VideoGenerationResponse)
-async def create_video_generation(request: VideoGenerationRequest):
+async def create_video_generation(request: VideoGenerationRequest, http_request: Request):
     """
     Create a new video generation job (OpenAI-compatible endpoint)
     """
-    start_time = time.time()
-
-    # Log request
-    logger.log_request(
-        method="POST",
-        path="/v1/videos/generations",
-        payload=request.model_dump()
-    )
-
-    # Create job
-    job = await job_queue.create_job(
-        prompt=request.prompt,
-        image=request.image,
-        job_type=JobType.VIDEO.value
-    )
-
-    # Build video URL
-    video_url = f"http://localhost:{config.SERVER_PORT}/videos/{job.job_id}.mp4"
-
-    # Build response
-    response = VideoGenerationResponse(
-        id=job.job_id,
-        created=job.created_at,
-        model=request.model,
-        status=JobStatus(job.status),
-        video_url=video_url if job.status == JobStatus.COMPLETED else None,
-        error=job.error
+    async def create_args():
+        # Validate and shrink the image before it is stored and shipped to workers
+        try:
+            image = await image_preprocessor.process(request.image)
+        except ImageValidationError as e:
+            logger.annotate(error=str(e))
+            raise HTTPException(status_code=400, detail=str(e))
+        return {"prompt": request.prompt, "image": image, "callback_url": request.callback_url}
+
+    job, replayed = await _create_job_once(
+        http_request, JobType.VIDEO.value, _request_fingerprint(JobType.VIDEO.value, request), create_args
     )
-
-    # Log response
-    duration = time.time() - start_time
-    logger.log_response(
+    logger.annotate(
         job_id=job.job_id,
-        status=job.status,
-        duration=duration
+        payload={"model": request.model, "prompt": request.prompt, "image": describe_image(request.image)}
     )
 
+    response = _video_generation_response(job, model=request.model)
+    if replayed:
+        response.headers["Idempotent-Replayed"] = "true"
     return response
 
 
@@ -180,14 +272,7 @@ async def get_video_generation(job_id: str):
     """
     Get status of a video generation job (OpenAI-compatible endpoint)
     """
-    start_time = time.time()
-
-    # Log request
-    logger.log_request(
-        method="GET",
-        path=f"/v1/videos/generations/{job_id}",
-        job_id=job_id
-    )
+    logger.annotate(job_id=job_id)
 
     # Get job
     job = await job_queue.get_job(job_id)
@@ -195,34 +280,39 @@ async def get_video_generation(job_id: str):
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    # Build video URL
-    video_url = f"http://localhost:{config.SERVER_PORT}/videos/{job.job_id}.mp4"
-
-    # Build response
-    response = VideoGenerationResponse(
-        id=job.job_id,
-        created=job.created_at,
-        model="grok",
-        status=JobStatus(job.status),
-        video_url=video_url if job.status == JobStatus.COMPLETED else None,
-        error=job.error
-    )
+    return _video_generation_response(job, model="grok")
 
-    # Log response
-    duration = time.time() - start_time
-    logger.log_response(
-        job_id=job.job_id,
-        status=job.status,
-        duration=duration
-    )
 
-    return response
+async def _cancel_job(job_id: str, job_type: JobType, reason: str):
+    """Cancel a pending or processing job of job_type; 404 if there is none, 409 once it has finished"""
+    logger.annotate(job_id=job_id)
+
+    job = await job_queue.get_job(job_id)
+    if not job or job.job_type != job_type:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    if not await job_queue.cancel_job(job_id, reason):
+        latest = await job_queue.get_job(job_id)
+        raise HTTPException(status_code=409, detail=f"Job already {latest.status if latest else 'deleted'}")
+    span_exporter.submit(job_id)
+
+    return await job_queue.get_job(job_id)
+
+
+@app.delete("/v1/videos/generations/{job_id}", response_model=VideoGenerationResponse)
+async def cancel_video_generation(job_id: str):
+    """
+    Cancel a video generation job; a worker already generating it stops on its next heartbeat
+    """
+    job = await _cancel_job(job_id, JobType.VIDEO, "Cancelled by client")
+    return _video_generation_response(job, model="grok")
 
 
-@app.get("/extension/poll")
+@app.get("/extension/poll", response_model=ExtensionPollResponse)
 async def extension_poll(
     mode: JobType = JobType.VIDEO,
-    client_id: str = Query(..., min_length=5, max_length=5)
+    client_id: str = Query(..., min_length=5, max_length=5),
+    wait: int = Query(0, ge=0, le=30, description="Seconds to long-poll for a new job")
 ):
     """
     Extension polls for next job to process
@@ -235,48 +325,81 @@ async def extension_poll(
     if not all(32 <= ord(c) <= 126 for c in client_id):
         raise HTTPException(status_code=400, detail="client_id must be 5 printable ASCII characters")
 
-    # Atomically claim next pending job by mode for this client
-    job = await job_queue.claim_next_pending_job(job_type=mode.value, client_id=client_id)
+    async def claim():
+        # Fail jobs that can no longer finish in time, then atomically claim the next
+        # pending job by mode for this client
+        min_deadline_ms = await load_shedder.shed(mode.value)
+        return await job_queue.claim_next_pending_job(job_type=mode.value, client_id=client_id,
+                                                      min_deadline_ms=min_deadline_ms)
+
+    if wait:
+        # Subscribed before the first claim, so a job submitted while it runs still wakes us.
+        # Another worker process may win the claim; the caller simply polls again.
+        async with broker.listen(f"jobs:{mode.value}") as subscription:
+            job = await claim()
+            if not job and await subscription.wait(timeout=wait) is not None:
+                job = await claim()
+    else:
+        job = await claim()
 
     if not job:
         return Response(status_code=204)
 
-    # Return job details
-    parsed_request = None
-    if job.request_payload:
-        try:
-            parsed_request = json.loads(job.request_payload)
-        except json.JSONDecodeError:
-            parsed_request = None
+    load_shedder.note_dispatched(mode.value)
 
-    response = ExtensionPollResponse(
-        job_id=job.job_id,
-        job_type=job.job_type,
-        client_id=job.client_id or client_id,
-        prompt=job.prompt,
-        image=job.image,
-        request=parsed_request
-    )
+    logger.annotate(job_id=job.job_id, client_id=client_id)
 
-    logger.log_request(
-        method="GET",
-        path=f"/extension/poll?mode={mode.value}&client_id={client_id}",
-        job_id=job.job_id,
-        payload={"client_id": client_id}
-    )
+    # Return job details (ExtensionPollResponse shape); the stored OpenAI request
+    # JSON is passed through without decoding
+    response = {
+        "job_id": job.job_id,
+        "job_type": job.job_type,
+        "client_id": job.client_id or client_id,
+        "prompt": job.prompt,
+        "image": job.image,
+    }
+    if job.session_id:
+        response["session_id"] = job.session_id
+        # The worker still has the previous turn's conversation open only if it served it
+        if job.preferred_client_id == client_id:
+            response["continue_from_job_id"] = job.previous_job_id
+    if job.job_type == JobType.VIDEO:
+        token, expires_at = upload_token_signer.issue(job.job_id)
+        response.update(upload_url=upload_url(job.job_id), upload_token=token, upload_token_expires_at=expires_at)
+    return FastJSONResponse(RawJSON(dumps_with_raw(response, request=job.request_payload)))
+
+
+@app.post("/extension/heartbeat")
+async def extension_heartbeat(request: ExtensionHeartbeatRequest):
+    """
+    Worker reports it is still working on a job; the first heartbeat marks the
+    start of generation in the job's timings
+    """
+    logger.annotate(job_id=request.job_id)
 
-    return response
+    job_status = await job_queue.record_heartbeat(request.job_id)
+    if job_status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    # Nobody is waiting for a cancelled job any more; the worker should drop it
+    return {
+        "status": "ok",
+        "job_id": request.job_id,
+        "job_status": job_status,
+        "cancel": job_status == JobStatus.CANCELLED
+    }
 
 
 @app.post("/extension/complete")
 async def extension_complete(
+    http_request: Request,
     job_id: str = Form(...),
     video: UploadFile = File(...)
 ):
     """
     Extension uploads completed video
     """
-    start_time = time.time()
+    logger.annotate(job_id=job_id)
 
     # Get job
     job = await job_queue.get_job(job_id)
@@ -284,51 +407,152 @@ async def extension_complete(
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    # Read video data
-    video_data = await video.read()
+    # Copy the spooled upload to storage in chunks
+    async def read_chunks():
+        while chunk := await video.read(1024 * 1024):
+            yield chunk
 
-    # Save video
-    video_path = await storage.save_video(job_id, video_data)
+    video = await storage.save_video_stream(job_id, read_chunks())
 
-    # Update job status
-    await job_queue.update_job_status(
-        job_id=job_id,
-        status=JobStatus.COMPLETED,
-        video_path=video_path
-    )
+    logger.annotate(video_size=video.size, video_duplicate=video.duplicate)
 
-    # Log response
-    duration = time.time() - start_time
-    logger.log_response(
-        job_id=job_id,
-        status=JobStatus.COMPLETED,
-        duration=duration,
-        video_size=len(video_data)
-    )
+    # The multipart body was received before this handler ran; its upload
+    # started when the request arrived.
+    if not await complete_video_job(job_id, video, upload_started_ms=int(http_request.state.received_at * 1000)):
+        raise HTTPException(status_code=409, detail="Job was cancelled")
 
     return {"status": "ok", "job_id": job_id}
 
 
+def _upload_status_response(job_id: str, status: dict) -> dict:
+    return {
+        "upload_id": job_id,
+        "size": status["size"],
+        "chunk_size": config.UPLOAD_CHUNK_SIZE,
+        "received": status["received"],
+        "missing": status["missing"]
+    }
+
+
+@app.post("/extension/uploads", response_model=ExtensionUploadStatusResponse)
+async def extension_upload_init(request: ExtensionUploadInitRequest):
+    """
+    Start or resume a chunked video upload; the upload ID is the job ID
+    """
+    logger.annotate(job_id=request.job_id, video_size=request.size)
+
+    job = await job_queue.get_job(request.job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    status = await storage.init_upload(request.job_id, request.size)
+    await job_queue.record_phase(request.job_id, 'upload_started_ms')
+    return _upload_status_response(request.job_id, status)
+
+
+@app.get("/extension/uploads/{upload_id}", response_model=ExtensionUploadStatusResponse)
+async def extension_upload_status(upload_id: str):
+    """
+    Report received/missing ranges so a worker can resume after a failure
+    """
+    status = storage.upload_status(upload_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    return _upload_status_response(upload_id, status)
+
+
+@app.put("/extension/uploads/{upload_id}")
+async def extension_upload_chunk(upload_id: str, http_request: Request, offset: int = Query(..., ge=0)):
+    """
+    Upload one chunk (raw body) at a byte offset; chunks may be sent in parallel
+    """
+    logger.annotate(job_id=upload_id)
+
+    content_length = http_request.headers.get("content-length")
+    if content_length is None:
+        raise HTTPException(status_code=411, detail="Content-Length required")
+    try:
+        length = int(content_length)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if length > config.UPLOAD_MAX_CHUNK_BYTES:
+        raise HTTPException(status_code=413, detail=f"Chunk larger than {config.UPLOAD_MAX_CHUNK_BYTES} bytes")
+
+    try:
+        written = await storage.write_chunk(upload_id, offset, length, http_request.stream())
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"status": "ok", "upload_id": upload_id, "offset": offset, "length": written}
+
+
+@app.post("/extension/uploads/{upload_id}/complete")
+async def extension_upload_complete(upload_id: str, request: ExtensionUploadCompleteRequest):
+    """
+    Verify checksum, move the assembled video into storage and complete the job
+    """
+    logger.annotate(job_id=upload_id)
+
+    job = await job_queue.get_job(upload_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    try:
+        video = await storage.finalize_upload(upload_id, request.sha256)
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    except UploadError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    logger.annotate(video_duplicate=video.duplicate)
+    if not await complete_video_job(upload_id, video):
+        raise HTTPException(status_code=409, detail="Job was cancelled")
+
+    return {"status": "ok", "job_id": upload_id}
+
+
 @app.post("/extension/complete/chat")
 async def extension_complete_chat(request: ExtensionChatCompleteRequest):
     """
     Extension reports completed chat/vision response
     """
+    logger.annotate(job_id=request.job_id)
     job = await job_queue.get_job(request.job_id)
 
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    await job_queue.update_job_status(
-        job_id=request.job_id,
-        status=JobStatus.COMPLETED,
-        text_response=request.content
-    )
+    # json_schema output that does not validate goes back to the queue for another run
+    output_error = validate_output(request.content, (job.request or {}).get("response_format"))
+    if output_error:
+        output_error = f"Model output does not match response_format schema: {output_error}"
+        logger.annotate(error=output_error, attempts=job.attempts)
+        if await job_queue.requeue_job(request.job_id, output_error, config.CHAT_SCHEMA_MAX_RETRIES):
+            return {"status": "requeued", "job_id": request.job_id}
 
-    logger.log_response(
+    if not await job_queue.update_job_status(
         job_id=request.job_id,
-        status=JobStatus.COMPLETED
-    )
+        status=JobStatus.FAILED if output_error else JobStatus.COMPLETED,
+        text_response=request.content,
+        error=output_error
+    ):
+        raise HTTPException(status_code=409, detail="Job was cancelled")
+    span_exporter.submit(request.job_id)
+
+    return {"status": "ok", "job_id": request.job_id}
+
+
+@app.post("/extension/chat/delta")
+async def extension_chat_delta(request: ExtensionChatDeltaRequest):
+    """
+    Extension reports partial chat/vision output for streaming clients
+    """
+    logger.annotate(job_id=request.job_id)
+
+    if not await job_queue.append_text_response(request.job_id, request.content, offset=request.offset):
+        raise HTTPException(status_code=409, detail="Job is not processing or delta offset is past the current text")
 
     return {"status": "ok", "job_id": request.job_id}
 
@@ -338,6 +562,8 @@ async def extension_error(request: ExtensionErrorRequest):
     """
     Extension reports job failure
     """
+    logger.annotate(job_id=request.job_id, error=request.error)
+
     # Get job
     job = await job_queue.get_job(request.job_id)
 
@@ -350,97 +576,273 @@ async def extension_error(request: ExtensionErrorRequest):
         status=JobStatus.FAILED,
         error=request.error
     )
+    span_exporter.submit(request.job_id)
 
-    # Log response
-    logger.log_response(
-        job_id=request.job_id,
-        status=JobStatus.FAILED,
-        error=request.error
+    return {"status": "ok", "job_id": request.job_id}
+
+
+def _finalize_chat_content(content: str, json_response: bool) -> str:
+    if json_response:
+        extracted_json = extract_first_json_object(content)
+        if extracted_json:
+            return extracted_json
+        logger.annotate(
+            error="JSON response_format requested but no JSON object found in model output"
+        )
+    return content
+
+
+class _ChatWaiters:
+    """
+    Callers waiting on each chat job, counted through the broker across all server
+    processes. When the last one gives up (disconnects or times out) the job is
+    cancelled, so no worker spends a generation on an answer nobody will read. A job
+    submitted with an Idempotency-Key is given CHAT_ABANDON_GRACE_SECONDS for a
+    retry to take over first, and keeps its key, so a later retry gets the
+    cancelled job rather than a duplicate.
+    """
+
+    def __init__(self):
+        self._tasks = set()
+
+    @staticmethod
+    def _key(job_id: str) -> str:
+        return f"chat-waiters:{job_id}"
+
+    @staticmethod
+    def _ttl() -> float:
+        # Outlives any caller's wait; counts left by a process that died then expire
+        return config.CHAT_COMPLETION_WAIT_SECONDS + config.CHAT_ABANDON_GRACE_SECONDS + 60
+
+    async def join(self, job_id: str):
+        # Shielded: a caller cancelled mid-join still counts, and leaves in its finally block
+        await asyncio.shield(broker.incr(self._key(job_id), 1, self._ttl()))
+
+    def leave(self, job_id: str, abandoned_reason: Optional[str] = None, keyed: bool = False):
+        """abandoned_reason is set when the caller gave up before the job finished"""
+        # A task, because the leaving caller may itself be mid-cancellation
+        task = asyncio.create_task(self._leave(job_id, abandoned_reason, keyed))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _leave(self, job_id: str, reason: Optional[str], keyed: bool):
+        if await broker.incr(self._key(job_id), -1, self._ttl()) > 0 or not reason:
+            return
+        if keyed:
+            await asyncio.sleep(config.CHAT_ABANDON_GRACE_SECONDS)
+            if await broker.incr(self._key(job_id), 0, self._ttl()) > 0:
+                return
+        if await job_queue.cancel_job(job_id, reason, release_key=False):
+            span_exporter.submit(job_id)
+
+
+chat_waiters = _ChatWaiters()
+
+
+async def _wait_for_disconnect(http_request: Request):
+    """Returns once the client has gone away; the request body must already be read"""
+    while (await http_request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _wait_for_job_update(subscription: Subscription, deadline: float, disconnected: asyncio.Task) -> bool:
+    """
+    Wait until the job changes or the client disconnects; True if it disconnected
+
+    Callers subscribe before reading the job, so a change in between still wakes this.
+    """
+    update = asyncio.create_task(
+        subscription.wait(timeout=min(5.0, max(0.0, deadline - time.time())))
     )
+    await asyncio.wait({update, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    update.cancel()
+    return disconnected.done()
 
-    return {"status": "ok", "job_id": request.job_id}
+
+_FINISHED_STATUSES = (JobStatus.COMPLETED, JobStatus.FAILED, JobStatus.CANCELLED)
+
+
+def _sse_event(payload) -> bytes:
+    return b"data: " + dumps(payload) + b"\n\n"
+
+
+def _chat_timeout_message(wait_seconds: float) -> str:
+    return f"Timed out waiting for chat completion after {round(wait_seconds, 1):g}s"
+
+
+async def _stream_chat_completion(job_id: str, model: str, json_response: bool, deadline: float,
+                                  wait_seconds: float, keyed: bool):
+    """
+    Yield OpenAI chat.completion.chunk SSE events as worker deltas land in the job's
+    partial text_response. JSON output is only known once complete, so it is sent
+    as a single chunk at the end.
+    """
+    completion_id = f"chatcmpl-{job_id}"
+    created = int(time.time())
+
+    def chunk(delta, finish_reason=None) -> bytes:
+        return _sse_event({
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        })
+
+    # Starlette cancels this generator when the client disconnects; the finally
+    # block then hands the job to chat_waiters to cancel
+    await chat_waiters.join(job_id)
+    abandoned = "Chat completion stream closed by the client"
+    try:
+        yield chunk({"role": "assistant", "content": ""})
+        streamed = ""
+
+        while time.time() < deadline:
+            # Subscribed before the read, so a delta landing in between still wakes the wait
+            async with broker.listen(f"job:{job_id}") as subscription:
+                latest = await job_queue.get_job(job_id)
+                text = (latest.text_response or "") if latest else ""
+                if not (latest and latest.status in _FINISHED_STATUSES) and (
+                        json_response or len(text) <= len(streamed) or not text.startswith(streamed)):
+                    await subscription.wait(timeout=min(5.0, max(0.0, deadline - time.time())))
+                    continue
+
+            if latest.status in (JobStatus.FAILED, JobStatus.CANCELLED):
+                abandoned = None
+                logger.annotate(error=latest.error)
+                yield _sse_event({"error": {"message": latest.error or "Chat job failed", "type": "server_error"}})
+                yield b"data: [DONE]\n\n"
+                return
+
+            if latest.status == JobStatus.COMPLETED:
+                abandoned = None
+                text = _finalize_chat_content(text, json_response)
+                if text.startswith(streamed) and len(text) > len(streamed):
+                    yield chunk({"content": text[len(streamed):]})
+                elif not text.startswith(streamed):
+                    # Final text diverged from the live page text already sent; deltas cannot be retracted.
+                    logger.annotate(stream_mismatch=True)
+                yield chunk({}, finish_reason="stop")
+                yield b"data: [DONE]\n\n"
+                return
+
+            yield chunk({"content": text[len(streamed):]})
+            streamed = text
+
+        abandoned = _chat_timeout_message(wait_seconds)
+        yield _sse_event({"error": {"message": abandoned, "type": "timeout"}})
+        yield b"data: [DONE]\n\n"
+    finally:
+        chat_waiters.leave(job_id, abandoned, keyed)
 
 
 @app.post("/v1/chat/completions")
-async def create_chat_completion(request: ChatCompletionRequest):
+async def create_chat_completion(request: ChatCompletionRequest, http_request: Request):
     """
     OpenAI-compatible chat endpoint bridged to extension workers.
     """
-    start_time = time.time()
-    prompt_for_history = _extract_user_prompt(request.messages)
-    wants_json_object = _wants_json_object_response(request)
+    json_response = wants_json(request.response_format)
+    try:
+        # Compiled (or fetched from the cache) now, so a bad schema fails before dispatch
+        schema_validator(request.response_format)
+    except SchemaError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid response_format: {e}")
+
+    async def create_args():
+        return {
+            "prompt": _extract_user_prompt(request.messages),
+            "image": None,
+            "request_payload": dumps(request.model_dump()).decode('utf-8'),
+            "session_id": request.session_id,
+        }
 
-    job = await job_queue.create_job(
-        prompt=prompt_for_history,
-        image=None,
-        job_type=JobType.CHAT.value,
-        request_payload=json.dumps(request.model_dump())
+    # A retry with the same Idempotency-Key waits on (or returns) the original job
+    job, replayed = await _create_job_once(
+        http_request, JobType.CHAT.value, _request_fingerprint(JobType.CHAT.value, request), create_args
     )
+    replay_headers = {"Idempotent-Replayed": "true"} if replayed else {}
 
-    logger.log_request(
-        method="POST",
-        path="/v1/chat/completions",
+    logger.annotate(
         job_id=job.job_id,
         payload={"model": request.model, "messages_count": len(request.messages)}
     )
 
     deadline = time.time() + config.CHAT_COMPLETION_WAIT_SECONDS
-    while time.time() < deadline:
-        latest = await job_queue.get_job(job.job_id)
-
-        if latest and latest.status == JobStatus.COMPLETED:
-            content = latest.text_response or ""
-            if wants_json_object:
-                extracted_json = _extract_first_json_object(content)
-                if extracted_json:
-                    content = extracted_json
-                else:
-                    logger.log_response(
-                        job_id=job.job_id,
-                        status=JobStatus.COMPLETED,
-                        error="response_format=json_object requested but no JSON object found in model output"
-                    )
-            duration = time.time() - start_time
-            logger.log_response(
-                job_id=job.job_id,
-                status=JobStatus.COMPLETED,
-                duration=duration
-            )
-            return {
-                "id": f"chatcmpl-{job.job_id}",
-                "object": "chat.completion",
-                "created": int(time.time()),
-                "model": request.model,
-                "choices": [
-                    {
-                        "index": 0,
-                        "message": {"role": "assistant", "content": content},
-                        "finish_reason": "stop"
+    if job.deadline_ms and not replayed:
+        # An X-Request-Timeout shorter than the configured wait ends the wait too
+        deadline = min(deadline, job.deadline_ms / 1000)
+    # The wait actually applied, counted from when the request arrived
+    wait_seconds = deadline - http_request.state.received_at
+    keyed = _idempotency_key(http_request) is not None
+    if request.stream:
+        return StreamingResponse(
+            _stream_chat_completion(job.job_id, request.model, json_response, deadline, wait_seconds, keyed),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **replay_headers}
+        )
+
+    # Someone has to be waiting: when the last caller disconnects or times out, the job is cancelled
+    await chat_waiters.join(job.job_id)
+    disconnected = asyncio.create_task(_wait_for_disconnect(http_request))
+    abandoned = "Chat completion client disconnected"
+    try:
+        while time.time() < deadline:
+            # Subscribed before the read, so a completion landing in between still wakes the wait
+            async with broker.listen(f"job:{job.job_id}") as subscription:
+                latest = await job_queue.get_job(job.job_id)
+                if not (latest and latest.status in _FINISHED_STATUSES):
+                    # Woken by the completing worker's process via the broker
+                    if await _wait_for_job_update(subscription, deadline, disconnected):
+                        logger.annotate(error=abandoned)
+                        return Response(status_code=499)
+                    continue
+
+            if latest.status == JobStatus.COMPLETED:
+                abandoned = None
+                content = _finalize_chat_content(latest.text_response or "", json_response)
+                return FastJSONResponse({
+                    "id": f"chatcmpl-{job.job_id}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": content},
+                            "finish_reason": "stop"
+                        }
+                    ],
+                    "usage": {
+                        "prompt_tokens": 0,
+                        "completion_tokens": 0,
+                        "total_tokens": 0
                     }
-                ],
-                "usage": {
-                    "prompt_tokens": 0,
-                    "completion_tokens": 0,
-                    "total_tokens": 0
-                }
-            }
-
-        if latest and latest.status == JobStatus.FAILED:
-            duration = time.time() - start_time
-            logger.log_response(
-                job_id=job.job_id,
-                status=JobStatus.FAILED,
-                duration=duration,
-                error=latest.error
-            )
-            raise HTTPException(status_code=500, detail=latest.error or "Chat job failed")
-
-        await asyncio.sleep(1)
-
-    raise HTTPException(
-        status_code=504,
-        detail=f"Timed out waiting for chat completion after {config.CHAT_COMPLETION_WAIT_SECONDS}s"
-    )
+                }, headers=replay_headers)
+
+            if latest.status == JobStatus.FAILED:
+                abandoned = None
+                logger.annotate(error=latest.error)
+                raise HTTPException(status_code=500, detail=latest.error or "Chat job failed")
+
+            # Cancelled
+            abandoned = None
+            logger.annotate(error=latest.error)
+            raise HTTPException(status_code=409, detail=latest.error or "Chat job was cancelled")
+
+        abandoned = _chat_timeout_message(wait_seconds)
+        raise HTTPException(status_code=504, detail=abandoned)
+    finally:
+        disconnected.cancel()
+        chat_waiters.leave(job.job_id, abandoned, keyed)
+
+
+@app.delete("/v1/chat/completions/{completion_id}")
+async def cancel_chat_completion(completion_id: str):
+    """
+    Cancel a chat completion by its chatcmpl- ID (or job ID); waiting callers get 409
+    """
+    job = await _cancel_job(completion_id.removeprefix("chatcmpl-"), JobType.CHAT, "Cancelled by client")
+    return {"id": f"chatcmpl-{job.job_id}", "object": "chat.completion", "status": job.status}
 
 
 @app.get("/videos/{job_id}.mp4")
@@ -462,17 +864,65 @@ async def get_video(job_id: str):
     )
 
 
+@app.get("/videos/{job_id}/thumbnail.jpg")
+async def get_video_thumbnail(job_id: str):
+    """
+    Serve the poster thumbnail rendered by post-processing
+    """
+    thumbnail_path = storage.thumbnail_path(job_id)
+    if not thumbnail_path.exists():
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return FileResponse(thumbnail_path, media_type="image/jpeg")
+
+
+@app.get("/videos/{job_id}/preview.mp4")
+async def get_video_preview(job_id: str):
+    """
+    Serve the short preview clip rendered by post-processing
+    """
+    preview_path = storage.preview_path(job_id)
+    if not preview_path.exists():
+        raise HTTPException(status_code=404, detail="Preview not found")
+    return FileResponse(preview_path, media_type="video/mp4")
+
+
+def _etag_response(http_request: Request, etag: str, build_body) -> Response:
+    """304 if the client already holds this ETag, otherwise the JSON body from build_body()"""
+    etag = f'"{etag}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in http_request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(RawJSON(build_body()), headers=headers)
+
+
 @app.get("/jobs")
-async def list_jobs(status: str = None, limit: int = 100):
+async def list_jobs(
+    http_request: Request,
+    status: str = None,
+    limit: int = 100,
+    updated_since: Optional[str] = Query(None, pattern=r"^\d+(:[\w-]+)?$",
+                                         description="Only jobs changed after this cursor (or epoch ms)"),
+    include_images: bool = True
+):
     """
     List jobs (for debugging/monitoring)
+
+    With updated_since, returns the change feed: jobs created or modified since
+    a previous response's cursor, plus reset=true if all jobs were cleared.
     """
-    jobs = await job_queue.list_jobs(status=status, limit=limit)
+    reset = False
+    if updated_since is not None:
+        jobs, cleared_at, position = await job_queue.list_changes(parse_change_cursor(updated_since), limit=limit)
+        reset = cleared_at is not None
+    else:
+        jobs = await job_queue.list_jobs(status=status, limit=limit)
+        position = await job_queue.get_change_position()
 
-    return {
-        "jobs": [job.to_dict() for job in jobs],
-        "count": len(jobs)
-    }
+    body = (b'{"jobs":[' + b','.join(job.to_json(include_image=include_images) for job in jobs)
+            + b'],"count":' + str(len(jobs)).encode()
+            + b',"cursor":' + dumps(format_change_cursor(position))
+            + (b',"reset":true}' if reset else b'}'))
+    return _etag_response(http_request, hashlib.blake2b(body, digest_size=16).hexdigest(), lambda: body)
 
 
 @app.delete("/jobs")
@@ -485,40 +935,104 @@ async def clear_jobs():
 
 
 @app.get("/api/logs")
-async def get_logs(limit: int = 50):
+async def get_logs(
+    http_request: Request,
+    limit: int = Query(50, ge=1, le=10000),
+    date: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$", description="Day (YYYY-MM-DD), default today")
+):
     """
-    Get recent request logs
+    Get recent request logs of a day, across its rotated and archived segments
     """
-    log_file = logger.get_log_file()
+    logger.flush()
+    day = date or datetime.now().strftime('%Y-%m-%d')
+    files = logger.archiver.day_files(day)
 
-    if not log_file.exists():
+    if not files:
         return {"logs": [], "count": 0}
 
-    logs = []
-    try:
-        with open(log_file, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
+    def read_logs() -> bytes:
+        logs = []
+        try:
+            for line in logger.archiver.tail(day, limit):
+                try:
+                    logs.append(json.loads(line))
+                except json.JSONDecodeError:
+                    pass
+
+            return dumps({
+                "logs": logs,
+                "count": len(logs)
+            })
+        except Exception as e:
+            return dumps({
+                "error": str(e),
+                "logs": [],
+                "count": 0
+            })
+
+    # Log files are append-only and rotation renames them, so names, sizes and mtimes identify the content.
+    versions = []
+    for path in files:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            continue
+        versions.append(f"{path.name}-{stat.st_size}-{stat.st_mtime_ns}")
+    version = hashlib.blake2b("/".join(versions).encode(), digest_size=8).hexdigest()
+    return _etag_response(http_request, f"{day}-{version}-{limit}", read_logs)
+
+
+@app.get("/api/dispatch/stats")
+async def get_dispatch_stats():
+    """
+    Expected generation time per job type and the share of jobs shed at dispatch
+    """
+    return load_shedder.stats()
 
-        # Get last N lines
-        recent_lines = lines[-limit:] if len(lines) > limit else lines
 
-        # Parse JSON logs
-        for line in recent_lines:
-            try:
-                logs.append(json.loads(line.strip()))
-            except json.JSONDecodeError:
-                pass
+@app.get("/api/webhooks/stats")
+async def get_webhook_stats():
+    """
+    Completion webhook outcomes in this process and the undelivered backlog
+    """
+    return await webhook_dispatcher.stats()
 
-        return {
-            "logs": logs,
-            "count": len(logs)
-        }
-    except Exception as e:
-        return {
-            "error": str(e),
-            "logs": [],
-            "count": 0
-        }
+
+@app.get("/api/db/stats")
+async def get_db_stats():
+    """
+    Group commit batches of job writes and the pending index of this process
+    """
+    return {**job_queue.writer.stats(), "pending_index": job_queue.pending.counts()}
+
+
+@app.get("/api/storage/stats")
+async def get_storage_stats():
+    """
+    Stored video content, references to it and the space deduplication saves
+    """
+    return await asyncio.to_thread(storage.stats)
+
+
+@app.get("/api/logs/stats")
+async def get_log_stats():
+    """
+    Request logging overhead and writer counters
+    """
+    return logger.stats()
+
+
+@app.get("/api/logs/summary")
+async def get_log_summary(
+    start: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$", description="First day (YYYY-MM-DD)"),
+    end: Optional[str] = Query(None, pattern=r"^\d{4}-\d{2}-\d{2}$", description="Last day (YYYY-MM-DD)")
+):
+    """
+    Request counts, errors and latency percentiles per path over a range of days,
+    merged from per-file rollups rather than scanned from the raw logs
+    """
+    logger.flush()
+    return FastJSONResponse(await asyncio.to_thread(logger.archiver.summary, start, end))
 
 
 @app.delete("/api/logs")
@@ -531,9 +1045,14 @@ async def clear_logs():
 
 
 if __name__ == "__main__":
+    import uvicorn
+
+    # SERVER_WORKERS > 1 is the production mode: several processes share the
+    # SQLite queue and coordinate through the broker; auto-reload is dev-only.
     uvicorn.run(
         "server:app",
         host=config.SERVER_HOST,
         port=config.SERVER_PORT,
-        reload=True
+        reload=config.SERVER_WORKERS <= 1,
+        workers=config.SERVER_WORKERS
     )
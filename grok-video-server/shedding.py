@@ -0,0 +1,118 @@
+"""
+Deadline-aware dispatch and load shedding.
+
+Every job carries a deadline: CHAT_COMPLETION_WAIT_SECONDS after submission for
+chat (the caller stops waiting then) and JOB_TIMEOUT_SECONDS for video (stale
+cleanup fails it then), or sooner if the client sends X-Request-Timeout. Before
+a worker claims a job, pending jobs of that type that cannot finish in time,
+given the median generation time of recent jobs, are failed instead of
+dispatched. Under backlog the fleet then only works on jobs that can succeed.
+The earliest deadline is known from the in-memory pending index, so a poll only
+writes when some job has actually run out of time.
+"""
+
+import asyncio
+import statistics
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Tuple
+
+import config
+from job_queue import job_queue
+from models import JobType
+from tracing import span_exporter
+
+
+class LoadShedder:
+    """
+    Per-type generation time estimates plus shed/dispatch counts for the shed-rate
+    metric. Estimates are refreshed from the jobs table at most every
+    QUEUE_STATS_REFRESH_SECONDS; counts are kept in process memory.
+    """
+
+    # Recent completions the generation time estimate is taken from
+    SAMPLE_SIZE = 50
+    # Below this many samples only jobs already past their deadline are shed
+    MIN_SAMPLES = 5
+
+    def __init__(self, queue=None):
+        self.queue = queue or job_queue
+        self._estimates: Dict[str, Tuple[int, float]] = {}
+        self._refresh_lock = asyncio.Lock()
+        # (monotonic time, shed count, dispatched count) per job type
+        self._events: Dict[str, Deque[Tuple[float, int, int]]] = {}
+
+    @staticmethod
+    def default_deadline_ms(job_type: str, timeout_seconds: float = None) -> int:
+        """Deadline for a job submitted now; an explicit timeout can only shorten it"""
+        if job_type == JobType.CHAT.value:
+            limit = config.CHAT_COMPLETION_WAIT_SECONDS
+        else:
+            limit = config.JOB_TIMEOUT_SECONDS
+        if timeout_seconds is not None:
+            limit = min(limit, timeout_seconds)
+        return int((time.time() + limit) * 1000)
+
+    async def expected_generation_ms(self, job_type: str) -> int:
+        """Median claim-to-completion time of recent jobs; 0 until there are enough samples"""
+        estimate, refreshed_at = self._estimates.get(job_type, (0, 0.0))
+        if time.monotonic() - refreshed_at < config.QUEUE_STATS_REFRESH_SECONDS:
+            return estimate
+        async with self._refresh_lock:
+            estimate, refreshed_at = self._estimates.get(job_type, (0, 0.0))
+            if time.monotonic() - refreshed_at < config.QUEUE_STATS_REFRESH_SECONDS:
+                return estimate
+            samples = await self.queue.get_service_times(job_type, limit=self.SAMPLE_SIZE)
+            estimate = int(statistics.median(samples)) if len(samples) >= self.MIN_SAMPLES else 0
+            self._estimates[job_type] = (estimate, time.monotonic())
+        return estimate
+
+    async def shed(self, job_type: str) -> int:
+        """
+        Fail pending jobs of a type that can no longer finish in time
+
+        Returns:
+            The earliest deadline a job claimed now can have (epoch ms)
+        """
+        expected_ms = await self.expected_generation_ms(job_type)
+        min_deadline_ms = int(time.time() * 1000) + expected_ms
+        job_ids = await self.queue.shed_pending_jobs(
+            job_type, min_deadline_ms,
+            f"Shed: deadline would pass before a worker could finish (expected {expected_ms} ms)"
+        )
+        for job_id in job_ids:
+            span_exporter.submit(job_id)
+        if job_ids:
+            self._record(job_type, shed=len(job_ids))
+        return min_deadline_ms
+
+    def note_dispatched(self, job_type: str):
+        self._record(job_type, dispatched=1)
+
+    def _record(self, job_type: str, shed: int = 0, dispatched: int = 0):
+        events = self._events.setdefault(job_type, deque())
+        now = time.monotonic()
+        events.append((now, shed, dispatched))
+        while events and now - events[0][0] > config.SHED_RATE_WINDOW_SECONDS:
+            events.popleft()
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """Per-type generation estimate, shed and dispatched counts and shed rate over the window"""
+        now = time.monotonic()
+        stats = {}
+        for job_type in JobType:
+            events = [e for e in self._events.get(job_type.value, ())
+                      if now - e[0] <= config.SHED_RATE_WINDOW_SECONDS]
+            shed = sum(e[1] for e in events)
+            dispatched = sum(e[2] for e in events)
+            stats[job_type.value] = {
+                "expected_generation_ms": self._estimates.get(job_type.value, (0, 0.0))[0],
+                "shed": shed,
+                "dispatched": dispatched,
+                "shed_rate": shed / (shed + dispatched) if shed + dispatched else 0.0,
+            }
+        return {"window_seconds": config.SHED_RATE_WINDOW_SECONDS, "job_types": stats}
+
+
+# Global load shedder instance
+load_shedder = LoadShedder()
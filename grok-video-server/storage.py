@@ -1,19 +1,97 @@
+"""
+Video files, chunked uploads and post-processing output.
+
+Videos are stored once per content: blobs/{sha256}.mp4 holds each distinct
+upload (named by the SHA-256 of the bytes as uploaded, computed while they are
+written) and {job_id}.mp4 is a hard link to it. Workers that return the same
+asset again (cached prompts, retries after a timeout, resubmissions) add only a
+directory entry, so a duplicate costs no disk space and shares the page cache of
+the first copy, while /videos/{job_id}.mp4 keeps working unchanged. A blob's link
+count is its reference count: it is deleted once no job links to it. The jobs
+table records which blob a job uses (video_sha256).
+
+Where hard links are unsupported the upload is moved to {job_id}.mp4 as before.
+"""
+
 import aiofiles
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import weakref
 from pathlib import Path
-from typing import Optional
+from typing import AsyncIterator, List, NamedTuple, Optional, Tuple
 from datetime import datetime, timedelta
 import config
+import mp4
+
+
+class UploadError(ValueError):
+    """Invalid chunked upload operation (bad offset, incomplete data, checksum mismatch)"""
+
 
-# Setup video storage directory
-VIDEO_DIR = Path(config.VIDEO_STORAGE_PATH)
-VIDEO_DIR.mkdir(exist_ok=True)
+class StoredVideo(NamedTuple):
+    """A job's video in storage"""
+    path: str
+    size: int
+    sha256: str
+    # True if the same content was already stored and only a link was added
+    duplicate: bool = False
+
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Merge [start, end) byte ranges"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
 
 
 class VideoStorage:
-    def __init__(self):
-        self.video_dir = VIDEO_DIR
+    def __init__(self, video_dir: str = None):
+        self._root = video_dir
+        self._video_dir: Optional[Path] = None
+        # One remux per blob at a time; a lock goes away with its last user
+        self._remux_locks = weakref.WeakValueDictionary()
+        self._stats = {"stored": 0, "duplicates": 0, "duplicate_bytes": 0, "evicted": 0}
+
+    def _ensure_dirs(self) -> Path:
+        """Resolve the storage path and create directories on first use, not at import"""
+        if self._video_dir is None:
+            video_dir = Path(self._root or config.VIDEO_STORAGE_PATH)
+            # Chunked uploads: {job_id}.part (sparse data file), .meta (size), .ranges (received chunks)
+            (video_dir / 'uploads').mkdir(parents=True, exist_ok=True)
+            # Post-processing output: {job_id}.jpg poster thumbnail, {job_id}.preview.mp4 short preview
+            (video_dir / 'media').mkdir(exist_ok=True)
+            # Video content: {sha256}.mp4, hard-linked as {job_id}.mp4 by every job that returned it
+            (video_dir / 'blobs').mkdir(exist_ok=True)
+            self._video_dir = video_dir
+        return self._video_dir
+
+    @property
+    def video_dir(self) -> Path:
+        return self._ensure_dirs()
+
+    @property
+    def upload_dir(self) -> Path:
+        return self._ensure_dirs() / 'uploads'
 
-    async def save_video(self, job_id: str, video_data: bytes) -> str:
+    @property
+    def media_dir(self) -> Path:
+        return self._ensure_dirs() / 'media'
+
+    @property
+    def blob_dir(self) -> Path:
+        return self._ensure_dirs() / 'blobs'
+
+    def blob_path(self, sha256: str) -> Path:
+        return self.blob_dir / f"{sha256}.mp4"
+
+    async def save_video(self, job_id: str, video_data: bytes) -> StoredVideo:
         """
         Save video file to storage
 
@@ -22,14 +100,203 @@ class VideoStorage:
             video_data: Video file bytes
 
         Returns:
-            Path to saved video file
+            The stored video
         """
-        video_path = self.video_dir / f"{job_id}.mp4"
+        tmp_path = self.upload_dir / f"{job_id}.stream"
 
-        async with aiofiles.open(video_path, 'wb') as f:
+        async with aiofiles.open(tmp_path, 'wb') as f:
             await f.write(video_data)
 
-        return str(video_path)
+        return await self._store(job_id, tmp_path, len(video_data), hashlib.sha256(video_data).hexdigest())
+
+    async def save_video_stream(self, job_id: str, chunks: AsyncIterator[bytes]) -> StoredVideo:
+        """
+        Save video from an async iterator of chunks without holding it in memory,
+        hashing it as it is written
+
+        Returns:
+            The stored video
+        """
+        tmp_path = self.upload_dir / f"{job_id}.stream"
+        digest = hashlib.sha256()
+        size = 0
+
+        async with aiofiles.open(tmp_path, 'wb') as f:
+            async for chunk in chunks:
+                await f.write(chunk)
+                digest.update(chunk)
+                size += len(chunk)
+
+        return await self._store(job_id, tmp_path, size, digest.hexdigest())
+
+    async def _store(self, job_id: str, tmp_path: Path, size: int, sha256: str) -> StoredVideo:
+        duplicate = await asyncio.to_thread(self._link_blob, job_id, tmp_path, sha256)
+        self._stats["stored"] += 1
+        if duplicate:
+            self._stats["duplicates"] += 1
+            self._stats["duplicate_bytes"] += size
+        return StoredVideo(str(self.video_dir / f"{job_id}.mp4"), size, sha256, duplicate)
+
+    def _link_blob(self, job_id: str, tmp_path: Path, sha256: str) -> bool:
+        """
+        Make {job_id}.mp4 a link to the blob for sha256, creating the blob from
+        tmp_path unless it already exists; tmp_path is consumed
+
+        Returns:
+            True if the blob already existed
+        """
+        video_path = self.video_dir / f"{job_id}.mp4"
+        blob_path = self.blob_path(sha256)
+        try:
+            for attempt in range(3):
+                try:
+                    # Creating the blob by linking is atomic: of concurrent uploads of the
+                    # same content, one creates it and the others find it
+                    os.link(tmp_path, blob_path)
+                    duplicate = False
+                except FileExistsError:
+                    duplicate = True
+                try:
+                    self._link_video(blob_path, video_path)
+                    break
+                except FileNotFoundError:
+                    # Evicted between the two links; store it again
+                    if attempt == 2:
+                        raise
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            # No hard links on this filesystem (or too many to one file): keep a private copy
+            print(f"Storing {job_id} without deduplication: {e}")
+            os.replace(tmp_path, video_path)
+            return False
+
+        tmp_path.unlink()
+        # A blob's mtime is when a job last referenced it; eviction goes by it
+        os.utime(blob_path)
+        return duplicate
+
+    def _link_video(self, blob_path: Path, video_path: Path):
+        """Point video_path at blob_path, replacing any file already there atomically"""
+        link_path = self.upload_dir / f"{video_path.stem}.link"
+        link_path.unlink(missing_ok=True)
+        os.link(blob_path, link_path)
+        os.replace(link_path, video_path)
+
+    def _upload_paths(self, job_id: str) -> Tuple[Path, Path, Path]:
+        return (self.upload_dir / f"{job_id}.part",
+                self.upload_dir / f"{job_id}.meta",
+                self.upload_dir / f"{job_id}.ranges")
+
+    def upload_status(self, job_id: str) -> Optional[dict]:
+        """
+        Get state of a chunked upload
+
+        Returns:
+            Dict with size, received and missing [start, end) ranges, or None
+        """
+        _, meta_path, ranges_path = self._upload_paths(job_id)
+        if not meta_path.exists():
+            return None
+
+        size = json.loads(meta_path.read_text())['size']
+        ranges = []
+        if ranges_path.exists():
+            for line in ranges_path.read_text().splitlines():
+                offset, length = (int(value) for value in line.split())
+                ranges.append((offset, offset + length))
+        received = _merge_ranges(ranges)
+
+        missing = []
+        position = 0
+        for start, end in received:
+            if start > position:
+                missing.append((position, start))
+            position = max(position, end)
+        if position < size:
+            missing.append((position, size))
+
+        return {
+            "size": size,
+            "received": [list(r) for r in received],
+            "missing": [list(r) for r in missing],
+        }
+
+    async def init_upload(self, job_id: str, size: int) -> dict:
+        """
+        Start (or resume) a chunked upload of `size` bytes for a job
+
+        An existing upload of the same size is resumed; a different size restarts it.
+        """
+        status = self.upload_status(job_id)
+        if status is not None and status['size'] == size:
+            return status
+
+        part_path, meta_path, ranges_path = self._upload_paths(job_id)
+        ranges_path.unlink(missing_ok=True)
+        async with aiofiles.open(part_path, 'wb') as f:
+            await f.truncate(size)
+        meta_path.write_text(json.dumps({"size": size, "created_at": int(datetime.now().timestamp())}))
+
+        return self.upload_status(job_id)
+
+    async def write_chunk(self, job_id: str, offset: int, length: int,
+                          chunks: AsyncIterator[bytes]) -> int:
+        """
+        Write one chunk at `offset` as it streams in; chunks may arrive in any order
+        and in parallel
+
+        Returns:
+            Bytes written
+        """
+        status = self.upload_status(job_id)
+        if status is None:
+            raise LookupError(f"No upload in progress for {job_id}")
+        if offset < 0 or length <= 0 or offset + length > status['size']:
+            raise UploadError(f"Chunk [{offset}, {offset + length}) is outside the {status['size']}-byte upload")
+
+        part_path, _, ranges_path = self._upload_paths(job_id)
+        written = 0
+        async with aiofiles.open(part_path, 'r+b') as f:
+            await f.seek(offset)
+            async for piece in chunks:
+                written += len(piece)
+                if written > length:
+                    raise UploadError(f"Chunk body is longer than declared length {length}")
+                await f.write(piece)
+
+        if written != length:
+            raise UploadError(f"Chunk body ended after {written} of {length} bytes")
+
+        # One short O_APPEND write per chunk keeps the range log consistent across processes.
+        async with aiofiles.open(ranges_path, 'a') as f:
+            await f.write(f"{offset} {length}\n")
+
+        return written
+
+    async def finalize_upload(self, job_id: str, sha256: str) -> StoredVideo:
+        """
+        Verify a complete chunked upload against its SHA-256 and move it into place
+
+        Returns:
+            The stored video
+        """
+        status = self.upload_status(job_id)
+        if status is None:
+            raise LookupError(f"No upload in progress for {job_id}")
+        if status['missing']:
+            raise UploadError(f"Upload incomplete, missing ranges: {status['missing'][:5]}")
+
+        part_path, meta_path, ranges_path = self._upload_paths(job_id)
+        digest = await asyncio.to_thread(_sha256_file, part_path)
+        if digest != sha256.lower():
+            raise UploadError(f"Checksum mismatch: expected {sha256.lower()}, got {digest}")
+
+        stored = await self._store(job_id, part_path, status['size'], digest)
+        meta_path.unlink(missing_ok=True)
+        ranges_path.unlink(missing_ok=True)
+
+        return stored
 
     async def get_video_path(self, job_id: str) -> Optional[str]:
         """
@@ -48,6 +315,78 @@ class VideoStorage:
 
         return None
 
+    def thumbnail_path(self, job_id: str) -> Path:
+        return self.media_dir / f"{job_id}.jpg"
+
+    def preview_path(self, job_id: str) -> Path:
+        return self.media_dir / f"{job_id}.preview.mp4"
+
+    async def faststart(self, job_id: str, sha256: Optional[str]) -> bool:
+        """
+        Remux a job's video for faststart
+
+        A blob is remuxed once: the result replaces it for jobs linking to it from
+        then on, and jobs that linked the original are moved over as they are
+        post-processed. Videos stored without a blob are remuxed on their own.
+
+        Returns:
+            True if this call remuxed the video
+        """
+        if sha256 is None:
+            return await asyncio.to_thread(mp4.faststart_in_place, self.video_dir / f"{job_id}.mp4", self.upload_dir)
+        lock = self._remux_locks.get(sha256)
+        if lock is None:
+            lock = self._remux_locks[sha256] = asyncio.Lock()
+        async with lock:
+            return await asyncio.to_thread(self._faststart_blob, job_id, sha256)
+
+    def _faststart_blob(self, job_id: str, sha256: str) -> bool:
+        video_path = self.video_dir / f"{job_id}.mp4"
+        blob_path = self.blob_path(sha256)
+        try:
+            if not os.path.samefile(blob_path, video_path):
+                # Remuxed for an earlier job with the same content
+                self._link_video(blob_path, video_path)
+        except FileNotFoundError:
+            # Evicted, or stored without a blob
+            return mp4.faststart_in_place(video_path, self.upload_dir)
+
+        # Unique per process, as another one may be remuxing the same blob
+        tmp_path = self.upload_dir / f"{sha256}.{os.getpid()}.faststart"
+        try:
+            if not mp4.faststart(blob_path, tmp_path):
+                return False
+            shutil.copystat(blob_path, tmp_path)
+            os.replace(tmp_path, blob_path)
+            self._link_video(blob_path, video_path)
+            return True
+        except FileNotFoundError:
+            # Evicted meanwhile; the job keeps the original
+            return False
+        finally:
+            tmp_path.unlink(missing_ok=True)
+
+    def link_media(self, source: Path, target: Path) -> bool:
+        """
+        Give target the content of another job's post-processing output (same video)
+
+        Returns:
+            False if source no longer exists
+        """
+        link_path = target.with_name(target.name + '.link')
+        link_path.unlink(missing_ok=True)
+        try:
+            os.link(source, link_path)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            try:
+                shutil.copyfile(source, link_path)
+            except FileNotFoundError:
+                return False
+        os.replace(link_path, target)
+        return True
+
     def list_videos(self) -> list:
         """List all video files in storage"""
         return [f.name for f in self.video_dir.glob("*.mp4")]
@@ -56,6 +395,10 @@ class VideoStorage:
         """
         Delete videos older than max_age_days
 
+        A job's video is as old as the last job to store the same content: dropping
+        older links to a blob that is still referenced frees nothing, so all jobs
+        sharing it expire together. Blobs are deleted once no job links to them.
+
         Args:
             max_age_days: Maximum age in days (default from config)
         """
@@ -74,6 +417,56 @@ class VideoStorage:
                 except Exception as e:
                     print(f"Failed to delete {video_file.name}: {e}")
 
+        self._stats["evicted"] += await asyncio.to_thread(self._delete_unreferenced_blobs)
+
+        # Abandoned chunked uploads and post-processing output
+        for directory in (self.upload_dir, self.media_dir):
+            for stale_file in directory.iterdir():
+                if datetime.fromtimestamp(stale_file.stat().st_mtime) < cutoff_date:
+                    stale_file.unlink(missing_ok=True)
+
+    def _delete_unreferenced_blobs(self) -> int:
+        """Delete blobs no job links to; returns how many"""
+        deleted = 0
+        for blob_file in self.blob_dir.glob("*.mp4"):
+            try:
+                if blob_file.stat().st_nlink == 1:
+                    blob_file.unlink()
+                    deleted += 1
+            except FileNotFoundError:
+                pass
+        return deleted
+
+    def stats(self) -> dict:
+        """Stored content and the space deduplication saves (scans the blob directory)"""
+        blobs = blob_bytes = references = saved_bytes = 0
+        for blob_file in self.blob_dir.glob("*.mp4"):
+            try:
+                st = blob_file.stat()
+            except FileNotFoundError:
+                continue
+            links = st.st_nlink - 1
+            blobs += 1
+            blob_bytes += st.st_size
+            references += links
+            saved_bytes += st.st_size * max(links - 1, 0)
+        return {
+            "blobs": blobs,
+            "blob_bytes": blob_bytes,
+            "references": references,
+            "saved_bytes": saved_bytes,
+            # Uploads stored by this process, how many were already stored, and blobs evicted
+            **self._stats,
+        }
+
+
+def _sha256_file(path: Path, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
 
 # Global storage instance
 storage = VideoStorage()
@@ -0,0 +1,368 @@
+"""
+Structured chat output: JSON extraction and `response_format` enforcement.
+
+Grok answers in free-form text, so JSON response formats are applied to the
+finished answer: the first JSON object is extracted and, for `json_schema`,
+validated against the request's schema. Schemas are compiled once into nested
+validator functions and cached by content hash, so workers completing many
+jobs with the same schema never re-walk it.
+
+Supported schema keywords: type, enum, const, properties, required,
+additionalProperties, items, minItems, maxItems, minLength, maxLength, pattern,
+minimum, maximum, exclusiveMinimum, exclusiveMaximum, anyOf, oneOf, allOf and
+local $ref (#/$defs/..., #/definitions/...). Other keywords are annotations and
+are ignored, as JSON Schema specifies.
+"""
+
+import hashlib
+import json
+import re
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Returns an error message, or None if the value is valid
+Validator = Callable[[Any, str], Optional[str]]
+
+SCHEMA_CACHE_SIZE = 256
+
+_DECODER = json.JSONDecoder()
+_STRUCTURAL_CHARS = re.compile(r'[{}"\\]')
+# A JSON object opens with a key or closes straight away
+_OBJECT_START = re.compile(r'\{\s*["}]')
+
+
+class SchemaError(ValueError):
+    """response_format carries a schema that cannot be compiled"""
+
+
+def _brace_spans(text: str, start: int, stop: int) -> Iterator[Tuple[int, int]]:
+    """
+    (start, end) of each top-level {...} run in text[start:stop], in order
+
+    Quotes only open strings inside braces, so apostrophes and quoted prose
+    around the JSON are ignored. An unterminated run ends at stop.
+    """
+    depth = 0
+    open_at = 0
+    in_string = False
+    escaped_at = -1
+    for match in _STRUCTURAL_CHARS.finditer(text, start, stop):
+        i = match.start()
+        if i == escaped_at:
+            continue
+        ch = text[i]
+        if in_string:
+            if ch == '\\':
+                escaped_at = i + 1
+            elif ch == '"':
+                in_string = False
+        elif depth == 0:
+            if ch == '{':
+                depth, open_at = 1, i
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                yield open_at, i + 1
+    if depth:
+        yield open_at, stop
+
+
+def extract_first_json_object(text: str) -> Optional[str]:
+    """
+    First valid JSON object embedded in free-form text, or None
+
+    One regex-driven pass finds balanced brace runs; only runs that open like an
+    object are decoded, each from a copy of just that run. A run that is not JSON
+    as a whole is searched again for objects nested inside it, so the cost is
+    linear in the text times the nesting depth of malformed runs, rather than a
+    decode of the whole remaining text from every brace.
+    """
+    if not text:
+        return None
+
+    # Regions still to search, innermost last; a popped region is searched in order
+    regions = [(0, len(text))]
+    while regions:
+        start, stop = regions.pop()
+        for span_start, span_end in _brace_spans(text, start, stop):
+            if _OBJECT_START.match(text, span_start):
+                # Decoding the run alone keeps error reporting (which counts lines
+                # up to the failure) proportional to the run, not the text before it
+                candidate = text[span_start:span_end]
+                try:
+                    parsed, end = _DECODER.raw_decode(candidate)
+                except json.JSONDecodeError:
+                    parsed = None
+                if isinstance(parsed, dict):
+                    return candidate[:end]
+            regions.append((span_end, stop))
+            regions.append((span_start + 1, span_end))
+            break
+    return None
+
+
+def _type_checker(name: str) -> Callable[[Any], bool]:
+    checks = {
+        "object": lambda v: isinstance(v, dict),
+        "array": lambda v: isinstance(v, list),
+        "string": lambda v: isinstance(v, str),
+        "boolean": lambda v: isinstance(v, bool),
+        "null": lambda v: v is None,
+        "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+        "integer": lambda v: (isinstance(v, int) and not isinstance(v, bool))
+                             or (isinstance(v, float) and v.is_integer()),
+    }
+    if name not in checks:
+        raise SchemaError(f"Unknown type: {name!r}")
+    return checks[name]
+
+
+class _SchemaCompiler:
+    """Compiles one root schema; $refs are resolved against it and compiled once each"""
+
+    def __init__(self, root: Dict[str, Any]):
+        self.root = root
+        self.refs: Dict[str, Validator] = {}
+
+    def _resolve(self, ref: str) -> Dict[str, Any]:
+        if ref == "#":
+            return self.root
+        if not ref.startswith("#/"):
+            raise SchemaError(f"Only local $ref is supported: {ref!r}")
+        node: Any = self.root
+        for part in ref[2:].split("/"):
+            part = part.replace("~1", "/").replace("~0", "~")
+            if not isinstance(node, dict) or part not in node:
+                raise SchemaError(f"Unresolvable $ref: {ref!r}")
+            node = node[part]
+        return node
+
+    def _ref(self, ref: str) -> Validator:
+        target = self._resolve(ref)
+
+        # Compiled on first use so recursive schemas terminate
+        def validate(value, path):
+            if ref not in self.refs:
+                self.refs[ref] = self.compile(target)
+            return self.refs[ref](value, path)
+        return validate
+
+    def compile(self, schema: Any) -> Validator:
+        if schema is True or schema == {}:
+            return lambda value, path: None
+        if schema is False:
+            return lambda value, path: f"{path}: no value is allowed here"
+        if not isinstance(schema, dict):
+            raise SchemaError(f"Schema must be an object or boolean, got {type(schema).__name__}")
+
+        checks: List[Validator] = []
+        if "$ref" in schema:
+            checks.append(self._ref(schema["$ref"]))
+        if "type" in schema:
+            checks.append(self._compile_type(schema["type"]))
+        if "enum" in schema:
+            options = schema["enum"]
+            checks.append(lambda v, p: None if any(_json_equal(v, o) for o in options)
+                          else f"{p}: must be one of {options!r}")
+        if "const" in schema:
+            const = schema["const"]
+            checks.append(lambda v, p: None if _json_equal(v, const) else f"{p}: must equal {const!r}")
+        checks.extend(self._compile_object(schema))
+        checks.extend(self._compile_array(schema))
+        checks.extend(self._compile_string(schema))
+        checks.extend(self._compile_number(schema))
+        checks.extend(self._compile_combinators(schema))
+
+        def validate(value, path):
+            for check in checks:
+                error = check(value, path)
+                if error:
+                    return error
+            return None
+        return validate
+
+    @staticmethod
+    def _compile_type(types) -> Validator:
+        names = [types] if isinstance(types, str) else list(types)
+        checkers = [_type_checker(name) for name in names]
+        expected = " or ".join(names)
+        return lambda v, p: None if any(check(v) for check in checkers) else f"{p}: expected {expected}"
+
+    def _compile_object(self, schema: Dict[str, Any]) -> List[Validator]:
+        checks: List[Validator] = []
+        properties = {name: self.compile(sub) for name, sub in schema.get("properties", {}).items()}
+        required = list(schema.get("required", []))
+        additional = schema.get("additionalProperties", True)
+        additional_check = None if additional is True else self.compile(additional)
+
+        if not (properties or required or additional_check):
+            return checks
+
+        def validate(value, path):
+            if not isinstance(value, dict):
+                return None
+            for name in required:
+                if name not in value:
+                    return f"{path}: missing required property {name!r}"
+            for name, item in value.items():
+                check = properties.get(name, additional_check)
+                if check is not None:
+                    error = check(item, f"{path}.{name}")
+                    if error:
+                        return error
+            return None
+        checks.append(validate)
+        return checks
+
+    def _compile_array(self, schema: Dict[str, Any]) -> List[Validator]:
+        checks: List[Validator] = []
+        if "items" in schema:
+            item_check = self.compile(schema["items"])
+
+            def validate_items(value, path):
+                if not isinstance(value, list):
+                    return None
+                for i, item in enumerate(value):
+                    error = item_check(item, f"{path}[{i}]")
+                    if error:
+                        return error
+                return None
+            checks.append(validate_items)
+        if "minItems" in schema:
+            low = schema["minItems"]
+            checks.append(lambda v, p: f"{p}: fewer than {low} items" if isinstance(v, list) and len(v) < low else None)
+        if "maxItems" in schema:
+            high = schema["maxItems"]
+            checks.append(lambda v, p: f"{p}: more than {high} items" if isinstance(v, list) and len(v) > high else None)
+        return checks
+
+    @staticmethod
+    def _compile_string(schema: Dict[str, Any]) -> List[Validator]:
+        checks: List[Validator] = []
+        if "minLength" in schema:
+            low = schema["minLength"]
+            checks.append(lambda v, p: f"{p}: shorter than {low} characters" if isinstance(v, str) and len(v) < low else None)
+        if "maxLength" in schema:
+            high = schema["maxLength"]
+            checks.append(lambda v, p: f"{p}: longer than {high} characters" if isinstance(v, str) and len(v) > high else None)
+        if "pattern" in schema:
+            try:
+                pattern = re.compile(schema["pattern"])
+            except (re.error, TypeError) as e:
+                raise SchemaError(f"Invalid pattern {schema['pattern']!r}: {e}")
+            checks.append(lambda v, p: f"{p}: does not match {pattern.pattern!r}"
+                          if isinstance(v, str) and not pattern.search(v) else None)
+        return checks
+
+    @staticmethod
+    def _compile_number(schema: Dict[str, Any]) -> List[Validator]:
+        def is_number(v):
+            return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+        checks: List[Validator] = []
+        bounds = (
+            ("minimum", lambda v, b: v < b, "less than"),
+            ("maximum", lambda v, b: v > b, "greater than"),
+            ("exclusiveMinimum", lambda v, b: v <= b, "not greater than"),
+            ("exclusiveMaximum", lambda v, b: v >= b, "not less than"),
+        )
+        for keyword, violates, message in bounds:
+            if keyword in schema:
+                bound = schema[keyword]
+                checks.append(lambda v, p, bound=bound, violates=violates, message=message:
+                              f"{p}: {message} {bound}" if is_number(v) and violates(v, bound) else None)
+        return checks
+
+    def _compile_combinators(self, schema: Dict[str, Any]) -> List[Validator]:
+        checks: List[Validator] = []
+        if "allOf" in schema:
+            subs = [self.compile(sub) for sub in schema["allOf"]]
+
+            def validate_all(value, path):
+                for sub in subs:
+                    error = sub(value, path)
+                    if error:
+                        return error
+                return None
+            checks.append(validate_all)
+        if "anyOf" in schema:
+            subs = [self.compile(sub) for sub in schema["anyOf"]]
+            checks.append(lambda v, p: None if any(sub(v, p) is None for sub in subs)
+                          else f"{p}: does not match any of anyOf")
+        if "oneOf" in schema:
+            subs = [self.compile(sub) for sub in schema["oneOf"]]
+
+            def validate_one(value, path):
+                matches = sum(1 for sub in subs if sub(value, path) is None)
+                return None if matches == 1 else f"{path}: matches {matches} of oneOf, expected exactly 1"
+            checks.append(validate_one)
+        return checks
+
+
+def _json_equal(a: Any, b: Any) -> bool:
+    """JSON equality: 1 == 1.0, but True != 1"""
+    if isinstance(a, bool) or isinstance(b, bool):
+        return type(a) is type(b) and a == b
+    return a == b
+
+
+_compiled_schemas: "OrderedDict[str, Validator]" = OrderedDict()
+
+
+def compile_schema(schema: Dict[str, Any]) -> Validator:
+    """Compiled validator for a schema, from the per-hash cache when seen before"""
+    try:
+        key = hashlib.blake2b(json.dumps(schema, sort_keys=True, separators=(",", ":")).encode(),
+                              digest_size=16).hexdigest()
+    except (TypeError, ValueError) as e:
+        raise SchemaError(f"Schema is not JSON: {e}")
+
+    validator = _compiled_schemas.get(key)
+    if validator is not None:
+        _compiled_schemas.move_to_end(key)
+        return validator
+
+    try:
+        validator = _SchemaCompiler(schema).compile(schema)
+    except (AttributeError, TypeError) as e:
+        raise SchemaError(f"Malformed schema: {e}")
+    _compiled_schemas[key] = validator
+    if len(_compiled_schemas) > SCHEMA_CACHE_SIZE:
+        _compiled_schemas.popitem(last=False)
+    return validator
+
+
+def format_type(response_format: Optional[Dict[str, Any]]) -> Optional[str]:
+    if not isinstance(response_format, dict):
+        return None
+    return response_format.get("type")
+
+
+def wants_json(response_format: Optional[Dict[str, Any]]) -> bool:
+    """The answer is JSON extracted from the model output, not the text as written"""
+    return format_type(response_format) in ("json_object", "json_schema")
+
+
+def schema_validator(response_format: Optional[Dict[str, Any]]) -> Optional[Validator]:
+    """Compiled validator for a json_schema response_format; None for any other format"""
+    if format_type(response_format) != "json_schema":
+        return None
+    json_schema = response_format.get("json_schema")
+    if not isinstance(json_schema, dict) or "schema" not in json_schema:
+        raise SchemaError("response_format.json_schema.schema is required")
+    return compile_schema(json_schema["schema"])
+
+
+def validate_output(text: str, response_format: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Why the model output does not satisfy a json_schema response_format, or None if it does"""
+    validator = schema_validator(response_format)
+    if validator is None:
+        return None
+    extracted = extract_first_json_object(text)
+    if extracted is None:
+        return "no JSON object found in model output"
+    return validator(json.loads(extracted), "$")
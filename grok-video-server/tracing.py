@@ -0,0 +1,194 @@
+"""
+Per-job critical-path timing, as phase durations and OpenTelemetry-style spans.
+
+Spans are derived from the phase timestamps stored on each job (PHASE_COLUMNS), so
+nothing is recorded twice. When TRACE_EXPORT is set, every finished job becomes one
+trace in OTLP/JSON form: a root span covering enqueue to completion with a child
+span per phase. A file path appends one export request per line; an http(s) URL
+POSTs it to an OTLP/HTTP collector (e.g. http://localhost:4318/v1/traces).
+"""
+
+import asyncio
+import hashlib
+import urllib.request
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import config
+from job_queue import Job, PHASE_COLUMNS, job_queue
+from models import JobStatus
+from serialization import dumps
+
+# (phase, start column, end column); a phase is reported once both ends are known.
+# Generation runs from the first heartbeat (or the claim, for workers that send
+# none) until the upload starts (or the job completes, for chat).
+PHASES = (
+    ("queue_wait", ("enqueued_ms",), ("claimed_ms",)),
+    ("worker_start", ("claimed_ms",), ("first_heartbeat_ms",)),
+    ("generation", ("first_heartbeat_ms", "claimed_ms"), ("upload_started_ms", "completed_ms")),
+    ("upload", ("upload_started_ms",), ("upload_done_ms",)),
+    ("finalize", ("upload_done_ms",), ("completed_ms",)),
+)
+
+# OTLP enum values
+SPAN_KIND_INTERNAL = 1
+STATUS_CODE_OK = 1
+STATUS_CODE_ERROR = 2
+
+
+def _first(job: Job, columns: Tuple[str, ...]) -> Optional[int]:
+    for column in columns:
+        value = getattr(job, column)
+        if value is not None:
+            return value
+    return None
+
+
+def job_phases(job: Job) -> List[Tuple[str, int, int]]:
+    """(phase, start_ms, end_ms) for every phase the job has finished"""
+    phases = []
+    for name, start_columns, end_columns in PHASES:
+        start, end = _first(job, start_columns), _first(job, end_columns)
+        if start is not None and end is not None and end >= start:
+            phases.append((name, start, end))
+    return phases
+
+
+def job_timings(job: Job) -> Dict[str, Any]:
+    """Phase timestamps plus per-phase and total durations, for API responses"""
+    timings: Dict[str, Any] = {column: getattr(job, column) for column in PHASE_COLUMNS}
+    durations = {name: end - start for name, start, end in job_phases(job)}
+    if job.enqueued_ms is not None and job.completed_ms is not None:
+        durations["total"] = job.completed_ms - job.enqueued_ms
+    timings["durations_ms"] = durations
+    return timings
+
+
+def _span_id(job_id: str, name: str) -> str:
+    return hashlib.blake2b(f"{job_id}/{name}".encode(), digest_size=8).hexdigest()
+
+
+def _attribute(key: str, value) -> Dict[str, Any]:
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _span(job: Job, trace_id: str, name: str, start_ms: int, end_ms: int,
+          parent_id: Optional[str] = None, attributes: List[Dict[str, Any]] = ()) -> Dict[str, Any]:
+    span = {
+        "traceId": trace_id,
+        "spanId": _span_id(job.job_id, name),
+        "name": name,
+        "kind": SPAN_KIND_INTERNAL,
+        "startTimeUnixNano": str(start_ms * 1_000_000),
+        "endTimeUnixNano": str(end_ms * 1_000_000),
+        "attributes": list(attributes),
+    }
+    if parent_id:
+        span["parentSpanId"] = parent_id
+    return span
+
+
+def job_trace(job: Job) -> Optional[Dict[str, Any]]:
+    """
+    OTLP/JSON ExportTraceServiceRequest for a finished job
+
+    IDs are derived from the job ID, so exporting the same job twice yields the
+    same spans. Returns None if the job has no enqueue or completion time.
+    """
+    if job.enqueued_ms is None or job.completed_ms is None:
+        return None
+
+    trace_id = hashlib.blake2b(job.job_id.encode(), digest_size=16).hexdigest()
+    attributes = [_attribute("job.id", job.job_id), _attribute("job.type", job.job_type),
+                  _attribute("job.status", job.status)]
+    if job.client_id:
+        attributes.append(_attribute("worker.client_id", job.client_id))
+
+    root = _span(job, trace_id, f"job {job.job_type}", job.enqueued_ms, job.completed_ms, attributes=attributes)
+    failed = job.status == JobStatus.FAILED
+    root["status"] = {"code": STATUS_CODE_ERROR if failed else STATUS_CODE_OK}
+    if failed and job.error:
+        root["status"]["message"] = job.error
+
+    spans = [root] + [
+        _span(job, trace_id, name, start, end, parent_id=root["spanId"])
+        for name, start, end in job_phases(job)
+    ]
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [_attribute("service.name", config.TRACE_SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": "grok-video-server.jobs"}, "spans": spans}],
+        }]
+    }
+
+
+class SpanExporter:
+    """
+    Exports finished jobs' traces from a background task, off the request path.
+
+    Export is best-effort: a full queue or an unreachable collector drops the
+    trace, never affects the job.
+    """
+
+    def __init__(self, queue=None, target: str = None, max_queued: int = 1000):
+        self.job_queue = queue or job_queue
+        self.target = target
+        self.max_queued = max_queued
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self.target = self.target or config.TRACE_EXPORT
+        if not self.target:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queued)
+        self._task = asyncio.create_task(self._worker())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._queue = None
+
+    def submit(self, job_id: str) -> bool:
+        """Queue a finished job for export; False if export is off or the queue is full"""
+        if self._queue is None:
+            return False
+        try:
+            self._queue.put_nowait(job_id)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def _worker(self):
+        while True:
+            job_id = await self._queue.get()
+            try:
+                job = await self.job_queue.get_job(job_id)
+                trace = job_trace(job) if job else None
+                if trace is not None:
+                    await asyncio.to_thread(self._write, dumps(trace))
+            except Exception as e:
+                print(f"Trace export failed for {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _write(self, body: bytes):
+        if self.target.startswith(("http://", "https://")):
+            request = urllib.request.Request(
+                self.target, data=body, method="POST", headers={"Content-Type": "application/json"}
+            )
+            with urllib.request.urlopen(request, timeout=5):
+                pass
+        else:
+            path = Path(self.target.removeprefix("file://"))
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(body + b"\n")
+
+
+# Global span exporter instance
+span_exporter = SpanExporter()
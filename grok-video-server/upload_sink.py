@@ -0,0 +1,253 @@
+"""
+Direct-to-storage video upload sink.
+
+`/extension/poll` hands video workers a short-lived signed upload token and URL.
+The sink is a bare ASGI app that checks the token and streams bodies straight to
+the storage path, then completes the job, without FastAPI request handling.
+It is mounted at /upload on the API server and can also run as its own process,
+so video bytes stop competing with API traffic:
+
+    uvicorn upload_sink:app --host 0.0.0.0 --port 8001
+    UPLOAD_SINK_URL=http://localhost:8001 python server.py
+
+Routes (token in `Authorization: Bearer`, never the URL, which is logged):
+    PUT  /upload/{job_id}                    whole video as the body
+    POST /upload/{job_id}?size=N             start or resume a chunked upload
+    PUT  /upload/{job_id}?offset=N           one chunk
+    POST /upload/{job_id}/complete?sha256=H  verify and complete the job
+"""
+
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from typing import Optional, Tuple
+from urllib.parse import parse_qs
+
+import config
+from broker import broker
+from job_queue import job_queue
+from logger import logger, RequestLoggingMiddleware
+from models import JobStatus
+from postprocess import postprocessor
+from serialization import dumps
+from storage import storage, StoredVideo, UploadError
+from tracing import span_exporter
+
+SECRET_FILE_NAME = '.upload_token_secret'
+
+
+class UploadTokenSigner:
+    """HMAC-signed, expiring upload tokens bound to one job ID"""
+
+    def __init__(self, secret: str = None):
+        self._secret: Optional[bytes] = secret.encode() if secret else None
+
+    @property
+    def secret(self) -> bytes:
+        if self._secret is None:
+            self._secret = (config.UPLOAD_TOKEN_SECRET or self._shared_secret()).encode()
+        return self._secret
+
+    @staticmethod
+    def _shared_secret() -> str:
+        """Random secret kept in the storage directory so every process on the host agrees on it"""
+        path = storage.video_dir / SECRET_FILE_NAME
+        if not path.exists():
+            tmp_path = path.with_name(f"{SECRET_FILE_NAME}.{os.getpid()}")
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(secrets.token_hex(32))
+            try:
+                # link() fails if another process created the file first; its secret wins
+                os.link(tmp_path, path)
+            except FileExistsError:
+                pass
+            finally:
+                tmp_path.unlink()
+        return path.read_text().strip()
+
+    def _signature(self, job_id: str, expires_at: int) -> str:
+        return hmac.new(self.secret, f"{job_id}.{expires_at}".encode(), hashlib.sha256).hexdigest()
+
+    def issue(self, job_id: str) -> Tuple[str, int]:
+        """(token, expires_at epoch seconds) for uploading job_id's video"""
+        expires_at = int(time.time()) + config.UPLOAD_TOKEN_TTL_SECONDS
+        return f"{expires_at}.{self._signature(job_id, expires_at)}", expires_at
+
+    def verify(self, job_id: str, token: str) -> bool:
+        expires, _, signature = token.partition('.')
+        if not expires.isdigit() or int(expires) < time.time():
+            return False
+        return hmac.compare_digest(signature, self._signature(job_id, int(expires)))
+
+
+def upload_url(job_id: str) -> str:
+    base = config.UPLOAD_SINK_URL or f"http://localhost:{config.SERVER_PORT}"
+    return f"{base.rstrip('/')}/upload/{job_id}"
+
+
+async def complete_video_job(job_id: str, video: StoredVideo, upload_started_ms: Optional[int] = None) -> bool:
+    """
+    Mark a video job completed once its file is in storage and queue follow-up work;
+    False if the job was cancelled meanwhile (the file is kept until normal cleanup)
+    """
+    completed = await job_queue.update_job_status(
+        job_id=job_id,
+        status=JobStatus.COMPLETED,
+        video_path=video.path,
+        video_sha256=video.sha256,
+        upload_started_ms=upload_started_ms,
+        upload_done_ms=int(time.time() * 1000)
+    )
+    if completed:
+        postprocessor.submit(job_id, video.path)
+        span_exporter.submit(job_id)
+    return completed
+
+
+class UploadSink:
+    """ASGI app for token-authenticated video uploads (see module docstring)"""
+
+    def __init__(self, signer: UploadTokenSigner = None):
+        self.signer = signer or upload_token_signer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        status, body = await self._handle(scope, receive)
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        """Only runs when the sink is served on its own; mounted apps get no lifespan events"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                # On its own the sink is a second process on the jobs database
+                broker.shared = True
+                await job_queue.init_db()
+                await broker.init()
+                await postprocessor.start()
+                await span_exporter.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await span_exporter.stop()
+                await postprocessor.stop()
+                await job_queue.close()
+                await broker.close()
+                logger.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    def _error(status: int, detail: str) -> Tuple[int, bytes]:
+        logger.annotate(error=detail)
+        return status, dumps({"detail": detail})
+
+    def _token(self, scope) -> str:
+        for name, value in scope.get("headers", []):
+            if name == b"authorization" and value[:7].lower() == b"bearer ":
+                return value[7:].decode("latin-1")
+        return ""
+
+    async def _handle(self, scope, receive) -> Tuple[int, bytes]:
+        received_ms = int(time.time() * 1000)
+        # Works mounted (path with or without the mount prefix) and standalone
+        parts = scope["path"].strip("/").split("/")
+        action = None
+        if parts and parts[-1] == "complete":
+            action = parts.pop()
+        if not parts or not parts[-1] or parts[-1] == "upload":
+            return self._error(404, "Not found")
+        job_id = parts[-1]
+        logger.annotate(job_id=job_id)
+
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        if not self.signer.verify(job_id, self._token(scope)):
+            return self._error(403, "Invalid or expired upload token")
+        if await job_queue.get_job(job_id) is None:
+            return self._error(404, "Job not found")
+
+        async def body_chunks():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    raise UploadError("Client disconnected")
+                chunk = message.get("body", b"")
+                if chunk:
+                    yield chunk
+                if not message.get("more_body", False):
+                    return
+
+        method = scope["method"]
+        try:
+            if method == "PUT" and action is None and "offset" not in query:
+                video = await storage.save_video_stream(job_id, body_chunks())
+                logger.annotate(video_size=video.size, video_duplicate=video.duplicate)
+                if not await complete_video_job(job_id, video, upload_started_ms=received_ms):
+                    return self._error(409, "Job was cancelled")
+                return 200, dumps({"status": "ok", "job_id": job_id, "size": video.size})
+
+            if method == "PUT" and action is None:
+                length = self._content_length(scope)
+                if length is None:
+                    return self._error(411, "Content-Length required")
+                if length > config.UPLOAD_MAX_CHUNK_BYTES:
+                    return self._error(413, f"Chunk larger than {config.UPLOAD_MAX_CHUNK_BYTES} bytes")
+                offset = int(query["offset"][0])
+                written = await storage.write_chunk(job_id, offset, length, body_chunks())
+                return 200, dumps({"status": "ok", "upload_id": job_id, "offset": offset, "length": written})
+
+            if method == "POST" and action is None:
+                size = int(query.get("size", ["0"])[0])
+                if size <= 0:
+                    return self._error(400, "size must be a positive byte count")
+                status = await storage.init_upload(job_id, size)
+                await job_queue.record_phase(job_id, 'upload_started_ms', received_ms)
+                return 200, dumps({
+                    "upload_id": job_id,
+                    "size": status["size"],
+                    "chunk_size": config.UPLOAD_CHUNK_SIZE,
+                    "received": status["received"],
+                    "missing": status["missing"],
+                })
+
+            if method == "POST" and action == "complete":
+                sha256 = query.get("sha256", [""])[0]
+                if len(sha256) != 64:
+                    return self._error(400, "sha256 must be a 64-character hex digest")
+                video = await storage.finalize_upload(job_id, sha256)
+                logger.annotate(video_duplicate=video.duplicate)
+                if not await complete_video_job(job_id, video):
+                    return self._error(409, "Job was cancelled")
+                return 200, dumps({"status": "ok", "job_id": job_id})
+        except ValueError as e:
+            # UploadError, or a malformed offset/size
+            return self._error(409 if action == "complete" else 400, str(e))
+        except LookupError:
+            return self._error(404, "Upload not found")
+
+        return self._error(405, "Method not allowed")
+
+    @staticmethod
+    def _content_length(scope) -> Optional[int]:
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                return int(value)
+        return None
+
+
+# Global token signer and sink instances; `app` is the standalone server entry point
+upload_token_signer = UploadTokenSigner()
+upload_sink = UploadSink()
+app = RequestLoggingMiddleware(upload_sink)
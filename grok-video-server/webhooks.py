@@ -0,0 +1,289 @@
+"""
+Completion webhooks for jobs submitted with a callback_url.
+
+When such a job reaches a terminal status, a trigger adds a row to the
+webhook_outbox table in the same transaction, so no finished job is missed even
+if the process dies right after. A background dispatcher claims due rows in
+batches, POSTs the job (the GET /v1/videos/generations/{id} body) to its URL
+over pooled keep-alive connections with at most WEBHOOK_CONCURRENCY in flight,
+and writes the outcomes back in one transaction per batch. Failed deliveries
+(network errors, timeouts, 408, 429 and 5xx) are retried with exponential
+backoff and jitter up to WEBHOOK_MAX_ATTEMPTS; other 4xx responses are final.
+
+Requests carry X-Webhook-Id (stable across retries, for de-duplication) and
+X-Webhook-Attempt. With WEBHOOK_SECRET set, X-Webhook-Signature is
+"sha256=" + HMAC-SHA256(secret, "{X-Webhook-Timestamp}.{body}").
+
+httpx is used when installed; otherwise http.client connections are pooled per
+origin and driven from a thread pool.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import http.client
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import config
+from job_queue import Job, job_queue
+from models import JobStatus
+from serialization import dumps
+from tracing import job_timings
+
+# Statuses that mean the receiver may succeed on a later attempt
+RETRY_STATUSES = {408, 425, 429, 500, 502, 503, 504}
+# Delivered or abandoned rows are kept this long for inspection
+DELIVERY_RETENTION_MS = 7 * 24 * 3600 * 1000
+PRUNE_INTERVAL_SECONDS = 3600
+# Idle keep-alive connections kept per origin by the stdlib client
+MAX_IDLE_PER_ORIGIN = 8
+
+
+def video_generation_body(job: Job, model: str = "grok") -> Dict[str, Any]:
+    """A job in the VideoGenerationResponse shape, as returned by the API and sent to callbacks"""
+    completed = job.status == JobStatus.COMPLETED
+    return {
+        "id": job.job_id,
+        "object": "videos.generation",
+        "created": job.created_at,
+        "model": model,
+        "status": job.status,
+        "video_url": f"http://localhost:{config.SERVER_PORT}/videos/{job.job_id}.mp4" if completed else None,
+        "error": job.error,
+        "timings": job_timings(job)
+    }
+
+
+class _StdlibClient:
+    """Keep-alive http.client connections per origin, used from a bounded thread pool"""
+
+    def __init__(self, max_workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='webhook')
+        self._idle: Dict[Tuple[str, str, Optional[int]], List[http.client.HTTPConnection]] = {}
+        self._lock = threading.Lock()
+
+    async def post(self, url: str, body: bytes, headers: Dict[str, str], timeout: float) -> Tuple[int, Optional[str]]:
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, self._post, url, body, headers, timeout
+        )
+
+    def _post(self, url: str, body: bytes, headers: Dict[str, str], timeout: float) -> Tuple[int, Optional[str]]:
+        parts = urlsplit(url)
+        origin = (parts.scheme, parts.hostname, parts.port)
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        while True:
+            with self._lock:
+                idle = self._idle.get(origin)
+                connection = idle.pop() if idle else None
+            reused = connection is not None
+            if connection is None:
+                connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+                connection = connection_class(parts.hostname, parts.port, timeout=timeout)
+            try:
+                connection.request('POST', target, body=body, headers=headers)
+                response = connection.getresponse()
+                response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused:
+                    # The receiver closed the idle connection; retry once on a fresh one
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            break
+
+        if response.will_close:
+            connection.close()
+        else:
+            with self._lock:
+                idle = self._idle.setdefault(origin, [])
+                if len(idle) < MAX_IDLE_PER_ORIGIN:
+                    idle.append(connection)
+                    connection = None
+            if connection is not None:
+                connection.close()
+        return response.status, response.getheader('Retry-After')
+
+    async def close(self):
+        with self._lock:
+            connections = [c for idle in self._idle.values() for c in idle]
+            self._idle.clear()
+        for connection in connections:
+            connection.close()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class _HttpxClient:
+    """httpx.AsyncClient with a connection pool sized to the delivery concurrency"""
+
+    def __init__(self, httpx, max_connections: int):
+        self._client = httpx.AsyncClient(limits=httpx.Limits(
+            max_connections=max_connections, max_keepalive_connections=max_connections
+        ))
+
+    async def post(self, url: str, body: bytes, headers: Dict[str, str], timeout: float) -> Tuple[int, Optional[str]]:
+        response = await self._client.post(url, content=body, headers=headers, timeout=timeout)
+        return response.status_code, response.headers.get('retry-after')
+
+    async def close(self):
+        await self._client.aclose()
+
+
+def _create_client(max_connections: int):
+    try:
+        import httpx
+    except ImportError:  # Without httpx, pooled stdlib connections in threads
+        return _StdlibClient(max_connections)
+    return _HttpxClient(httpx, max_connections)
+
+
+class WebhookDispatcher:
+    """
+    Delivers the webhook outbox from a background task.
+
+    Every server process runs one; claims are leased in the database, so each
+    delivery is attempted by one process at a time.
+    """
+
+    def __init__(self, queue=None):
+        self.queue = queue or job_queue
+        self._client = None
+        self._task: Optional[asyncio.Task] = None
+        self._in_flight: Set[asyncio.Task] = set()
+        self._results: List[Tuple] = []
+        self._stats = {"delivered": 0, "retried": 0, "failed": 0, "batches": 0}
+
+    async def start(self):
+        self._client = _create_client(config.WEBHOOK_CONCURRENCY)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        # Unfinished deliveries keep their lease and are retried after it expires
+        for task in list(self._in_flight):
+            task.cancel()
+        await asyncio.gather(*self._in_flight, return_exceptions=True)
+        if self._results:
+            await self.queue.record_webhook_results(self._results)
+            self._results = []
+        if self._client is not None:
+            await self._client.close()
+            self._client = None
+
+    async def _run(self):
+        pruned_at = 0.0
+        while True:
+            try:
+                free = config.WEBHOOK_CONCURRENCY - len(self._in_flight)
+                claimed = []
+                if free > 0:
+                    lease_ms = int((config.WEBHOOK_TIMEOUT_SECONDS + 30) * 1000)
+                    claimed = await self.queue.claim_webhook_deliveries(free, lease_ms)
+                    for delivery in claimed:
+                        task = asyncio.create_task(self._deliver(*delivery))
+                        self._in_flight.add(task)
+                        task.add_done_callback(self._in_flight.discard)
+                if self._results:
+                    # Outcomes that fail to save stay queued; at worst their lease expires and they are resent
+                    count = len(self._results)
+                    await self.queue.record_webhook_results(self._results[:count])
+                    del self._results[:count]
+                    self._stats["batches"] += 1
+                if time.monotonic() - pruned_at > PRUNE_INTERVAL_SECONDS:
+                    await self.queue.prune_webhook_deliveries(int(time.time() * 1000) - DELIVERY_RETENTION_MS)
+                    pruned_at = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Webhook dispatch failed: {e}")
+                claimed = []
+
+            # A full claim probably left more due: claim again as soon as a slot frees up
+            saturated = bool(claimed) and len(claimed) == free
+            if self._in_flight:
+                await asyncio.wait(self._in_flight, return_when=asyncio.FIRST_COMPLETED,
+                                   timeout=None if saturated else config.WEBHOOK_POLL_INTERVAL_SECONDS)
+            elif not saturated:
+                await asyncio.sleep(config.WEBHOOK_POLL_INTERVAL_SECONDS)
+
+    def _headers(self, delivery_id: int, attempt: int, body: bytes) -> Dict[str, str]:
+        headers = {
+            "Content-Type": "application/json",
+            "User-Agent": "grok-video-server-webhooks",
+            "X-Webhook-Id": str(delivery_id),
+            "X-Webhook-Attempt": str(attempt),
+        }
+        if config.WEBHOOK_SECRET:
+            timestamp = str(int(time.time()))
+            signature = hmac.new(config.WEBHOOK_SECRET.encode(), timestamp.encode() + b"." + body,
+                                 hashlib.sha256).hexdigest()
+            headers.update({"X-Webhook-Timestamp": timestamp, "X-Webhook-Signature": f"sha256={signature}"})
+        return headers
+
+    @staticmethod
+    def retry_delay_seconds(attempt: int, retry_after: Optional[str] = None) -> float:
+        """Exponential backoff with jitter after the given attempt; a longer Retry-After wins"""
+        delay = config.WEBHOOK_RETRY_BASE_SECONDS * 2 ** (attempt - 1)
+        delay = min(delay, config.WEBHOOK_RETRY_MAX_SECONDS) * random.uniform(0.5, 1.0)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(int(retry_after), config.WEBHOOK_RETRY_MAX_SECONDS))
+        return delay
+
+    async def _deliver(self, delivery_id: int, job_id: str, url: str, attempt: int):
+        now_ms = int(time.time() * 1000)
+        job = await self.queue.get_job(job_id)
+        if job is None:
+            self._results.append((delivery_id, None, now_ms, None, None, "Job no longer exists"))
+            self._stats["failed"] += 1
+            return
+
+        body = dumps(video_generation_body(job))
+        status, retry_after, error = None, None, None
+        try:
+            status, retry_after = await self._client.post(
+                url, body, self._headers(delivery_id, attempt, body), config.WEBHOOK_TIMEOUT_SECONDS
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+
+        now_ms = int(time.time() * 1000)
+        if status is not None and 200 <= status < 300:
+            self._results.append((delivery_id, now_ms, None, None, status, None))
+            self._stats["delivered"] += 1
+            return
+
+        error = error or f"HTTP {status}"
+        retryable = status is None or status in RETRY_STATUSES
+        if retryable and attempt < config.WEBHOOK_MAX_ATTEMPTS:
+            next_attempt_ms = now_ms + int(self.retry_delay_seconds(attempt, retry_after) * 1000)
+            self._results.append((delivery_id, None, None, next_attempt_ms, status, error))
+            self._stats["retried"] += 1
+        else:
+            self._results.append((delivery_id, None, now_ms, None, status, error))
+            self._stats["failed"] += 1
+
+    async def stats(self) -> Dict[str, Any]:
+        """Outcomes in this process plus the outbox backlog shared by all processes"""
+        backlog, oldest_ms = await self.queue.get_webhook_backlog()
+        return {
+            **self._stats,
+            "in_flight": len(self._in_flight),
+            "backlog": backlog,
+            "oldest_pending_age_ms": int(time.time() * 1000) - oldest_ms if oldest_ms else None,
+        }
+
+
+# Global webhook dispatcher instance
+webhook_dispatcher = WebhookDispatcher()